@@ -0,0 +1,228 @@
+"""
+Benchmark the hot paths of dataset_generation and dataset_splitter on the cpu
+
+Every benchmark is run repeats times and its median is kept, so a single run disturbed by other work does not move
+it. Results are saved as json so runs can be compared across commits, a run compared to a baseline fails when the
+median of any benchmark is slower than the median of the baseline by more than the regression threshold.
+
+python benchmarks.py --output results.json
+python benchmarks.py --output results.json --baseline baseline.json --threshold 0.2
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+SCRIPTS_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the scripts are run from their own folder and import their siblings directly
+sys.path.insert(0, os.path.join(SCRIPTS_FOLDER, 'dataset_generation'))
+sys.path.insert(0, os.path.join(SCRIPTS_FOLDER, 'dataset_splitter'))
+
+import numpy as np  # noqa: E402
+
+import dataset_generation  # noqa: E402
+import dataset_splitter  # noqa: E402
+
+DEFAULT_STEM_COUNTS = [10_000, 100_000, 1_000_000]
+
+
+def create_result(value: float, unit: str, higher_is_better: bool, repeats: int = 1) -> Dict:
+    return {'value': value, 'unit': unit, 'higher_is_better': higher_is_better, 'repeats': repeats}
+
+
+def time_median_of(function, repeats: int, setup=None) -> float:
+    """
+    Get the median of repeats runs of function in seconds
+    :param setup: Called before every run, outside of the timing
+    """
+    seconds = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    return statistics.median(seconds)
+
+
+def benchmark_shape_drawers(canvas_size=(640, 480), number_of_shapes: int = 200, repeats: int = 5) -> Dict:
+    """
+    Time add_shape_to_canvas for every entry of all_shapes on a reused canvas
+    """
+    random_state = np.random.RandomState(0)
+    canvas_color = dataset_generation.convert_hex_color_to_rgb(dataset_generation.colors['darkgreen'])
+    color = dataset_generation.convert_hex_color_to_rgb(dataset_generation.colors['gold'])
+    canvas = dataset_generation.create_blank_canvas(canvas_size, canvas_color)
+    results = {}
+    for shape in dataset_generation.all_shapes:
+        shape_sizes = dataset_generation.generate_shape_sizes(shape, number_of_shapes, random_state)
+        shape_centers = dataset_generation.generate_shape_centers(canvas_size, shape_sizes,
+                                                                  random_state=random_state)
+        placements = [(tuple(shape_center), tuple(shape_size))
+                      for shape_center, shape_size in zip(shape_centers.tolist(), shape_sizes.tolist())]
+
+        def draw_shapes():
+            for shape_center, shape_size in placements:
+                dataset_generation.add_shape_to_canvas(canvas, shape, shape_center=shape_center,
+                                                       shape_size=shape_size, color=color, stroke_width=4)
+
+        seconds = time_median_of(draw_shapes, repeats)
+        results[f'draw_{shape}'] = create_result(seconds / number_of_shapes * 1e6, 'us/shape', False, repeats)
+    return results
+
+
+def benchmark_generate_images(canvas_size=(640, 480), number_of_images_per_shape: int = 50,
+                              repeats: int = 5) -> Dict:
+    """
+    Time generate_images end to end, encoding and writing the files included
+    """
+    colors_to_use = ['darkgreen', 'gold', 'aqua']
+    number_of_images = number_of_images_per_shape * len(dataset_generation.all_shapes)
+    with tempfile.TemporaryDirectory(prefix='benchmark_generate_images_') as generated_images_folder:
+        def generate():
+            with contextlib.redirect_stdout(io.StringIO()):
+                dataset_generation.generate_images(canvas_size, colors_to_use, generated_images_folder,
+                                                   number_of_images_per_shape,
+                                                   random_state=np.random.RandomState(0))
+
+        seconds = time_median_of(generate, repeats)
+    return {'generate_images': create_result(number_of_images / seconds, 'images/s', True, repeats)}
+
+
+def create_synthetic_tree(tree_folder: str, number_of_stems: int, stems_per_directory: int = 1000) -> str:
+    """
+    Create a training_data folder of empty darknet samples, 1 in 10 stems misses its .json
+    The tree is reused when it already exists in tree_folder
+    :return: the path of the training_data folder
+    """
+    training_data_folder = os.path.join(tree_folder, f'stems_{number_of_stems}', 'training_data')
+    complete_marker = os.path.join(tree_folder, f'stems_{number_of_stems}', 'complete')
+    if os.path.exists(complete_marker):
+        return training_data_folder
+    if os.path.exists(training_data_folder):
+        shutil.rmtree(training_data_folder)
+    for first_stem in range(0, number_of_stems, stems_per_directory):
+        directory = os.path.join(training_data_folder, f'folder_{first_stem // stems_per_directory:05d}')
+        os.makedirs(directory)
+        for stem in range(first_stem, min(first_stem + stems_per_directory, number_of_stems)):
+            extensions = ['.jpg', '.txt'] if stem % 10 == 0 else ['.jpg', '.txt', '.json']
+            for extension in extensions:
+                open(os.path.join(directory, f'image_{stem}{extension}'), 'wb').close()
+    open(complete_marker, 'wb').close()
+    return training_data_folder
+
+
+def benchmark_splitter(tree_folder: str, stem_counts: List[int], fraction: float = 0.1, repeats: int = 5) -> Dict:
+    """
+    Time filter_valid_files and get_fraction_of_dataset, with and without streaming, on synthetic trees of every
+    size in stem_counts
+    """
+    results = {}
+    for number_of_stems in stem_counts:
+        training_data_folder = create_synthetic_tree(tree_folder, number_of_stems)
+        files = dataset_splitter.get_files_from_folder(training_data_folder)
+        seconds = time_median_of(lambda: dataset_splitter.filter_valid_files(files), repeats)
+        results[f'filter_valid_files_{number_of_stems}'] = create_result(seconds, 's', False, repeats)
+        del files
+
+        directory_to_copy_to = os.path.join(tree_folder, f'stems_{number_of_stems}', 'split-training-data')
+        for name, streaming in [('get_fraction_of_dataset', False), ('get_fraction_of_dataset_streaming', True)]:
+            def get_fraction_of_dataset():
+                with contextlib.redirect_stdout(io.StringIO()):
+                    dataset_splitter.get_fraction_of_dataset(training_data_folder, directory_to_copy_to, fraction,
+                                                             streaming=streaming, seed=0)
+
+            # every run starts from an empty destination like the first one
+            seconds = time_median_of(get_fraction_of_dataset, repeats,
+                                     setup=lambda: shutil.rmtree(directory_to_copy_to, ignore_errors=True))
+            results[f'{name}_{number_of_stems}'] = create_result(seconds, 's', False, repeats)
+        shutil.rmtree(directory_to_copy_to)
+    return results
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=SCRIPTS_FOLDER, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def find_regressions(results: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """
+    Compare the median of every benchmark of results found in baseline to its median in the baseline
+    :param threshold: The fraction a benchmark may be slower than its baseline, 0.2 allows 20% slower
+    :return: a description of every benchmark slower than allowed
+    """
+    regressions = []
+    for name, result in results['benchmarks'].items():
+        if name not in baseline['benchmarks']:
+            continue
+        baseline_value = baseline['benchmarks'][name]['value']
+        value = result['value']
+        if result['higher_is_better']:
+            slower = value < baseline_value * (1 - threshold)
+        else:
+            slower = value > baseline_value * (1 + threshold)
+        if slower:
+            regressions.append(f'{name}: {value:.4g} {result["unit"]} vs {baseline_value:.4g} in the baseline')
+    return regressions
+
+
+def run_benchmarks(stem_counts: List[int], tree_folder: str, repeats: int = 5) -> Dict:
+    benchmarks = {}
+    print('Benchmarking shape drawers')
+    benchmarks.update(benchmark_shape_drawers(repeats=repeats))
+    print('Benchmarking generate_images')
+    benchmarks.update(benchmark_generate_images(repeats=repeats))
+    print(f'Benchmarking the splitter on {stem_counts} stems')
+    benchmarks.update(benchmark_splitter(tree_folder, stem_counts, repeats=repeats))
+    return {
+        'commit': get_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'benchmarks': benchmarks,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark dataset_generation and dataset_splitter')
+    parser.add_argument('--output', default='benchmark_results.json', help='json file the results are saved to')
+    parser.add_argument('--baseline', help='json results of an earlier run to compare to')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='fraction a benchmark may be slower than the baseline before the run fails')
+    parser.add_argument('--stem-counts', type=int, nargs='+', default=DEFAULT_STEM_COUNTS,
+                        help='sizes of the synthetic trees the splitter is benchmarked on')
+    parser.add_argument('--tree-folder', default=os.path.join(tempfile.gettempdir(), 'dataset_benchmark_trees'),
+                        help='folder the synthetic trees are created in and reused from')
+    parser.add_argument('--repeats', type=int, default=5, help='runs of every benchmark, the median is kept')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.stem_counts, args.tree_folder, args.repeats)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    for name, result in results['benchmarks'].items():
+        print(f'{name}: {result["value"]:.4g} {result["unit"]}')
+    print(f'Saved the results to {args.output}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.threshold)
+        if regressions:
+            print(f'{len(regressions)} benchmarks regressed by more than {args.threshold:.0%}:')
+            for regression in regressions:
+                print(f'  {regression}')
+            sys.exit(1)
+        print(f'No benchmark regressed by more than {args.threshold:.0%}')
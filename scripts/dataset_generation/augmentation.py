@@ -0,0 +1,282 @@
+"""
+Rotate, scale, flip and color jitter shapes while they are rendered
+
+Every shape is described by its outline in a unit frame centered on (0, 0): the vertices of the polygons, the end
+points of the line and the arrow, and the axes of the circle and the ellipse.
+The affine matrices of a batch are drawn at once and applied to the outlines of the whole batch with numpy, then the
+analytic bounding box of every shape, the min and max of its transformed outline or the extent of the rotated
+ellipse padded by half the stroke for the shapes that are stroked, keeps the shape within the canvas.
+Shapes are drawn with sub-pixel coordinates. cv2 rasterizes their edges up to a pixel and a half away from the
+analytic box, so the label is the extent of the pixels of the region around the box that differ from the canvas on a
+channel where the shape color does: the shape is drawn once, without anti-aliasing, on a canvas of a single color.
+"""
+import math
+from typing import NamedTuple, Tuple
+
+import cv2
+import numpy as np
+
+from dataset_generation import all_shapes, shape_geometries, convert_bounding_boxes_to_darknet
+
+# fractional bits of the coordinates passed to cv2
+SHIFT = 4
+SHIFT_SCALE = 1 << SHIFT
+
+# pixels the region holding a shape extends past its analytic box, cv2 draws at most a pixel and a half past it
+REGION_MARGIN = 3
+
+# the tip of cv2.arrowedLine, relative to the length of the arrow and at 45 degrees from it
+ARROW_TIP_LENGTH = 0.1
+ARROW_TIP_ANGLE = math.pi / 4
+
+# outlines in a unit frame centered on (0, 0), they are scaled by the shape size
+unit_outlines = {
+    'rectangle': np.array([[-0.5, -0.5], [0.5, -0.5], [0.5, 0.5], [-0.5, 0.5]]),
+    'square': np.array([[-0.5, -0.5], [0.5, -0.5], [0.5, 0.5], [-0.5, 0.5]]),
+    'triangle': shape_geometries['triangle'].vertices - 0.5,
+    # the unit star has a radius of 1 and a star of size w has a radius of w // 2
+    'star': shape_geometries['star'].vertices * 0.5,
+    'line': np.array([[-0.5, -0.5], [0.5, 0.5]]),
+    'arrow': np.array([[-0.5, -0.5], [0.5, 0.5]]),
+}
+
+# shapes whose outline is stroked, their box is padded by half the stroke
+stroked_shapes = {'rectangle', 'square', 'triangle', 'line', 'arrow', 'circle'}
+
+
+class AugmentationParameters(NamedTuple):
+    # rotations are drawn uniformly in [-max_rotation, max_rotation] degrees
+    max_rotation: float = 180.0
+    # scales are drawn uniformly in [min_scale, max_scale]
+    min_scale: float = 0.75
+    max_scale: float = 1.5
+    horizontal_flip_probability: float = 0.5
+    vertical_flip_probability: float = 0.0
+    # every channel of the shape and canvas colors moves by up to color_jitter
+    color_jitter: int = 24
+
+
+class AffineTransforms(NamedTuple):
+    # (N, 2, 2) linear part of the transform of every shape
+    matrices: np.ndarray
+    # (N,) rotation in degrees and scale, the ellipses are drawn from them since a flip leaves an ellipse unchanged
+    rotations: np.ndarray
+    scales: np.ndarray
+
+
+def generate_affine_transforms(number_of_shapes: int, augmentation: AugmentationParameters,
+                               random_state: np.random.RandomState = None) -> AffineTransforms:
+    """
+    Draw the rotation, scale and flips of number_of_shapes shapes at once
+    :param random_state: The random state to draw from, defaults to the global numpy random state
+    """
+    if random_state is None:
+        random_state = np.random
+    rotations = random_state.uniform(-augmentation.max_rotation, augmentation.max_rotation, number_of_shapes)
+    scales = random_state.uniform(augmentation.min_scale, augmentation.max_scale, number_of_shapes)
+    flip_x = np.where(random_state.random_sample(number_of_shapes) < augmentation.horizontal_flip_probability, -1, 1)
+    flip_y = np.where(random_state.random_sample(number_of_shapes) < augmentation.vertical_flip_probability, -1, 1)
+
+    radians = np.radians(rotations)
+    cos, sin = np.cos(radians) * scales, np.sin(radians) * scales
+    # rotation @ scale @ flip
+    matrices = np.empty((number_of_shapes, 2, 2), np.float64)
+    matrices[:, 0, 0] = cos * flip_x
+    matrices[:, 0, 1] = -sin * flip_y
+    matrices[:, 1, 0] = sin * flip_x
+    matrices[:, 1, 1] = cos * flip_y
+    return AffineTransforms(matrices, rotations, scales)
+
+
+def transform_outlines(shape: str, shape_sizes: np.ndarray, matrices: np.ndarray) -> np.ndarray:
+    """
+    Scale the unit outline of a shape by every shape size and apply the matrices
+    :return: the (N, V, 2) outlines relative to the center of every shape
+    """
+    outlines = unit_outlines[shape][np.newaxis] * shape_sizes[:, np.newaxis, :]
+    return np.einsum('nij,nvj->nvi', matrices, outlines)
+
+
+def get_arrow_tips(outlines: np.ndarray) -> np.ndarray:
+    """
+    Get the (N, 2, 2) end points of the two lines of the tip cv2.arrowedLine draws for every (start, end) outline
+    """
+    start, end = outlines[:, 0], outlines[:, 1]
+    tip_size = np.linalg.norm(start - end, axis=1) * ARROW_TIP_LENGTH
+    angle = np.arctan2(start[:, 1] - end[:, 1], start[:, 0] - end[:, 0])
+    tips = np.empty((len(outlines), 2, 2), np.float64)
+    for i, tip_angle in enumerate([angle + ARROW_TIP_ANGLE, angle - ARROW_TIP_ANGLE]):
+        tips[:, i, 0] = end[:, 0] + tip_size * np.cos(tip_angle)
+        tips[:, i, 1] = end[:, 1] + tip_size * np.sin(tip_angle)
+    return tips
+
+
+def get_ellipse_axes(shape: str, shape_sizes: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    """
+    Get the (N, 2) half axes of circles and ellipses once scaled
+    """
+    if shape == 'circle':
+        radius = (shape_sizes[:, 0] // 2) * scales
+        return np.stack([radius, radius], axis=1)
+    return shape_sizes / 2 * scales[:, np.newaxis]
+
+
+def get_relative_tight_boxes(shape: str, shape_sizes: np.ndarray, transforms: AffineTransforms,
+                             stroke_width: int):
+    """
+    Get the tight (x_min, y_min, x_max, y_max) of every transformed shape relative to its center
+    :return: the (N, 4) boxes and the (N, V, 2) outlines, None for circles and ellipses
+    """
+    if shape in {'circle', 'ellipse'}:
+        axes = get_ellipse_axes(shape, shape_sizes, transforms.scales)
+        radians = np.radians(transforms.rotations)
+        cos, sin = np.cos(radians), np.sin(radians)
+        # extent of an ellipse with half axes (a, b) rotated by the angle
+        half_width = np.sqrt((axes[:, 0] * cos) ** 2 + (axes[:, 1] * sin) ** 2)
+        half_height = np.sqrt((axes[:, 0] * sin) ** 2 + (axes[:, 1] * cos) ** 2)
+        boxes = np.stack([-half_width, -half_height, half_width, half_height], axis=1)
+        outlines = None
+    else:
+        outlines = transform_outlines(shape, shape_sizes, transforms.matrices)
+        extent_points = outlines
+        if shape == 'arrow':
+            extent_points = np.concatenate([outlines, get_arrow_tips(outlines)], axis=1)
+        boxes = np.concatenate([extent_points.min(axis=1), extent_points.max(axis=1)], axis=1)
+    if shape in stroked_shapes:
+        boxes[:, :2] -= stroke_width / 2
+        boxes[:, 2:] += stroke_width / 2
+    return boxes, outlines
+
+
+def generate_centers_within_canvas(canvas_size: Tuple[int, int], relative_boxes: np.ndarray,
+                                   canvas_padding: int = 20, random_state: np.random.RandomState = None):
+    """
+    Draw the center of every shape so its box stays within the padding of the canvas
+    Shapes too large for the canvas are centered on it
+    """
+    if random_state is None:
+        random_state = np.random
+    canvas_extent = np.array(canvas_size, np.float64)
+    low = canvas_padding - relative_boxes[:, :2]
+    high = canvas_extent - canvas_padding - relative_boxes[:, 2:]
+    too_large = high < low
+    low[too_large] = high[too_large] = np.broadcast_to(canvas_extent / 2, low.shape)[too_large]
+    return low + random_state.random_sample(low.shape) * (high - low)
+
+
+def jitter_colors(color: Tuple[int, int, int], number_of_colors: int, color_jitter: int,
+                  random_state: np.random.RandomState = None) -> np.ndarray:
+    """
+    Get (N, 3) colors moved by up to color_jitter on every channel
+    """
+    if random_state is None:
+        random_state = np.random
+    jitter = random_state.randint(-color_jitter, color_jitter + 1, size=(number_of_colors, 3))
+    return np.clip(np.array(color) + jitter, 0, 255)
+
+
+def to_fixed_point(points: np.ndarray) -> np.ndarray:
+    return np.rint(points * SHIFT_SCALE).astype(np.int32)
+
+
+def get_drawing_regions(canvas_size: Tuple[int, int], boxes: np.ndarray) -> np.ndarray:
+    """
+    Get the (N, 4) integer (x_min, y_min, x_max, y_max) regions of the canvas holding every pixel drawn for the boxes
+    """
+    width, height = canvas_size
+    regions = np.concatenate([np.floor(boxes[:, :2]) - REGION_MARGIN, np.ceil(boxes[:, 2:]) + 1 + REGION_MARGIN],
+                             axis=1)
+    return np.clip(regions, 0, [width, height, width, height]).astype(np.int64)
+
+
+def draw_augmented_shape(image: np.ndarray, shape: str, color, stroke_width: int, fixed_points: np.ndarray,
+                         fixed_axes: Tuple[int, int] = None, rotation: float = 0.0):
+    """
+    Draw a shape from its fixed point coordinates, the center of circles and ellipses or the outline of the others
+    """
+    if shape in {'circle', 'ellipse'}:
+        center = tuple(fixed_points[0].tolist())
+        if shape == 'circle':
+            cv2.ellipse(image, center, fixed_axes, rotation, 0, 360, color, stroke_width, cv2.LINE_8, SHIFT)
+        cv2.ellipse(image, center, fixed_axes, rotation, 0, 360, color, -1, cv2.LINE_8, SHIFT)
+    elif shape in {'line', 'arrow'}:
+        start, end = (tuple(point) for point in fixed_points.tolist())
+        if shape == 'line':
+            cv2.line(image, start, end, color, stroke_width, cv2.LINE_8, SHIFT)
+        else:
+            cv2.arrowedLine(image, start, end, color, stroke_width, cv2.LINE_8, SHIFT, ARROW_TIP_LENGTH)
+    else:
+        if shape != 'star':
+            cv2.polylines(image, [fixed_points], True, color, stroke_width, cv2.LINE_8, SHIFT)
+        cv2.fillPoly(image, [fixed_points], color, cv2.LINE_8, SHIFT)
+
+
+def render_augmented_shape_batch(canvas_size: Tuple[int, int], shape: str, shape_sizes: np.ndarray,
+                                 canvas_color=(0, 0, 0), color=(0, 0, 0), stroke_width=4,
+                                 augmentation: AugmentationParameters = AugmentationParameters(),
+                                 draw_bounding_box=False, bounding_box_color=(0, 0, 0),
+                                 random_state: np.random.RandomState = None, canvases: np.ndarray = None,
+                                 canvas_padding: int = 20):
+    """
+    Render one randomly rotated, scaled, flipped and color jittered shape per canvas
+    The centers are drawn once the transforms are known so every tight box fits in the padding of the canvas
+    :return: the canvases, the (N, 4) tight bounding boxes of the drawn pixels and the (N, 4) darknet boxes
+    """
+    if shape not in all_shapes:
+        raise ValueError('shape must be one of: {}'.format(all_shapes))
+    if random_state is None:
+        random_state = np.random
+    number_of_images = len(shape_sizes)
+    shape_sizes = np.asarray(shape_sizes, np.float64)
+    width, height = canvas_size
+    if canvases is None or canvases.shape[0] < number_of_images:
+        # every canvas is filled with its own jittered color below
+        canvases = np.empty((number_of_images, height, width, 3), np.uint8)
+    canvases = canvases[:number_of_images]
+
+    transforms = generate_affine_transforms(number_of_images, augmentation, random_state)
+    relative_boxes, outlines = get_relative_tight_boxes(shape, shape_sizes, transforms, stroke_width)
+    centers = generate_centers_within_canvas(canvas_size, relative_boxes, canvas_padding, random_state)
+    canvas_colors = jitter_colors(canvas_color, number_of_images, augmentation.color_jitter, random_state)
+    shape_colors = jitter_colors(color, number_of_images, augmentation.color_jitter, random_state)
+    # a BGR channel where the shape color differs from the canvas color, the first one when they are the same
+    label_channels = np.argmax(canvas_colors[:, ::-1] != shape_colors[:, ::-1], axis=1).tolist()
+    # BGR as plain tuples for cv2
+    canvas_colors = [tuple(value) for value in canvas_colors[:, ::-1].tolist()]
+    shape_colors = [tuple(value) for value in shape_colors[:, ::-1].tolist()]
+
+    analytic_boxes = relative_boxes + np.tile(centers, 2)
+    if shape in {'circle', 'ellipse'}:
+        fixed_points = to_fixed_point(centers)[:, np.newaxis, :]
+        fixed_axes = [tuple(axes) for axes in to_fixed_point(get_ellipse_axes(shape, shape_sizes,
+                                                                               transforms.scales)).tolist()]
+        rotations = transforms.rotations.tolist()
+    else:
+        fixed_points = to_fixed_point(outlines + centers[:, np.newaxis, :])
+        fixed_axes = [None] * number_of_images
+        rotations = [0.0] * number_of_images
+    regions = get_drawing_regions(canvas_size, analytic_boxes)
+
+    tight_boxes = np.clip(analytic_boxes, 0, [width, height, width, height])
+    for i, (x_min, y_min, x_max, y_max) in enumerate(regions.tolist()):
+        canvas = canvases[i]
+        canvas[:] = canvas_colors[i]
+        draw_augmented_shape(canvas, shape, shape_colors[i], stroke_width, fixed_points[i], fixed_axes[i],
+                             rotations[i])
+        # a shape outside of the canvas, or of the color of the canvas, keeps its analytic box clipped to the canvas
+        if x_max <= x_min or y_max <= y_min:
+            continue
+        channel = label_channels[i]
+        drawn = canvas[y_min:y_max, x_min:x_max, channel] != canvas_colors[i][channel]
+        x, y, w, h = cv2.boundingRect(drawn.view(np.uint8))
+        if w and h:
+            tight_boxes[i] = x_min + x, y_min + y, x_min + x + w, y_min + y + h
+
+    if draw_bounding_box:
+        for canvas, tight_box in zip(canvases, np.rint(tight_boxes).astype(np.int64).tolist()):
+            cv2.rectangle(canvas, (tight_box[0], tight_box[1]), (tight_box[2], tight_box[3]), bounding_box_color, 2)
+
+    # with a box size instead of the shape size the darknet center is the center of the box
+    darknet_boxes = convert_bounding_boxes_to_darknet(tight_boxes, tight_boxes[:, 2:] - tight_boxes[:, :2],
+                                                      canvas_size)
+    return canvases, tight_boxes, darknet_boxes
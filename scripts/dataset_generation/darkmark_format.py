@@ -0,0 +1,117 @@
+"""
+Write the DarkMark json of generated images so they can be split and trained on without a pass through DarkMark
+
+The json holds the size of the image and one mark per object, with its class, its rect and the 4 corners of the rect,
+both relative to the image and in pixels, like the files DarkMark saves next to the images it reviewed.
+The marks of a whole batch are converted at once with numpy and formatted from templates instead of json.dumps,
+the output is the same as json.dumps(..., indent='\t', sort_keys=True).
+"""
+import json
+import time
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+DARKMARK_VERSION = '1.5.30-1'
+
+# DarkMark saves the zoom of its window, generated images were never displayed
+DARKMARK_SCALE = 1.0
+
+_POINT_TEMPLATE = ('\t\t\t\t{\n'
+                   '\t\t\t\t\t"int_x": %d,\n'
+                   '\t\t\t\t\t"int_y": %d,\n'
+                   '\t\t\t\t\t"x": %r,\n'
+                   '\t\t\t\t\t"y": %r\n'
+                   '\t\t\t\t}')
+
+_MARK_TEMPLATE = ('\t\t{\n'
+                  '\t\t\t"class_idx": %d,\n'
+                  '\t\t\t"name": %s,\n'
+                  '\t\t\t"points": [\n'
+                  + ',\n'.join([_POINT_TEMPLATE] * 4) + '\n'
+                  '\t\t\t],\n'
+                  '\t\t\t"rect": {\n'
+                  '\t\t\t\t"h": %r,\n'
+                  '\t\t\t\t"int_h": %d,\n'
+                  '\t\t\t\t"int_w": %d,\n'
+                  '\t\t\t\t"int_x": %d,\n'
+                  '\t\t\t\t"int_y": %d,\n'
+                  '\t\t\t\t"w": %r,\n'
+                  '\t\t\t\t"x": %r,\n'
+                  '\t\t\t\t"y": %r\n'
+                  '\t\t\t}\n'
+                  '\t\t}')
+
+_IMAGE_TEMPLATE = ('{\n'
+                   '\t"completely_empty": %s,\n'
+                   '\t"image": {\n'
+                   '\t\t"height": %d,\n'
+                   '\t\t"scale": %r,\n'
+                   '\t\t"width": %d\n'
+                   '\t},\n'
+                   '\t"mark": %s,\n'
+                   '\t"timestamp": %d,\n'
+                   '\t"version": %s\n'
+                   '}\n')
+
+
+def convert_darknet_boxes_to_darkmark(darknet_boxes: np.ndarray, canvas_size: Tuple[int, int]):
+    """
+    Convert (N, 4) darknet boxes to the (N, 4) relative corners (x1, y1, x2, y2) and pixel corners of DarkMark
+    Pixel corners are inclusive, so the int_w of a rect is x2 - x1 + 1
+    """
+    canvas_width, canvas_height = canvas_size
+    darknet_boxes = np.asarray(darknet_boxes, np.float64).reshape(-1, 4)
+    corners = np.empty((len(darknet_boxes), 4), np.float64)
+    corners[:, :2] = darknet_boxes[:, :2] - darknet_boxes[:, 2:] / 2
+    corners[:, 2:] = darknet_boxes[:, :2] + darknet_boxes[:, 2:] / 2
+    int_corners = np.rint(corners * (canvas_width, canvas_height, canvas_width, canvas_height)).astype(np.int64)
+    return corners, int_corners
+
+
+def _format_mark(object_class: int, name: str, corners: List[float], int_corners: List[int]) -> str:
+    x1, y1, x2, y2 = corners
+    int_x1, int_y1, int_x2, int_y2 = int_corners
+    return _MARK_TEMPLATE % (
+        object_class, name,
+        int_x1, int_y1, x1, y1,
+        int_x2, int_y1, x2, y1,
+        int_x2, int_y2, x2, y2,
+        int_x1, int_y2, x1, y2,
+        y2 - y1, int_y2 - int_y1 + 1, int_x2 - int_x1 + 1, int_x1, int_y1, x2 - x1, x1, y1)
+
+
+def _format_image(canvas_size: Tuple[int, int], marks: List[str], timestamp: int) -> str:
+    canvas_width, canvas_height = canvas_size
+    mark = '[\n' + ',\n'.join(marks) + '\n\t]' if marks else '[]'
+    return _IMAGE_TEMPLATE % ('false' if marks else 'true', canvas_height, DARKMARK_SCALE, canvas_width, mark,
+                              timestamp, json.dumps(DARKMARK_VERSION))
+
+
+def format_darkmark_json(canvas_size: Tuple[int, int], object_classes: Sequence[int], names: Sequence[str],
+                         darknet_boxes: np.ndarray, timestamp: int = None) -> str:
+    """
+    Format the json of a single image holding one mark per darknet box
+    :param timestamp: The unix time of the marks, defaults to now
+    """
+    if timestamp is None:
+        timestamp = int(time.time())
+    corners, int_corners = convert_darknet_boxes_to_darkmark(darknet_boxes, canvas_size)
+    marks = [_format_mark(object_class, json.dumps(name), box_corners, box_int_corners)
+             for object_class, name, box_corners, box_int_corners in zip(object_classes, names, corners.tolist(),
+                                                                          int_corners.tolist())]
+    return _format_image(canvas_size, marks, timestamp)
+
+
+def format_darkmark_jsons(canvas_size: Tuple[int, int], object_class: int, name: str, darknet_boxes: np.ndarray,
+                          timestamp: int = None) -> List[str]:
+    """
+    Format the json of every image of a batch holding a single object of the same class
+    :param timestamp: The unix time of the marks, defaults to now
+    """
+    if timestamp is None:
+        timestamp = int(time.time())
+    corners, int_corners = convert_darknet_boxes_to_darkmark(darknet_boxes, canvas_size)
+    name = json.dumps(name)
+    return [_format_image(canvas_size, [_format_mark(object_class, name, box_corners, box_int_corners)], timestamp)
+            for box_corners, box_int_corners in zip(corners.tolist(), int_corners.tolist())]
@@ -1,13 +1,24 @@
 """
 Generate a dataset for detecting shapes
 """
+import functools
 import os
-import random
-from typing import Tuple, List
+import sys
+import time
+from typing import Tuple, List, NamedTuple
 
 import cv2
 import numpy as np
 
+# the instrumentation shared by the scripts sits in its own folder next to this one
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'instrumentation'))
+
+from darkmark_format import format_darkmark_json, format_darkmark_jsons
+from image_writer import ImageWriter
+from instrumentation import get_instrumentation, report_run
+from run_manifest import RunManifest
+from shard_format import ShardWriter, write_shard_manifest
+
 all_shapes = ['ellipse', 'circle', 'square', 'rectangle', 'line', 'arrow', 'triangle', 'star']
 
 shape_to_index = dict(zip(all_shapes, range(len(all_shapes))))
@@ -49,6 +60,21 @@ def create_blank_canvas(canvas_shape: Tuple[int, int], color: Tuple[int, int, in
     return canvas
 
 
+def create_blank_canvases(canvas_shape: Tuple[int, int], number_of_canvases: int,
+                          color: Tuple[int, int, int] = (0, 0, 0), canvases: np.ndarray = None):
+    """
+    Create a batch of blank canvases with color as a single (N, H, W, 3) array
+    If canvases is given it is reused instead of allocating a new array
+    """
+    width, height = canvas_shape
+    if canvases is None or canvases.shape[0] < number_of_canvases:
+        canvases = np.empty((number_of_canvases, height, width, 3), np.uint8)
+    canvases = canvases[:number_of_canvases]
+    # convert color tuple to BGR, the assignment broadcasts the color over every canvas at once
+    canvases[:] = color[::-1]
+    return canvases
+
+
 def line_intersection(line1: List[Tuple[int, int]], line2: List[Tuple[int, int]]):
     """
     Find the intersection of two lines
@@ -80,25 +106,8 @@ def add_shape_to_canvas(canvas, shape: str, shape_center: Tuple[int, int] = (100
     # convert color tuple to BGR
     color = color[::-1]
 
-    if shape not in all_shapes:
-        raise ValueError('shape must be one of: {}'.format(all_shapes))
-    if shape == 'circle':
-        canvas, max_bounding_box = add_circle_to_canvas(canvas, color, shape_center, shape_size, stroke_width)
-    elif shape == 'ellipse':
-        canvas, max_bounding_box = add_ellipse_to_canvas(canvas, color, shape_center, shape_size)
-    elif shape in {'rectangle', 'square'}:
-        canvas, max_bounding_box = add_rectangle_to_canvas(canvas, color, shape_center, shape_size, stroke_width)
-    elif shape == 'line':
-        canvas, max_bounding_box = add_line_to_canvas(canvas, color, shape_center, shape_size, stroke_width)
-    elif shape == 'arrow':
-        canvas, max_bounding_box = add_arrow_to_canvas(canvas, color, shape_center, shape_size, stroke_width)
-    elif shape == 'triangle':
-        canvas, max_bounding_box = add_triangle_to_canvas(canvas, color, shape_center, shape_size, stroke_width)
-    elif shape == 'star':
-        radius = shape_size[0] // 2
-        canvas, max_bounding_box = add_star_to_canvas(canvas, color, shape_center, radius)
-    else:
-        raise ValueError(f'Implemented shape {shape} cannot be drawn')
+    draw_shape = get_shape_drawer(shape)
+    canvas, max_bounding_box = draw_shape(canvas, color, shape_center, shape_size, stroke_width)
 
     stroke_width_padding = stroke_width * 2
 
@@ -117,6 +126,35 @@ def add_shape_to_canvas(canvas, shape: str, shape_center: Tuple[int, int] = (100
     return canvas, max_bounding_box
 
 
+def get_shape_drawer(shape: str, use_mask_cache: bool = False):
+    """
+    Get the function drawing a shape, every drawer takes (canvas, color, shape_center, shape_size, stroke_width)
+    The color passed to the drawer must already be BGR
+    :param use_mask_cache: Paste masks cached by rasterize_shape_mask instead of drawing the shape every time
+    """
+    if shape not in all_shapes:
+        raise ValueError('shape must be one of: {}'.format(all_shapes))
+    if use_mask_cache:
+        return functools.partial(add_shape_mask_to_canvas, shape=shape)
+    if shape == 'circle':
+        return add_circle_to_canvas
+    elif shape == 'ellipse':
+        return lambda canvas, color, shape_center, shape_size, stroke_width: add_ellipse_to_canvas(
+            canvas, color, shape_center, shape_size)
+    elif shape in {'rectangle', 'square'}:
+        return add_rectangle_to_canvas
+    elif shape == 'line':
+        return add_line_to_canvas
+    elif shape == 'arrow':
+        return add_arrow_to_canvas
+    elif shape == 'triangle':
+        return add_triangle_to_canvas
+    elif shape == 'star':
+        return lambda canvas, color, shape_center, shape_size, stroke_width: add_star_to_canvas(
+            canvas, color, shape_center, shape_size[0] // 2)
+    raise ValueError(f'Implemented shape {shape} cannot be drawn')
+
+
 def add_line_to_canvas(canvas, color, shape_center, shape_size, stroke_width):
     x1, y1 = shape_center
     x2, y2 = shape_center[0] + shape_size[0], shape_center[1] + shape_size[1]
@@ -171,122 +209,209 @@ def add_arrow_to_canvas(canvas: np.ndarray, color: Tuple[int, int, int], shape_c
 
 def add_triangle_to_canvas(canvas: np.ndarray, color: Tuple[int, int, int], shape_center: Tuple[int, int],
                            shape_size: Tuple[int, int], stroke_width: int):
-    x1, y1 = shape_center
-    x2, y2 = shape_center[0] + shape_size[0], shape_center[1] + shape_size[1]
-    x3, y3 = shape_center[0] + shape_size[0] / 2, shape_center[1] + shape_size[1]
-    pts = np.array([[x1, y1], [x2, y2], [x3, y3]], np.int32)
-    pts = pts.reshape((-1, 1, 2))
+    triangle_geometry = shape_geometries['triangle']
+    x, y = shape_center
+    w, h = shape_size
+    # truncating the scaled vertices before translating them matches truncating the translated ones
+    pts = np.array([(int(vertex_x * w) + x, int(vertex_y * h) + y)
+                    for vertex_x, vertex_y in triangle_geometry.vertex_list], np.int32)
     canvas = cv2.polylines(canvas, [pts], True, color, stroke_width)
     # Fill the triangle with the color
     canvas = cv2.fillPoly(canvas, [pts], color)
-    max_bounding_box = (x1, y1, x2, int(max(y2, y3)))
+    x_min, y_min, x_max, y_max = triangle_geometry.bounding_box
+    max_bounding_box = (x + int(x_min * w), y + int(y_min * h), x + int(x_max * w), y + int(y_max * h))
     return canvas, max_bounding_box
 
 
-def add_star_to_canvas(canvas: np.ndarray, color: Tuple[int, int, int], center: Tuple[int, int], radius: int):
+def create_unit_pentagram_points() -> np.ndarray:
     """
-    Add a star to the canvas
+    Create the top center, bottom right, middle left, middle right and bottom left points of the star with a radius
+    of 1 centered on (0, 0)
     """
-    # convert color tuple to BGR
-    color = color[::-1]
-
-    # # Draw a blue circle at the center
-    # cv2.circle(canvas, center, radius, (255,0,0), -1)
-
     # The following code is adopted from https://programmerall.com/article/22831425530/
-    # This code was found on a few pages likely a result of pages copying each other
-    # That being said, I have no idea what the code does
-
-    # Draw a yellow pentagon star
     # The first step by means of a rotation angle to find five vertices
-
     # Explain the following line of code:
     # https://stackoverflow.com/a/15015748/7998814
     phi = 4 * np.pi / 5
     rotations = [[[np.cos(i * phi), -np.sin(i * phi)], [i * np.sin(phi), np.cos(i * phi)]] for i in range(1, 5)]
-    pentagram = np.array([[[[0, -1]] + [np.dot(m, (0, -1)) for m in rotations]]], dtype=np.float)
-
-    # Define the zoom multiple and the transfer vector to put the pentagonal star above the left half of the picture
-    pentagram = np.round(pentagram * radius + np.array(center)).astype(np.int)
-
-    # Draw the star using lines
-    # cv2.polylines(canvas, pentagram, True, (0, 255, 255), 9)
-
+    pentagram_points = np.array([[0, -1]] + [np.dot(m, (0, -1)) for m in rotations], dtype=np.float64)
     # End of code from https://programmerall.com/article/22831425530/
+    return pentagram_points
 
-    # Get the points of the star
-    pentagram_points = pentagram[0][0]
 
-    # Create a mapping for ease of use
-    star_points = {
-        'top_center': pentagram_points[0],
-        'bottom_right': pentagram_points[1],
-        'middle_left': pentagram_points[2],
-        'middle_right': pentagram_points[3],
-        'bottom_left': pentagram_points[4],
-    }
+def get_star_polygon(pentagram_points) -> list:
+    """
+    Get the 10 points of the outline of a solid star from its 5 pentagram points
+    """
+    top_center, bottom_right, middle_left, middle_right, bottom_left = pentagram_points
 
-    # Create a mapping for ease of use
-    # This dict uses the order of which lines are drawn to determine as keys
-    lines_for_star = {
-        1: [star_points['top_center'], star_points['bottom_right']],
-        2: [star_points['bottom_right'], star_points['middle_left']],
-        3: [star_points['middle_left'], star_points['middle_right']],
-        4: [star_points['middle_right'], star_points['bottom_left']],
-        5: [star_points['bottom_left'], star_points['top_center']],
-    }
-    # In a more human readable format the lines are drawn in the following order:
+    # The lines of the pentagram in the order they are drawn:
     # 1. Top center to bottom right
     # 2. Bottom right to middle left
     # 3. Middle left to middle right
     # 4. Middle right to bottom left
     # 5. Bottom left to top center
+    lines_for_star = {
+        1: [top_center, bottom_right],
+        2: [bottom_right, middle_left],
+        3: [middle_left, middle_right],
+        4: [middle_right, bottom_left],
+        5: [bottom_left, top_center],
+    }
 
-    # In order to draw a solid star, we need to get the points where the lines intersect
-    polyfill_points = []
+    # In order to draw a solid star, we need the points where the lines intersect between the vertices
+    return [
+        top_center,
+        line_intersection(lines_for_star[1], lines_for_star[3]),
+        middle_right,
+        line_intersection(lines_for_star[1], lines_for_star[4]),
+        bottom_right,
+        line_intersection(lines_for_star[2], lines_for_star[4]),
+        bottom_left,
+        line_intersection(lines_for_star[2], lines_for_star[5]),
+        middle_left,
+        line_intersection(lines_for_star[3], lines_for_star[5]),
+    ]
+
+
+def create_unit_star_polygon() -> np.ndarray:
+    """
+    Create the polygon of a solid star with a radius of 1 centered on (0, 0)
+    """
+    return np.array(get_star_polygon(unit_pentagram_points), dtype=np.float64)
 
-    polyfill_points.append(star_points['top_center'])
-    top_center_to_middle_right = line_intersection(lines_for_star[1], lines_for_star[3])
 
-    polyfill_points.append(top_center_to_middle_right)
-    polyfill_points.append(star_points['middle_right'])
+# Computed once at import instead of on every draw
+unit_pentagram_points = create_unit_pentagram_points()
 
-    middle_right_to_bottom_right = line_intersection(lines_for_star[1], lines_for_star[4])
-    polyfill_points.append(middle_right_to_bottom_right)
-    polyfill_points.append(star_points['bottom_right'])
 
-    bottom_right_to_bottom_left = line_intersection(lines_for_star[2], lines_for_star[4])
-    polyfill_points.append(bottom_right_to_bottom_left)
-    polyfill_points.append(star_points['bottom_left'])
+class ShapeGeometry(NamedTuple):
+    """
+    The unit geometry of a polygon shape, a draw only scales and translates it
+    """
+    # (V, 2) vertices scaled by the shape size, or by the radius for a star
+    vertices: np.ndarray
+    # the same vertices as tuples, scaling a few vertices in python is cheaper than in numpy
+    vertex_list: Tuple[Tuple[float, float], ...]
+    # tight (x_min, y_min, x_max, y_max) of the unit vertices
+    bounding_box: Tuple[float, float, float, float]
+
+
+def create_shape_geometry(vertices) -> ShapeGeometry:
+    vertices = np.asarray(vertices, dtype=np.float64)
+    vertices.setflags(write=False)
+    bounding_box = tuple(vertices.min(axis=0).tolist() + vertices.max(axis=0).tolist())
+    vertex_list = tuple(tuple(vertex) for vertex in vertices.tolist())
+    return ShapeGeometry(vertices, vertex_list, bounding_box)
+
+
+# Computed once at import instead of on every draw
+shape_geometries = {
+    'triangle': create_shape_geometry([[0, 0], [1, 1], [0.5, 1]]),
+    'star': create_shape_geometry(create_unit_star_polygon()),
+}
 
-    bottom_left_to_middle_left = line_intersection(lines_for_star[2], lines_for_star[5])
-    polyfill_points.append(bottom_left_to_middle_left)
-    polyfill_points.append(star_points['middle_left'])
 
-    middle_left_to_top_center = line_intersection(lines_for_star[3], lines_for_star[5])
-    polyfill_points.append(middle_left_to_top_center)
+def get_pentagram_points(center: Tuple[int, int], radius: int) -> np.ndarray:
+    """
+    Get the 5 pentagram points of a star, rounded once scaled and translated
+    """
+    return np.round(unit_pentagram_points * radius + np.array(center)).astype(np.int64)
+
+
+def get_star_bounding_box(pentagram_points: np.ndarray):
+    top_center, bottom_right, middle_left, middle_right, _ = pentagram_points.tolist()
+    return middle_left[0], top_center[1], middle_right[0], bottom_right[1]
+
+
+def add_star_to_canvas(canvas: np.ndarray, color: Tuple[int, int, int], center: Tuple[int, int], radius: int):
+    """
+    Add a star to the canvas
+    The pentagram points are rounded once translated and the points between them are truncated, so the outline and
+    its pixels are the ones of the original drawer. The color must already be BGR like every other drawer
+    """
+    pentagram_points = get_pentagram_points(center, radius)
+    # Ensure that polyfill_points only contains integers
+    polyfill_points = np.array([(int(x), int(y)) for x, y in get_star_polygon(pentagram_points.tolist())], np.int32)
+    cv2.fillPoly(canvas, [polyfill_points], color)
+    return canvas, get_star_bounding_box(pentagram_points)
+
+
+def get_max_bounding_box(shape: str, shape_center: Tuple[int, int], shape_size: Tuple[int, int]):
+    """
+    Get the max bounding box the drawer of a shape returns without drawing it
+    """
+    if shape not in all_shapes:
+        raise ValueError('shape must be one of: {}'.format(all_shapes))
+    x, y = shape_center
+    w, h = shape_size
+    if shape == 'circle':
+        diameter = int(w / 2) * 2
+        return x, y, x + diameter, y + diameter
+    elif shape == 'ellipse':
+        center_x, center_y = int(x + w / 2), int(y + h / 2)
+        return center_x - w / 2, center_y - h / 2, center_x + w / 2, center_y + h / 2
+    elif shape == 'star':
+        return get_star_bounding_box(get_pentagram_points(shape_center, w // 2))
+    return x, y, x + w, y + h
 
-    # Ensure that polyfill_points only contains tuples of integers
-    polyfill_points = [(int(x), int(y)) for x, y in polyfill_points]
 
-    # # Draw the points of the star for debugging
-    # colors_to_use = random.sample(colors.keys(), len(colors))
-    # for i, point in enumerate(polyfill_points):
-    #     # color random
-    #     color_label = colors_to_use[i]
-    #     pt_color = convert_hex_color_to_rgb(colors[color_label])
-    #     # convert color tuple to BGR
-    #     pt_color = pt_color[::-1]
-    #     cv2.circle(canvas, tuple(point), 9, pt_color, -1)
-    #     print(f'point number {i} is {point} with color {color_label}')
+@functools.lru_cache(maxsize=4096)
+def rasterize_shape_mask(shape: str, shape_size: Tuple[int, int], stroke_width: int):
+    """
+    Rasterize a shape once with its regular drawer and keep the pixels it covers
+    cv2 rasterization is invariant to integer translations so the mask can be pasted at any shape center
+    :return: the mask, the offset of its top left corner and the max bounding box, both relative to the shape center
+    """
+    margin = max(shape_size) + stroke_width * 2 + 2
+    local_canvas = np.zeros((shape_size[1] + margin * 2, shape_size[0] + margin * 2, 3), np.uint8)
+    draw_shape = get_shape_drawer(shape)
+    _, max_bounding_box = draw_shape(local_canvas, (255, 255, 255), (margin, margin), shape_size, stroke_width)
+
+    covered = local_canvas.any(axis=2)
+    rows = np.flatnonzero(covered.any(axis=1))
+    columns = np.flatnonzero(covered.any(axis=0))
+    mask = covered[rows[0]:rows[-1] + 1, columns[0]:columns[-1] + 1].astype(np.uint8)
+    mask.setflags(write=False)
+    offset = (int(columns[0]) - margin, int(rows[0]) - margin)
+    max_bounding_box = tuple(value - margin for value in max_bounding_box)
+    return mask, offset, max_bounding_box
+
+
+@functools.lru_cache(maxsize=256)
+def get_color_patch(color: Tuple[int, int, int], patch_shape: Tuple[int, int]) -> np.ndarray:
+    """
+    Get a read only patch filled with color to paste masks from
+    """
+    color_patch = np.empty((*patch_shape, 3), np.uint8)
+    color_patch[:] = color
+    color_patch.setflags(write=False)
+    return color_patch
 
-    # polyfill a polygon with a purple color
-    cv2.fillPoly(canvas, np.array([polyfill_points]), color)
 
-    max_bounding_box = (star_points['middle_left'][0],  # leftmost point
-                        star_points['top_center'][1],  # highest point
-                        star_points['middle_right'][0],  # rightmost point
-                        star_points['bottom_right'][1])  # lowest point
+def add_shape_mask_to_canvas(canvas: np.ndarray, color: Tuple[int, int, int], shape_center: Tuple[int, int],
+                             shape_size: Tuple[int, int], stroke_width: int, shape: str):
+    """
+    Draw a shape by pasting its cached mask
+    The result is the same as its regular drawer unless the shape is clipped by the border of the canvas
+    """
+    mask, (offset_x, offset_y), max_bounding_box = rasterize_shape_mask(shape, tuple(shape_size), stroke_width)
+    x, y = shape_center[0] + offset_x, shape_center[1] + offset_y
+    height, width = mask.shape
+    # clip the mask to the canvas
+    x_start, y_start = max(x, 0), max(y, 0)
+    x_end, y_end = min(x + width, canvas.shape[1]), min(y + height, canvas.shape[0])
+    if x_start < x_end and y_start < y_end:
+        region = canvas[y_start:y_end, x_start:x_end]
+        # round the patch up to 64 pixels so a few patches serve every mask size
+        patch_shape = (-(-mask.shape[0] // 64) * 64, -(-mask.shape[1] // 64) * 64)
+        color_patch = get_color_patch(tuple(color), patch_shape)[:y_end - y_start, :x_end - x_start]
+        pasted = cv2.copyTo(color_patch, mask[y_start - y:y_end - y, x_start - x:x_end - x], region)
+        if pasted is not region:
+            region[:] = pasted
+
+    max_bounding_box = (max_bounding_box[0] + shape_center[0], max_bounding_box[1] + shape_center[1],
+                        max_bounding_box[2] + shape_center[0], max_bounding_box[3] + shape_center[1])
     return canvas, max_bounding_box
 
 
@@ -299,15 +424,18 @@ def show_image(image, window_name='image'):
     cv2.destroyAllWindows()
 
 
-def generate_shape_size(shape: str):
+def generate_shape_size(shape: str, random_state: np.random.RandomState = None):
     """
     Generate a random shape size
+    :param random_state: The random state to draw from, defaults to the global numpy random state
     """
 
     if shape not in all_shapes:
         raise ValueError('shape must be one of: {}'.format(all_shapes))
+    if random_state is None:
+        random_state = np.random
 
-    w = np.random.randint(64, 128)
+    w = random_state.randint(64, 128)
     # 1:1 ratio
     if shape in {'circle', 'square', 'star'}:
         return w, w
@@ -315,26 +443,197 @@ def generate_shape_size(shape: str):
     elif shape in {'rectangle', 'ellipse'}:
         return w * 2, w
 
-    h = np.random.randint(64, 128)
+    h = random_state.randint(64, 128)
     if shape in {'line', 'arrow', 'triangle'}:
         return w, h
 
 
-def generate_shape_center(canvas_size: Tuple[int, int], shape_size: Tuple[int, int], canvas_padding: int = 20):
+def generate_shape_center(canvas_size: Tuple[int, int], shape_size: Tuple[int, int], canvas_padding: int = 20,
+                          random_state: np.random.RandomState = None):
     """
     Generate a random shape center within the canvas with padding
+    :param random_state: The random state to draw from, defaults to the global numpy random state
     """
+    if random_state is None:
+        random_state = np.random
     w, h = canvas_size[0], canvas_size[1]
     w_min = canvas_padding
     w_max = w - canvas_padding
     h_min = canvas_padding
     h_max = h - canvas_padding
     shape_w, shape_h = shape_size
-    x = np.random.randint(w_min, w_max - shape_w)
-    y = np.random.randint(h_min, h_max - shape_h)
+    x = random_state.randint(w_min, w_max - shape_w)
+    y = random_state.randint(h_min, h_max - shape_h)
     return x, y
 
 
+def generate_shape_sizes(shape: str, number_of_shapes: int, random_state: np.random.RandomState = None,
+                         shape_scale: float = 1.0) -> np.ndarray:
+    """
+    Generate random sizes for number_of_shapes shapes as an (N, 2) array of (width, height)
+    :param random_state: The random state to draw from, defaults to the global numpy random state
+    :param shape_scale: Scale the sizes drawn for a 640x480 canvas, the same values are drawn whatever the scale
+    """
+
+    if shape not in all_shapes:
+        raise ValueError('shape must be one of: {}'.format(all_shapes))
+    if random_state is None:
+        random_state = np.random
+
+    w = random_state.randint(64, 128, size=number_of_shapes)
+    # 1:1 ratio
+    if shape in {'circle', 'square', 'star'}:
+        shape_sizes = np.stack([w, w], axis=1)
+    # 1:2 ratio
+    elif shape in {'rectangle', 'ellipse'}:
+        shape_sizes = np.stack([w * 2, w], axis=1)
+    else:
+        h = random_state.randint(64, 128, size=number_of_shapes)
+        shape_sizes = np.stack([w, h], axis=1)
+
+    if shape_scale != 1.0:
+        shape_sizes = np.maximum(np.rint(shape_sizes * shape_scale), 1).astype(shape_sizes.dtype)
+    return shape_sizes
+
+
+def generate_shape_centers(canvas_size: Tuple[int, int], shape_sizes: np.ndarray, canvas_padding: int = 20,
+                           random_state: np.random.RandomState = None) -> np.ndarray:
+    """
+    Generate random shape centers for every row of shape_sizes within the canvas with padding
+    :param random_state: The random state to draw from, defaults to the global numpy random state
+    """
+    if random_state is None:
+        random_state = np.random
+    w, h = canvas_size[0], canvas_size[1]
+    # the upper bound depends on each shape size so numpy broadcasts it per row
+    x = random_state.randint(canvas_padding, w - canvas_padding - shape_sizes[:, 0])
+    y = random_state.randint(canvas_padding, h - canvas_padding - shape_sizes[:, 1])
+    return np.stack([x, y], axis=1)
+
+
+def generate_shape_placements(canvas_size: Tuple[int, int], shape: str, number_of_shapes: int,
+                              random_state: np.random.RandomState = None, shape_scale: float = 1.0,
+                              canvas_padding: int = 20):
+    """
+    Generate the (N, 2) sizes and the (N, 2) centers of number_of_shapes shapes
+    Every shape draws its size then its center with generate_shape_size and generate_shape_center, in the order the
+    images used to be drawn one by one, so a seed gives the same placements as the per image loop
+    The draws cannot be batched in that order: the bounds of a center depend on the size drawn just before it, and
+    randint rejects draws outside of its bounds, so where the draws of an image start depends on every image before it
+    Use generate_shape_sizes and generate_shape_centers when the placements need not match the per image loop
+    :param random_state: The random state to draw from, defaults to the global numpy random state
+    :param shape_scale: Scale the sizes drawn for a 640x480 canvas, see generate_shape_sizes
+    """
+    shape_sizes = np.empty((number_of_shapes, 2), np.int64)
+    shape_centers = np.empty((number_of_shapes, 2), np.int64)
+    for i in range(number_of_shapes):
+        shape_sizes[i] = generate_shape_size(shape, random_state)
+        if shape_scale != 1.0:
+            shape_sizes[i] = np.maximum(np.rint(shape_sizes[i] * shape_scale), 1)
+        shape_centers[i] = generate_shape_center(canvas_size, shape_sizes[i].tolist(), canvas_padding, random_state)
+    return shape_sizes, shape_centers
+
+
+def convert_bounding_boxes_to_darknet(max_bounding_boxes: np.ndarray, shape_sizes: np.ndarray,
+                                      canvas_size: Tuple[int, int]) -> np.ndarray:
+    """
+    Convert (N, 4) max bounding boxes to the darknet <x_center> <y_center> <width> <height> relative to the canvas
+    """
+    canvas_width, canvas_height = canvas_size
+    darknet_boxes = np.empty((len(max_bounding_boxes), 4), np.float64)
+    darknet_boxes[:, 0] = (max_bounding_boxes[:, 0] + shape_sizes[:, 0] / 2) / canvas_width
+    darknet_boxes[:, 1] = (max_bounding_boxes[:, 1] + shape_sizes[:, 1] / 2) / canvas_height
+    darknet_boxes[:, 2] = (max_bounding_boxes[:, 2] - max_bounding_boxes[:, 0]) / canvas_width
+    darknet_boxes[:, 3] = (max_bounding_boxes[:, 3] - max_bounding_boxes[:, 1]) / canvas_height
+    return darknet_boxes
+
+
+def format_darknet_label(object_class: int, darknet_box) -> str:
+    """
+    Format a single darknet label line
+    <object-class> <x_center> <y_center> <width> <height>
+    """
+    x_center, y_center, width, height = (float(value) for value in darknet_box)
+    return f'{object_class} {x_center} {y_center} {width} {height}'
+
+
+def render_shape_batch(canvas_size: Tuple[int, int], shape: str, shape_centers: np.ndarray, shape_sizes: np.ndarray,
+                       canvas_color=(0, 0, 0), color=(0, 0, 0), stroke_width=1, draw_bounding_box=False,
+                       bounding_box_color=(0, 0, 0), canvases: np.ndarray = None, use_mask_cache: bool = False):
+    """
+    Render one shape per canvas into a single preallocated (N, H, W, 3) array
+    Every canvas is byte-identical to create_blank_canvas followed by add_shape_to_canvas with the same placement
+    :param use_mask_cache: Paste cached masks of the shapes instead of drawing them, see add_shape_mask_to_canvas
+    :return: the canvases, the (N, 4) max bounding boxes and the (N, 4) darknet boxes
+    """
+    number_of_images = len(shape_sizes)
+    canvases = create_blank_canvases(canvas_size, number_of_images, canvas_color, canvases)
+
+    # resolve the drawer once for the whole batch instead of once per image
+    draw_shape = get_shape_drawer(shape, use_mask_cache)
+    # convert color tuple to BGR
+    color = color[::-1]
+
+    max_bounding_boxes = np.empty((number_of_images, 4), np.float64)
+    for i in range(number_of_images):
+        shape_center = (int(shape_centers[i, 0]), int(shape_centers[i, 1]))
+        shape_size = (int(shape_sizes[i, 0]), int(shape_sizes[i, 1]))
+        # canvases[i] is a contiguous view so cv2 draws straight into the batch
+        _, max_bounding_boxes[i] = draw_shape(canvases[i], color, shape_center, shape_size, stroke_width)
+
+    # Add the stroke width to the max bounding box and ensure that it only contains ints
+    stroke_width_padding = stroke_width * 2
+    max_bounding_boxes[:, :2] -= stroke_width_padding
+    max_bounding_boxes[:, 2:] += stroke_width_padding
+    max_bounding_boxes = max_bounding_boxes.astype(np.int64)
+
+    if draw_bounding_box:
+        for canvas, max_bounding_box in zip(canvases, max_bounding_boxes.tolist()):
+            cv2.rectangle(canvas, (max_bounding_box[0], max_bounding_box[1]), (
+                max_bounding_box[2], max_bounding_box[3]), bounding_box_color, 2)
+
+    darknet_boxes = convert_bounding_boxes_to_darknet(max_bounding_boxes, shape_sizes, canvas_size)
+    return canvases, max_bounding_boxes, darknet_boxes
+
+
+def measure_rendering_throughput(canvas_size: Tuple[int, int] = (640, 480), number_of_images_per_shape: int = 200,
+                                 batch_size: int = 64, seed: int = 0):
+    """
+    Compare the images/sec of the per image path and render_shape_batch for every shape
+    Both paths render the same placements so the comparison only measures the rendering
+    """
+    canvas_color = convert_hex_color_to_rgb(colors['darkgreen'])
+    color = convert_hex_color_to_rgb(colors['gold'])
+    np.random.seed(seed)
+    placements = {}
+    for shape in all_shapes:
+        shape_sizes = generate_shape_sizes(shape, number_of_images_per_shape)
+        placements[shape] = generate_shape_centers(canvas_size, shape_sizes), shape_sizes
+
+    start = time.perf_counter()
+    for shape, (shape_centers, shape_sizes) in placements.items():
+        for shape_center, shape_size in zip(shape_centers.tolist(), shape_sizes.tolist()):
+            canvas = create_blank_canvas(canvas_size, canvas_color)
+            add_shape_to_canvas(canvas, shape, shape_center=tuple(shape_center), shape_size=tuple(shape_size),
+                                color=color, stroke_width=4)
+    per_image_seconds = time.perf_counter() - start
+
+    canvases = np.empty((batch_size, canvas_size[1], canvas_size[0], 3), np.uint8)
+    start = time.perf_counter()
+    for shape, (shape_centers, shape_sizes) in placements.items():
+        for batch_start in range(0, number_of_images_per_shape, batch_size):
+            batch = slice(batch_start, batch_start + batch_size)
+            canvases, _, _ = render_shape_batch(canvas_size, shape, shape_centers[batch], shape_sizes[batch],
+                                                canvas_color, color, stroke_width=4, canvases=canvases)
+    batch_seconds = time.perf_counter() - start
+
+    number_of_images = number_of_images_per_shape * len(all_shapes)
+    return {
+        'per_image_images_per_second': number_of_images / per_image_seconds,
+        'batch_images_per_second': number_of_images / batch_seconds,
+    }
+
+
 def make_dir_if_not_exist(path: str):
     """
     Create a directory if it doesn't exist
@@ -343,11 +642,37 @@ def make_dir_if_not_exist(path: str):
         os.makedirs(path)
 
 
-def generate_images(canvas_size: Tuple[int, int], colors_to_use: List[str], generated_images_folder: str,
-                    number_of_images_per_shape: int = 15, draw_bounding_box=False):
+def generate_shape_images(canvas_size: Tuple[int, int], shape: str, colors_to_use: List[str],
+                          generated_images_folder: str, number_of_images: int, first_image_index: int = 0,
+                          draw_bounding_box=False, batch_size: int = 64,
+                          random_state: np.random.RandomState = None, image_writer: ImageWriter = None,
+                          write_darkmark_json=True, augmentation=None, shape_scale: float = 1.0, tiles=None,
+                          timestamp: int = None):
     """
-    Generate images of size canvas_size using the colors defined in colors_to_use and saving to generated_images_folder
+    Generate number_of_images images of a single shape, the files are numbered from first_image_index
+    :param random_state: The random state to draw from, defaults to the global numpy random state
+    :param image_writer: The writer encoding and saving the files, a new one is used for this call when not given
+    :param write_darkmark_json: Write the DarkMark .json of every image next to its .txt
+    :param augmentation: The augmentation.AugmentationParameters to rotate, scale, flip and color jitter the shapes
+    with, the labels are then their tight bounding boxes
+    :param shape_scale: Scale the shape sizes, see generate_shape_sizes
+    :param tiles: The network_resolution.TileParameters to cut every canvas into tiles with, every tile is saved as
+    {shape}_{color}_{i}_{tile index} with the label clipped to it
+    :param timestamp: The unix time written in the DarkMark json, defaults to now, a fixed timestamp writes the same
+    files for a seed
     """
+    if image_writer is None:
+        with ImageWriter() as image_writer:
+            generate_shape_images(canvas_size, shape, colors_to_use, generated_images_folder, number_of_images,
+                                  first_image_index, draw_bounding_box, batch_size, random_state, image_writer,
+                                  write_darkmark_json, augmentation, shape_scale, tiles, timestamp)
+        return
+    # imported here since both modules import this one
+    if augmentation is not None:
+        from augmentation import render_augmented_shape_batch
+    if tiles is not None:
+        from network_resolution import cut_tiles
+
     canvas_color_key = colors_to_use[0]
     canvas_color = convert_hex_color_to_rgb(colors[canvas_color_key])
     background_color_key = colors_to_use[1]
@@ -357,50 +682,104 @@ def generate_images(canvas_size: Tuple[int, int], colors_to_use: List[str], gene
 
     # parent directory for all the generated images with this canvas color
     generated_images_dir = os.path.join(generated_images_folder, canvas_color_key)
-    make_dir_if_not_exist(generated_images_dir)
+    if image_writer.shard_writer is None:
+        make_dir_if_not_exist(generated_images_dir)
 
-    for shape in all_shapes:
-        for i in range(number_of_images_per_shape):
-            canvas = create_blank_canvas(canvas_size, canvas_color)
-            shape_size = generate_shape_size(shape)
-            shape_center = generate_shape_center(canvas_size, shape_size)
-
-            print(f'Drawing {shape} with color {background_color_key}')
-            canvas, max_bounding_box = add_shape_to_canvas(
-                canvas, shape, shape_center=shape_center, shape_size=shape_size, color=background_color, stroke_width=4,
-                draw_bounding_box=draw_bounding_box, bounding_box_color=bounding_box_color)
-
-            # save the canvas
-            generated_image_file = f'{shape}_{background_color_key}_{i}'
-            # save jpg
-            cv2.imwrite(os.path.join(generated_images_dir, f'{generated_image_file}.jpg'), canvas)
-            # save the max bounding box in the darknet format
+    if augmentation is None:
+        shape_sizes, shape_centers = generate_shape_placements(canvas_size, shape, number_of_images, random_state,
+                                                               shape_scale)
+    else:
+        shape_sizes = generate_shape_sizes(shape, number_of_images, random_state, shape_scale)
+    object_class = shape_to_index[shape]
+    instrumentation = get_instrumentation()
+
+    for batch_start in range(0, number_of_images, batch_size):
+        batch = slice(batch_start, batch_start + batch_size)
+        with instrumentation.stage('render', items=len(shape_sizes[batch])):
+            if augmentation is None:
+                canvases, _, darknet_boxes = render_shape_batch(
+                    canvas_size, shape, shape_centers[batch], shape_sizes[batch], canvas_color, background_color,
+                    stroke_width=4, draw_bounding_box=draw_bounding_box, bounding_box_color=bounding_box_color)
+            else:
+                # the centers depend on the transforms so they are drawn with them, batch by batch
+                canvases, _, darknet_boxes = render_augmented_shape_batch(
+                    canvas_size, shape, shape_sizes[batch], canvas_color, background_color, stroke_width=4,
+                    augmentation=augmentation, draw_bounding_box=draw_bounding_box,
+                    bounding_box_color=bounding_box_color, random_state=random_state)
+        instrumentation.count('images_rendered', len(canvases))
+
+        # (file name, image, darknet box) of every image to save, the box is None for tiles without a shape
+        if tiles is None:
+            image_size = canvas_size
+            samples = [(f'{shape}_{background_color_key}_{i}', canvas, darknet_box)
+                       for i, (canvas, darknet_box) in enumerate(zip(canvases, darknet_boxes),
+                                                                 start=first_image_index + batch_start)]
+        else:
+            image_size = tiles.tile_size
+            samples = [(f'{shape}_{background_color_key}_{first_image_index + batch_start + i}_{tile_index}', tile,
+                        tile_box)
+                       for i, tile_index, tile, tile_box in cut_tiles(canvases, darknet_boxes, canvas_size, tiles)]
+        if write_darkmark_json:
+            labelled_boxes = np.array([box for _, _, box in samples if box is not None], np.float64).reshape(-1, 4)
+            darkmark_jsons = iter(format_darkmark_jsons(image_size, object_class, shape, labelled_boxes, timestamp))
+            empty_darkmark_json = format_darkmark_json(image_size, [], [], labelled_boxes[:0], timestamp)
+
+        # every batch gets a new array since the writer encodes the canvases while the next batch is rendered
+        for file_name, image, darknet_box in samples:
+            # save the canvas as jpg with the max bounding box in the darknet format
             # <object-class> <x_center> <y_center> <width> <height>
-            with open(os.path.join(generated_images_dir, f'{generated_image_file}.txt'), 'w') as f:
-                object_class = shape_to_index[shape]
-                x_center = max_bounding_box[0] + shape_size[0] / 2
-                # Convert x_center to be relative to the canvas
-                x_center = x_center / canvas_size[0]
-
-                y_center = max_bounding_box[1] + shape_size[1] / 2
-                # Convert y_center to be relative to the canvas
-                y_center = y_center / canvas_size[1]
-
-                width = max_bounding_box[2] - max_bounding_box[0]
-                # Convert width to be relative to the canvas
-                width = width / canvas_size[0]
-
-                height = max_bounding_box[3] - max_bounding_box[1]
-                # Convert height to be relative to the canvas
-                height = height / canvas_size[1]
+            generated_image_file = os.path.join(generated_images_dir, file_name)
+            label = '' if darknet_box is None else format_darknet_label(object_class, darknet_box)
+            text_files = {f'{generated_image_file}.txt': label}
+            if write_darkmark_json:
+                text_files[f'{generated_image_file}.json'] = (
+                    empty_darkmark_json if darknet_box is None else next(darkmark_jsons))
+            image_writer.submit(generated_image_file + image_writer.encoder.extension, image, text_files)
+        instrumentation.progress(f'Queued {batch_start + len(canvases)}/{number_of_images} {shape} with color '
+                                 f'{background_color_key} for {generated_images_dir}')
 
-                f.write(f'{object_class} {x_center} {y_center} {width} {height}')
-            print(f'Saved {generated_image_file} files to {generated_images_dir}')
 
-
-def draw_all_canvas_and_shapes(canvas_size: Tuple[int, int] = (640, 480)):
+def generate_images(canvas_size: Tuple[int, int], colors_to_use: List[str], generated_images_folder: str,
+                    number_of_images_per_shape: int = 15, draw_bounding_box=False, batch_size: int = 64,
+                    first_image_index: int = 0, random_state: np.random.RandomState = None,
+                    samples_per_shard: int = None, write_darkmark_json=True, augmentation=None,
+                    shape_scale: float = 1.0, tiles=None, overwrite=True, encoder=None, timestamp: int = None):
+    """
+    Generate images of size canvas_size using the colors defined in colors_to_use and saving to generated_images_folder
+    The placement of every shape is drawn up front so the output for a seed does not depend on batch_size,
+    unless the shapes are augmented
+    :param random_state: The random state to draw from, defaults to the global numpy random state
+    :param samples_per_shard: Pack the samples into shards of this size in generated_images_folder instead of
+    writing the files of every image
+    :param write_darkmark_json: Write the DarkMark .json of every image next to its .txt
+    :param augmentation: The augmentation.AugmentationParameters to rotate, scale, flip and color jitter the shapes with
+    :param shape_scale: Scale the shape sizes, see generate_shape_sizes
+    :param tiles: The network_resolution.TileParameters to cut every canvas into tiles with
+    :param overwrite: Write the images whose files already exist again instead of skipping them
+    :param encoder: The image_encoding.EncoderParameters of the images, defaults to jpg
+    :param timestamp: The unix time written in the DarkMark json, defaults to now
+    """
+    shard_writer = None
+    if samples_per_shard is not None:
+        shard_writer = ShardWriter(generated_images_folder, generated_images_folder, samples_per_shard,
+                                   shard_prefix=f'{colors_to_use[0]}-{colors_to_use[1]}-{first_image_index:08d}')
+    with ImageWriter(shard_writer=shard_writer, overwrite=overwrite, encoder=encoder) as image_writer:
+        for shape in all_shapes:
+            generate_shape_images(canvas_size, shape, colors_to_use, generated_images_folder,
+                                  number_of_images_per_shape, first_image_index, draw_bounding_box, batch_size,
+                                  random_state, image_writer, write_darkmark_json, augmentation, shape_scale,
+                                  tiles, timestamp)
+    if shard_writer is not None:
+        write_shard_manifest(generated_images_folder)
+    print(f'Saved {image_writer.images_written} images to {os.path.join(generated_images_folder, colors_to_use[0])}')
+    if image_writer.images_skipped:
+        print(f'Skipped {image_writer.images_skipped} images whose files exist')
+
+
+def draw_all_canvas_and_shapes(canvas_size: Tuple[int, int] = (640, 480), overwrite=False):
     """
     Draw all the shapes on the canvas mainly used for debugging
+    :param overwrite: Draw the shapes whose files already exist again instead of keeping them
     """
     # create folder to save the generated images
     generated_images_folder = os.path.join('all_shapes')
@@ -410,17 +789,45 @@ def draw_all_canvas_and_shapes(canvas_size: Tuple[int, int] = (640, 480)):
 
     # take the first three colors to draw the shapes
     colors_to_use = colors_to_manipulate[:3]
-    generate_images(canvas_size, colors_to_use, generated_images_folder, 1, draw_bounding_box=True)
+    generate_images(canvas_size, colors_to_use, generated_images_folder, 1, draw_bounding_box=True,
+                    overwrite=overwrite)
 
 
-def generate_training_images(canvas_size: Tuple[int, int] = (640, 480)):
+def generate_training_images(canvas_size: Tuple[int, int] = (640, 480), number_of_iterations: int = 1,
+                             number_of_images_per_shape: int = 1, seed: int = None, max_workers: int = 1,
+                             samples_per_shard: int = None, report_path: str = None, augmentation=None,
+                             images_folder: str = 'generated_images', shape_scale: float = 1.0, tiles=None,
+                             verify_checksums=True, encoder=None, timestamp: int = None):
     """
     Generate training images with the size of canvas_size
+    The run is recorded in the run_manifest.RunManifest of the images folder: running again with the same settings
+    resumes it, regenerating only the missing or damaged files, and a larger number_of_images_per_shape only
+    generates the images added
     :param canvas_size: The size of the images we will generate
+    :param number_of_iterations: The number of times a random set of colors is picked
+    :param number_of_images_per_shape: The number of images generated for every shape in each iteration
+    :param seed: The master seed, every work item derives its own seed from it so the output does not depend on
+    max_workers. The seed of the run manifest is used when it is not given, or a random seed for a new run
+    :param max_workers: The number of processes used to generate the images
+    :param samples_per_shard: Pack the samples into shards of this size instead of writing the files of every image,
+    each work item then writes a single shard
+    :param report_path: Write the json run report of the render, encode and write stages to this path,
+    the instrumentation is enabled for this call when it is not already
+    :param augmentation: The augmentation.AugmentationParameters to rotate, scale, flip and color jitter the shapes with
+    :param images_folder: The folder of the network folder the images are generated in
+    :param shape_scale: Scale the shape sizes, see generate_shape_sizes
+    :param tiles: The network_resolution.TileParameters to cut every canvas into tiles with
+    :param verify_checksums: Read the files of the work items recorded in the run manifest to find the damaged ones,
+    otherwise only the missing files are regenerated
+    :param encoder: The image_encoding.EncoderParameters of the images, defaults to jpg
+    :param timestamp: The unix time written in the DarkMark json, defaults to the timestamp of the run manifest, the
+    time the run started for a new run. With a fixed seed and timestamp two runs write the same files
+    :raises ValueError: if the images folder holds a run with another seed, other settings or another timestamp
     """
+    # imported here since parallel_generation imports this module
+    from parallel_generation import attach_recorded_files, plan_work_items, run_work_items
+
     neural_network_name = 'shapes_neural_network'
-    number_of_iterations = 1
-    number_of_images_per_shape = 1
 
     # define our folder we will work in
     network_folder = os.path.abspath(neural_network_name)
@@ -428,7 +835,7 @@ def generate_training_images(canvas_size: Tuple[int, int] = (640, 480)):
     make_dir_if_not_exist(network_folder)
 
     # create folder to save the generated images
-    generated_images_folder = os.path.join(network_folder, 'generated_images')
+    generated_images_folder = os.path.join(network_folder, images_folder)
     make_dir_if_not_exist(generated_images_folder)
 
     # create names file
@@ -437,11 +844,39 @@ def generate_training_images(canvas_size: Tuple[int, int] = (640, 480)):
     with open(names_path, 'w') as f:
         f.writelines(f'{shape}\n' for shape in all_shapes)
 
-    colors_to_manipulate = list(colors.keys())
-
-    for _ in range(number_of_iterations):
-        colors_to_use = random.sample(colors_to_manipulate, 3)
-        generate_images(canvas_size, colors_to_use, generated_images_folder, number_of_images_per_shape)
+    images_per_work_item = 64 if samples_per_shard is None else samples_per_shard
+    # every setting changing the generated files, a run can only be resumed with the same ones
+    config = {
+        'canvas_size': canvas_size,
+        'number_of_iterations': number_of_iterations,
+        'images_per_work_item': images_per_work_item,
+        'write_shards': samples_per_shard is not None,
+        'augmentation': None if augmentation is None else augmentation._asdict(),
+        'shape_scale': shape_scale,
+        'tiles': None if tiles is None else tiles._asdict(),
+        'encoder': None if encoder is None else encoder._asdict(),
+    }
+    manifest = RunManifest.open(generated_images_folder, seed, config, timestamp)
+    seed = manifest.seed
+    print(f'Generating training images with seed {seed}')
+    if manifest.completed:
+        print(f'Resuming {manifest.path}, {len(manifest.completed)} work items were completed')
+
+    work_items = []
+    for generation_round in manifest.plan_rounds(number_of_images_per_shape, images_per_work_item):
+        work_items.extend(plan_work_items(canvas_size, generated_images_folder, number_of_iterations,
+                                          generation_round.number_of_images_per_shape, seed, images_per_work_item,
+                                          write_shards=samples_per_shard is not None, augmentation=augmentation,
+                                          shape_scale=shape_scale, tiles=tiles, encoder=encoder,
+                                          first_image_index=generation_round.first_image_index,
+                                          first_chunk_index=generation_round.first_chunk_index,
+                                          timestamp=manifest.timestamp))
+    work_items = attach_recorded_files(work_items, manifest, verify_checksums)
+    with report_run(report_path) as instrumentation:
+        number_of_images = run_work_items(work_items, max_workers, manifest)
+        if samples_per_shard is not None:
+            write_shard_manifest(generated_images_folder)
+        instrumentation.progress(f'Generated {number_of_images} images in {generated_images_folder}', force=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,183 @@
+"""
+Encode generated images as JPEG, PNG, WebP or raw arrays, and profile what every encoding costs
+
+JPEG at the default quality of cv2 rings around the flat edges of the shapes and is paid for again when training
+decodes it, PNG and lossless WebP keep every pixel, and raw arrays are .npy files that are read or memory-mapped
+without decoding anything. profile_encoders renders a sample of every shape and reports the encode time, the size
+and the decode time of every encoding, and how far the decoded pixels are from the rendered ones.
+"""
+import io
+import time
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+IMAGE_FORMATS = ['jpg', 'png', 'webp', 'raw']
+
+# the extension of the image files of every format
+image_format_extensions = {
+    'jpg': '.jpg',
+    'png': '.png',
+    'webp': '.webp',
+    'raw': '.npy',
+}
+
+
+class EncoderParameters(NamedTuple):
+    # one of IMAGE_FORMATS
+    image_format: str = 'jpg'
+    # the quality of jpg and webp from 0 to 100, webp is lossless above 100
+    quality: int = 95
+    # optimize the huffman tables of jpg, smaller files for a slower encode
+    optimize: bool = False
+    # the zlib compression level of png from 0 to 9
+    compression_level: int = 1
+
+    @property
+    def extension(self) -> str:
+        return image_format_extensions[self.image_format]
+
+
+# the encoders compared by profile_encoders, the first one is what cv2.imwrite writes for a .jpg
+PROFILE_ENCODERS = [
+    EncoderParameters('jpg'),
+    EncoderParameters('jpg', quality=75, optimize=True),
+    EncoderParameters('png', compression_level=1),
+    EncoderParameters('png', compression_level=9),
+    EncoderParameters('webp', quality=90),
+    EncoderParameters('webp', quality=101),
+    EncoderParameters('raw'),
+]
+
+
+def get_encoder_name(encoder: EncoderParameters) -> str:
+    """
+    Get a short name of the encoder, e.g. jpg q95 or png level 1
+    """
+    if encoder.image_format == 'jpg':
+        return f'jpg q{encoder.quality}' + (' optimized' if encoder.optimize else '')
+    if encoder.image_format == 'png':
+        return f'png level {encoder.compression_level}'
+    if encoder.image_format == 'webp':
+        return 'webp lossless' if encoder.quality > 100 else f'webp q{encoder.quality}'
+    return encoder.image_format
+
+
+def get_imencode_flags(encoder: EncoderParameters) -> List[int]:
+    """
+    Get the cv2.imencode flags of the encoder
+    :raises ValueError: if the image format is not one of IMAGE_FORMATS
+    """
+    if encoder.image_format == 'jpg':
+        return [cv2.IMWRITE_JPEG_QUALITY, encoder.quality, cv2.IMWRITE_JPEG_OPTIMIZE, int(encoder.optimize)]
+    if encoder.image_format == 'png':
+        return [cv2.IMWRITE_PNG_COMPRESSION, encoder.compression_level]
+    if encoder.image_format == 'webp':
+        return [cv2.IMWRITE_WEBP_QUALITY, encoder.quality]
+    if encoder.image_format == 'raw':
+        return []
+    raise ValueError(f'Unknown image format {encoder.image_format}, use one of {IMAGE_FORMATS}')
+
+
+def encode_image(image: np.ndarray, encoder: EncoderParameters) -> np.ndarray:
+    """
+    Encode an image into the bytes of its file, raw images are encoded as .npy
+    :raises ValueError: if cv2 could not encode the image
+    """
+    if encoder.image_format == 'raw':
+        buffer = io.BytesIO()
+        np.save(buffer, np.ascontiguousarray(image), allow_pickle=False)
+        return np.frombuffer(buffer.getbuffer(), np.uint8)
+    encoded, buffer = cv2.imencode(encoder.extension, image, get_imencode_flags(encoder))
+    if not encoded:
+        raise ValueError(f'cv2 could not encode a {encoder.image_format} image')
+    return buffer
+
+
+def decode_image(buffer: np.ndarray, image_format: str) -> np.ndarray:
+    """
+    Decode the bytes of an image file, raw images are a view of buffer like a memory-mapped .npy
+    """
+    if image_format == 'raw':
+        # only the header is copied, the magic string and the version are followed by the length of the header
+        if tuple(buffer[6:8]) == (1, 0):
+            header_end = 10 + int.from_bytes(bytes(buffer[8:10]), 'little')
+        else:
+            header_end = 12 + int.from_bytes(bytes(buffer[8:12]), 'little')
+        header = io.BytesIO(bytes(buffer[:header_end]))
+        if np.lib.format.read_magic(header) == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(header)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(header)
+        return np.frombuffer(buffer, dtype, offset=header_end).reshape(shape, order='F' if fortran_order else 'C')
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+
+
+def render_profile_sample(canvas_size: Tuple[int, int] = (640, 480), number_of_images_per_shape: int = 8,
+                          seed: int = 0) -> np.ndarray:
+    """
+    Render number_of_images_per_shape images of every shape in an (N, H, W, 3) array
+    """
+    # imported here since dataset_generation imports image_writer which imports this module
+    from dataset_generation import (all_shapes, colors, convert_hex_color_to_rgb, generate_shape_centers,
+                                    generate_shape_sizes, render_shape_batch)
+
+    random_state = np.random.RandomState(np.random.MT19937(np.random.SeedSequence(seed)))
+    canvas_color = convert_hex_color_to_rgb(colors['darkgreen'])
+    color = convert_hex_color_to_rgb(colors['gold'])
+    sample = []
+    for shape in all_shapes:
+        shape_sizes = generate_shape_sizes(shape, number_of_images_per_shape, random_state)
+        shape_centers = generate_shape_centers(canvas_size, shape_sizes, random_state=random_state)
+        canvases, _, _ = render_shape_batch(canvas_size, shape, shape_centers, shape_sizes, canvas_color, color,
+                                            stroke_width=4)
+        sample.append(canvases)
+    return np.concatenate(sample)
+
+
+def profile_encoders(encoders: Sequence[EncoderParameters] = PROFILE_ENCODERS,
+                     canvas_size: Tuple[int, int] = (640, 480), number_of_images_per_shape: int = 8,
+                     seed: int = 0) -> List[Dict]:
+    """
+    Encode and decode a rendered sample of every shape with every encoder on a single thread
+    :return: the encode ms/image, bytes/image, decode ms/image and the PSNR of the decoded images of every encoder,
+    the PSNR is inf for lossless encodings
+    """
+    sample = render_profile_sample(canvas_size, number_of_images_per_shape, seed)
+    profile = []
+    for encoder in encoders:
+        start = time.perf_counter()
+        buffers = [encode_image(image, encoder) for image in sample]
+        encode_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        decoded = [decode_image(buffer, encoder.image_format) for buffer in buffers]
+        decode_seconds = time.perf_counter() - start
+
+        squared_error = np.mean([np.mean(np.square(image.astype(np.float64) - decoded_image))
+                                 for image, decoded_image in zip(sample, decoded)])
+        profile.append({
+            'encoder': get_encoder_name(encoder),
+            'encode_ms_per_image': encode_seconds * 1000 / len(sample),
+            'bytes_per_image': sum(len(buffer) for buffer in buffers) / len(sample),
+            'decode_ms_per_image': decode_seconds * 1000 / len(sample),
+            'psnr': float('inf') if squared_error == 0 else float(10 * np.log10(255 ** 2 / squared_error)),
+        })
+    return profile
+
+
+def format_encoder_profile(profile: List[Dict]) -> str:
+    """
+    Format the profile of profile_encoders as a markdown table
+    """
+    lines = ['| Encoder | encode ms/image | bytes/image | decode ms/image | PSNR |',
+             '| --- | --- | --- | --- | --- |']
+    for row in profile:
+        lines.append(f'| {row["encoder"]} | {row["encode_ms_per_image"]:.2f} | {row["bytes_per_image"]:.0f} | '
+                     f'{row["decode_ms_per_image"]:.2f} | {row["psnr"]:.1f} |')
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    print(format_encoder_profile(profile_encoders()))
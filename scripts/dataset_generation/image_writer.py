@@ -0,0 +1,193 @@
+"""
+Write generated images and their labels in the background
+
+Rendering only hands off arrays to an ImageWriter.
+A pool of threads encodes the images with cv2.imencode, which releases the GIL, and a single thread writes the
+encoded images and their labels to disk in batches. The encoding is set by image_encoding.EncoderParameters.
+Both queues are bounded so a slow disk blocks the renderer instead of growing memory.
+Given a ShardWriter the files are packed into shards instead of being written one by one.
+Unless overwrite is set, images whose files are all there already are skipped before being encoded.
+"""
+import os
+import queue
+import sys
+import threading
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# the instrumentation shared by the scripts sits in its own folder next to this one
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'instrumentation'))
+
+from image_encoding import EncoderParameters, encode_image
+from instrumentation import get_instrumentation
+from run_manifest import compute_checksum
+from shard_format import ShardWriter
+
+# Put on a queue to stop the thread reading it
+_STOP = None
+
+
+class ImageWriterError(Exception):
+    """
+    Raised when some of the submitted files could not be encoded or written
+    """
+
+    def __init__(self, errors: List[Tuple[str, Exception]]):
+        self.errors = errors
+        path, error = errors[0]
+        super().__init__(f'Failed to write {len(errors)} files, first error for {path}: {error}')
+
+
+class ImageWriter:
+    """
+    Encode and write images with their label files on background threads
+
+    with ImageWriter() as image_writer:
+        image_writer.submit('circle_gold_0' + image_writer.encoder.extension, canvas, {'circle_gold_0.txt': label})
+    """
+
+    def __init__(self, max_queued_images: int = 256, encode_workers: int = None, write_batch_size: int = 32,
+                 shard_writer: ShardWriter = None, overwrite: bool = True, record_checksums: bool = False,
+                 encoder: EncoderParameters = None):
+        """
+        :param max_queued_images: The number of images waiting to be encoded or written before submit blocks
+        :param encode_workers: The number of encoding threads, defaults to the number of cpus
+        :param write_batch_size: The maximum number of images written by the writer thread in one go
+        :param shard_writer: Pack the files into shards instead of writing them, it is closed with the ImageWriter
+        :param overwrite: Write the images whose image and text files already exist again instead of skipping them
+        :param record_checksums: Record the checksum of every file written in checksums, see run_manifest
+        :param encoder: The encoding of the images, defaults to jpg at the quality of cv2.imwrite, the path of the
+        images submitted should end with encoder.extension
+        :raises ValueError: if overwrite is not set with a shard_writer, shards are always written from scratch
+        """
+        if shard_writer is not None and not overwrite:
+            raise ValueError('Samples packed into shards cannot be skipped, overwrite must be set')
+        self.shard_writer = shard_writer
+        self.encoder = EncoderParameters() if encoder is None else encoder
+        if encode_workers is None:
+            encode_workers = os.cpu_count() or 1
+        self.write_batch_size = write_batch_size
+        self.errors: List[Tuple[str, Exception]] = []
+        self.images_written = 0
+        self.images_skipped = 0
+        self.overwrite = overwrite
+        # the checksum of every file written, mapping its path to run_manifest.compute_checksum of its content
+        self.checksums: Dict[str, str] = {} if record_checksums else None
+        self.instrumentation = get_instrumentation()
+        self._errors_lock = threading.Lock()
+        self._encode_queue = queue.Queue(maxsize=max_queued_images)
+        self._write_queue = queue.Queue(maxsize=max_queued_images)
+        self._encode_threads = [threading.Thread(target=self._encode_images, daemon=True)
+                                for _ in range(encode_workers)]
+        self._write_thread = threading.Thread(target=self._write_files, daemon=True)
+        for thread in self._encode_threads:
+            thread.start()
+        self._write_thread.start()
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # do not hide the exception of the render loop behind a write error
+        self.close(raise_errors=exc_type is None)
+
+    def submit(self, image_path: str, image: np.ndarray, text_files: Dict[str, str] = None):
+        """
+        Queue an image for encoding, blocks while the queue is full
+        The image must not be modified afterwards since it is encoded later on
+        Without overwrite the image is skipped when its image and text files all exist
+        :param image_path: The path of the image, it is encoded with the encoder of the ImageWriter
+        :param text_files: Text files written next to the image, mapping their path to their content
+        """
+        if self._closed:
+            raise ValueError('Cannot submit to a closed ImageWriter')
+        if self.errors:
+            # stop the renderer early instead of reporting the errors once everything is rendered
+            raise ImageWriterError(self.errors)
+        if not self.overwrite and all(os.path.exists(path) for path in [image_path, *(text_files or {})]):
+            self.images_skipped += 1
+            self.instrumentation.count('images_skipped')
+            return
+        self._encode_queue.put((image_path, image, text_files or {}))
+
+    def close(self, raise_errors: bool = True):
+        """
+        Wait for every submitted file to be written and stop the threads
+        :raises ImageWriterError: if some of the files could not be encoded or written
+        """
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._encode_threads:
+            self._encode_queue.put(_STOP)
+        for thread in self._encode_threads:
+            thread.join()
+        self._write_queue.put(_STOP)
+        self._write_thread.join()
+        if self.shard_writer is not None:
+            try:
+                self.shard_writer.close()
+            except Exception as error:
+                self._add_error(self.shard_writer.shard_folder, error)
+        if raise_errors and self.errors:
+            raise ImageWriterError(self.errors)
+
+    def _add_error(self, path: str, error: Exception):
+        with self._errors_lock:
+            self.errors.append((path, error))
+
+    def _encode_images(self):
+        while True:
+            item = self._encode_queue.get()
+            if item is _STOP:
+                return
+            image_path, image, text_files = item
+            try:
+                with self.instrumentation.stage('encode'):
+                    buffer = encode_image(image, self.encoder)
+            except Exception as error:
+                self._add_error(image_path, error)
+                continue
+            self._write_queue.put((image_path, buffer, text_files))
+
+    def _write_files(self):
+        stopped = False
+        while not stopped:
+            # block for the first item then take whatever else is already waiting
+            batch = [self._write_queue.get()]
+            while len(batch) < self.write_batch_size:
+                try:
+                    batch.append(self._write_queue.get_nowait())
+                except queue.Empty:
+                    break
+            if _STOP in batch:
+                stopped = True
+                batch = [item for item in batch if item is not _STOP]
+            for image_path, buffer, text_files in batch:
+                self._write_image_files(image_path, buffer, text_files)
+
+    def _write_image_files(self, image_path: str, buffer: np.ndarray, text_files: Dict[str, str]):
+        try:
+            if self.shard_writer is not None:
+                with self.instrumentation.stage('write'):
+                    self.shard_writer.add_sample(image_path, buffer, text_files)
+            else:
+                with self.instrumentation.stage('write'):
+                    with open(image_path, 'wb') as f:
+                        f.write(buffer)
+                with self.instrumentation.stage('label_write', items=len(text_files)):
+                    for text_path, text in text_files.items():
+                        with open(text_path, 'wb') as f:
+                            f.write(text.encode())
+                if self.checksums is not None:
+                    self.checksums[image_path] = compute_checksum(buffer)
+                    for text_path, text in text_files.items():
+                        self.checksums[text_path] = compute_checksum(text.encode())
+        except Exception as error:
+            self._add_error(image_path, error)
+            return
+        self.images_written += 1
+        self.instrumentation.count('images_written')
+        self.instrumentation.count('bytes_written', len(buffer))
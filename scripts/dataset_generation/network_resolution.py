@@ -0,0 +1,162 @@
+"""
+Generate images at the input resolution of the network instead of letting DarkMark resize or zoom them
+
+DarkMark trains on copies of the images in darkmark_image_cache: resize copies scaled to the [net] width and height
+of the .cfg, and zoom copies cut into tiles of that size. Rendering at the network resolution writes each image once
+at the size darknet trains on.
+Native images are rendered at the network size with the shapes scaled like a resize would scale them, zoom tiles
+are cut at 1:1 from a larger canvas with the labels clipped to every tile.
+"""
+import configparser
+import os
+from typing import List, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+from dataset_generation import generate_training_images
+
+# the canvas size the shape sizes were chosen for
+REFERENCE_CANVAS_SIZE = (640, 480)
+
+
+class TileParameters(NamedTuple):
+    # the (width, height) of every tile, the canvas is covered by evenly spaced and possibly overlapping tiles
+    tile_size: Tuple[int, int]
+    # a shape is labelled in a tile when at least this fraction of its box is within the tile
+    min_visibility: float = 0.25
+    # also write the tiles holding no labelled shape, as negative samples with an empty label
+    keep_empty_tiles: bool = False
+
+
+def read_network_size(cfg_path: str) -> Tuple[int, int]:
+    """
+    Read the (width, height) of the [net] section of a darknet .cfg
+    :raises ValueError: if the .cfg has no [net] section or no width or height
+    """
+    # darknet repeats section names, so only the lines up to the first section after [net] are parsed
+    net_lines = []
+    with open(cfg_path) as f:
+        for line in f:
+            if line.strip().startswith('[') and net_lines:
+                break
+            if line.strip() in {'[net]', '[network]'} or net_lines:
+                net_lines.append(line)
+    if not net_lines:
+        raise ValueError(f'{cfg_path} has no [net] section')
+    parser = configparser.ConfigParser(comment_prefixes=('#', ';'), inline_comment_prefixes=('#',), strict=False)
+    parser.read_string(''.join(net_lines))
+    net = parser[parser.sections()[0]]
+    if 'width' not in net or 'height' not in net:
+        raise ValueError(f'The [net] section of {cfg_path} has no width or height')
+    return int(net['width']), int(net['height'])
+
+
+def read_network_sizes(cfg_paths: Sequence[str]) -> List[Tuple[int, int]]:
+    """
+    Read the distinct network sizes of several .cfg files, in order
+    """
+    network_sizes = []
+    for cfg_path in cfg_paths:
+        network_size = read_network_size(cfg_path)
+        if network_size not in network_sizes:
+            network_sizes.append(network_size)
+    return network_sizes
+
+
+def get_shape_scale(canvas_size: Tuple[int, int], reference_canvas_size: Tuple[int, int] = REFERENCE_CANVAS_SIZE):
+    """
+    Get the scale of the shapes of a canvas, so they cover the share of it they would on the reference canvas
+    The smallest ratio is used so circles, squares and stars keep their 1:1 ratio
+    """
+    return min(canvas_size[0] / reference_canvas_size[0], canvas_size[1] / reference_canvas_size[1])
+
+
+def get_tile_origins(canvas_size: Tuple[int, int], tile_size: Tuple[int, int]) -> np.ndarray:
+    """
+    Get the (T, 2) top left corners of the fewest evenly spaced tiles covering the canvas
+    :raises ValueError: if the tiles are larger than the canvas
+    """
+    if tile_size[0] > canvas_size[0] or tile_size[1] > canvas_size[1]:
+        raise ValueError(f'Tiles of {tile_size} do not fit in a canvas of {canvas_size}')
+    axes = []
+    for canvas_extent, tile_extent in zip(canvas_size, tile_size):
+        number_of_tiles = -(-canvas_extent // tile_extent)
+        axes.append(np.rint(np.linspace(0, canvas_extent - tile_extent, number_of_tiles)).astype(np.int64))
+    xs, ys = np.meshgrid(*axes)
+    return np.stack([xs.ravel(), ys.ravel()], axis=1)
+
+
+def clip_darknet_boxes_to_tiles(darknet_boxes: np.ndarray, canvas_size: Tuple[int, int], tile_origins: np.ndarray,
+                                tile_size: Tuple[int, int]):
+    """
+    Clip (N, 4) darknet boxes of the canvas to every tile
+    :return: the (N, T, 4) darknet boxes relative to every tile and the (N, T) fraction of every box within the tile
+    """
+    canvas_scale = np.array(tuple(canvas_size) * 2, np.float64)
+    corners = np.empty((len(darknet_boxes), 4), np.float64)
+    corners[:, :2] = darknet_boxes[:, :2] - darknet_boxes[:, 2:] / 2
+    corners[:, 2:] = darknet_boxes[:, :2] + darknet_boxes[:, 2:] / 2
+    corners *= canvas_scale
+
+    # corners of every box in the frame of every tile, clipped to the tile
+    tile_corners = corners[:, np.newaxis, :] - np.tile(tile_origins, 2)[np.newaxis, :, :]
+    np.clip(tile_corners, 0, tuple(tile_size) * 2, out=tile_corners)
+
+    box_areas = (corners[:, 2] - corners[:, 0]) * (corners[:, 3] - corners[:, 1])
+    clipped_sizes = tile_corners[:, :, 2:] - tile_corners[:, :, :2]
+    visibility = clipped_sizes[:, :, 0] * clipped_sizes[:, :, 1] / np.maximum(box_areas, 1e-12)[:, np.newaxis]
+
+    tile_scale = np.array(tile_size, np.float64)
+    tile_boxes = np.empty(tile_corners.shape, np.float64)
+    tile_boxes[:, :, :2] = (tile_corners[:, :, :2] + tile_corners[:, :, 2:]) / 2 / tile_scale
+    tile_boxes[:, :, 2:] = clipped_sizes / tile_scale
+    return tile_boxes, visibility
+
+
+def cut_tiles(canvases: np.ndarray, darknet_boxes: np.ndarray, canvas_size: Tuple[int, int], tiles: TileParameters):
+    """
+    Cut the canvases of a batch holding one shape each into tiles
+    :return: the list of (canvas index, tile index, tile, darknet box or None) of every tile to write,
+    tiles are views of the canvases
+    """
+    tile_width, tile_height = tiles.tile_size
+    tile_origins = get_tile_origins(canvas_size, tiles.tile_size)
+    tile_boxes, visibility = clip_darknet_boxes_to_tiles(darknet_boxes, canvas_size, tile_origins, tiles.tile_size)
+    labelled = (visibility >= tiles.min_visibility) & (visibility > 0)
+
+    cut = []
+    for canvas_index, tile_index in zip(*np.nonzero(labelled | tiles.keep_empty_tiles)):
+        x, y = tile_origins[tile_index].tolist()
+        tile = canvases[canvas_index, y:y + tile_height, x:x + tile_width]
+        tile_box = tile_boxes[canvas_index, tile_index] if labelled[canvas_index, tile_index] else None
+        cut.append((int(canvas_index), int(tile_index), tile, tile_box))
+    return cut
+
+
+def generate_network_images(cfg_paths: Sequence[str] = ('shapes_neural_network/shapes_neural_network.cfg',),
+                            number_of_iterations: int = 1, number_of_images_per_shape: int = 1, seed: int = None,
+                            max_workers: int = 1, zoom_canvas_size: Tuple[int, int] = None,
+                            tiles: TileParameters = None, **kwargs):
+    """
+    Generate training images at the [net] width and height of every .cfg
+    Images of every network size go to generated_images/{width}x{height}
+    :param zoom_canvas_size: Also render canvases of this size and cut them into tiles of the network size,
+    written to generated_images/{width}x{height}_zoom
+    :param tiles: The tile parameters of the zoom tiles, the tile size is the network size
+    :param kwargs: Passed to generate_training_images
+    """
+    for network_size in read_network_sizes(cfg_paths):
+        width, height = network_size
+        generate_training_images(network_size, number_of_iterations, number_of_images_per_shape, seed, max_workers,
+                                 images_folder=os.path.join('generated_images', f'{width}x{height}'),
+                                 shape_scale=get_shape_scale(network_size), **kwargs)
+        if zoom_canvas_size is None:
+            continue
+        zoom_tiles = TileParameters(network_size) if tiles is None else tiles._replace(tile_size=network_size)
+        generate_training_images(zoom_canvas_size, number_of_iterations, number_of_images_per_shape, seed,
+                                 max_workers, images_folder=os.path.join('generated_images', f'{width}x{height}_zoom'),
+                                 shape_scale=get_shape_scale(zoom_canvas_size), tiles=zoom_tiles, **kwargs)
+
+
+if __name__ == '__main__':
+    generate_network_images(zoom_canvas_size=REFERENCE_CANVAS_SIZE)
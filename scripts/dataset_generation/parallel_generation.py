@@ -0,0 +1,224 @@
+"""
+Generate a dataset for detecting shapes on several processes
+
+The (iteration, canvas color, shape, index) work space is cut into work items of a fixed number of images.
+Every work item derives its own seed from the master seed and its position in the work space,
+so the generated files only depend on the master seed and never on the number of workers.
+Given a run_manifest.RunManifest, the files of every work item are checksummed once written and recorded, and the work
+items recorded already only regenerate their missing or damaged files.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Tuple, List, NamedTuple
+
+import numpy as np
+
+from augmentation import AugmentationParameters
+from image_encoding import EncoderParameters
+from dataset_generation import all_shapes, colors, generate_shape_images
+from image_writer import ImageWriter
+from instrumentation import Instrumentation, get_instrumentation, set_instrumentation
+from network_resolution import TileParameters
+from run_manifest import RunManifest, compute_file_checksum, remove_damaged_files
+from shard_format import ShardWriter
+
+
+class GenerationWorkItem(NamedTuple):
+    """
+    A range of images of a single shape within one iteration
+    """
+    canvas_size: Tuple[int, int]
+    generated_images_folder: str
+    colors_to_use: Tuple[str, str, str]
+    shape: str
+    first_image_index: int
+    number_of_images: int
+    seed_sequence: np.random.SeedSequence
+    draw_bounding_box: bool = False
+    write_shards: bool = False
+    augmentation: AugmentationParameters = None
+    shape_scale: float = 1.0
+    tiles: TileParameters = None
+    encoder: EncoderParameters = None
+    # the unix time written in the DarkMark json of every image, defaults to now
+    timestamp: int = None
+    # the checksums of the files of the work item when a run manifest recorded it, relative to the images folder
+    recorded_files: Dict[str, str] = None
+    # read the recorded files to compare their checksums, otherwise only missing files are regenerated
+    verify_checksums: bool = True
+    # the encoding threads of the ImageWriter of the work item, defaults to the number of cpus
+    encode_workers: int = None
+
+
+class WorkItemResult(NamedTuple):
+    # the number of images generated, 0 when every file of the work item was already there
+    number_of_images: int
+    # the checksum of every file of the work item, relative to the images folder
+    files: Dict[str, str]
+
+
+def get_work_item_key(work_item: GenerationWorkItem) -> str:
+    """
+    Get the name of a work item in a run manifest, {canvas color}/{shape}_{shape color}_{first image index}
+    """
+    return f'{work_item.colors_to_use[0]}/{work_item.shape}_{work_item.colors_to_use[1]}_{work_item.first_image_index}'
+
+
+def create_random_state(master_seed: int, *spawn_key: int) -> np.random.RandomState:
+    """
+    Create a random state that is independent for every spawn key derived from the master seed
+    """
+    seed_sequence = np.random.SeedSequence(master_seed, spawn_key=spawn_key)
+    return np.random.RandomState(np.random.MT19937(seed_sequence))
+
+
+def pick_iteration_colors(master_seed: int, iteration: int) -> Tuple[str, str, str]:
+    """
+    Pick the canvas, shape and bounding box colors of an iteration
+    """
+    random_state = create_random_state(master_seed, iteration)
+    colors_to_manipulate = list(colors.keys())
+    picked = random_state.choice(len(colors_to_manipulate), 3, replace=False)
+    return tuple(colors_to_manipulate[i] for i in picked)
+
+
+def plan_work_items(canvas_size: Tuple[int, int], generated_images_folder: str, number_of_iterations: int,
+                    number_of_images_per_shape: int, master_seed: int, images_per_work_item: int = 64,
+                    draw_bounding_box=False, write_shards=False,
+                    augmentation: AugmentationParameters = None, shape_scale: float = 1.0,
+                    tiles: TileParameters = None, encoder: EncoderParameters = None, first_image_index: int = 0,
+                    first_chunk_index: int = 0, timestamp: int = None) -> List[GenerationWorkItem]:
+    """
+    Cut the (iteration, canvas color, shape, index) work space into work items
+    Image indexes continue across iterations so files of iterations picking the same colors never collide
+    :param write_shards: Every work item packs its samples into a single shard named after its shape and first index
+    :param augmentation: The parameters every work item augments its shapes with
+    :param shape_scale: The scale of the shape sizes
+    :param tiles: The parameters of the tiles every canvas is cut into
+    :param encoder: The encoding of the images, defaults to jpg
+    :param first_image_index: The index of the first image, see run_manifest.GenerationRound
+    :param first_chunk_index: The chunk index of the first work item of every shape and iteration, in the spawn key
+    of its seed
+    :param timestamp: The DarkMark timestamp of the images, defaults to now
+    """
+    work_items = []
+    for iteration in range(number_of_iterations):
+        colors_to_use = pick_iteration_colors(master_seed, iteration)
+        iteration_first_image_index = first_image_index + iteration * number_of_images_per_shape
+        for shape_index, shape in enumerate(all_shapes):
+            for chunk_index, chunk_start in enumerate(range(0, number_of_images_per_shape, images_per_work_item),
+                                                      start=first_chunk_index):
+                number_of_images = min(images_per_work_item, number_of_images_per_shape - chunk_start)
+                seed_sequence = np.random.SeedSequence(master_seed, spawn_key=(iteration, shape_index, chunk_index))
+                work_items.append(GenerationWorkItem(canvas_size, generated_images_folder, colors_to_use, shape,
+                                                     iteration_first_image_index + chunk_start, number_of_images,
+                                                     seed_sequence, draw_bounding_box, write_shards,
+                                                     augmentation, shape_scale, tiles, encoder, timestamp))
+    return work_items
+
+
+def run_work_item(work_item: GenerationWorkItem) -> WorkItemResult:
+    """
+    Generate the images of a work item with its own random state
+    A work item with recorded files only regenerates the files that are missing or whose checksum changed, the
+    images are rendered again to replay its random state but the files that are there are not written again
+    :return: the number of images generated and the checksums of the files of the work item
+    """
+    folder = work_item.generated_images_folder
+    overwrite = True
+    if work_item.recorded_files is not None:
+        damaged_files = remove_damaged_files(folder, work_item.recorded_files, work_item.verify_checksums)
+        if not damaged_files:
+            return WorkItemResult(0, work_item.recorded_files)
+        # a shard is written in one go, so it is generated again from scratch
+        overwrite = work_item.write_shards
+
+    random_state = np.random.RandomState(np.random.MT19937(work_item.seed_sequence))
+    shard_writer = None
+    if work_item.write_shards:
+        shard_writer = ShardWriter(folder, folder, work_item.number_of_images,
+                                   shard_prefix=f'{work_item.shape}-{work_item.first_image_index:08d}')
+    with ImageWriter(encode_workers=work_item.encode_workers, shard_writer=shard_writer, overwrite=overwrite,
+                     record_checksums=True, encoder=work_item.encoder) as image_writer:
+        generate_shape_images(work_item.canvas_size, work_item.shape, list(work_item.colors_to_use),
+                              folder, work_item.number_of_images,
+                              work_item.first_image_index, work_item.draw_bounding_box, random_state=random_state,
+                              image_writer=image_writer, augmentation=work_item.augmentation,
+                              shape_scale=work_item.shape_scale, tiles=work_item.tiles,
+                              timestamp=work_item.timestamp)
+
+    if shard_writer is None:
+        files = dict(work_item.recorded_files or {}) if not overwrite else {}
+        files.update((os.path.relpath(path, folder), checksum) for path, checksum in image_writer.checksums.items())
+    else:
+        shard_files = shard_writer.shard_paths + [os.path.splitext(path)[0] + '.json'
+                                                  for path in shard_writer.shard_paths]
+        files = {os.path.relpath(path, folder): compute_file_checksum(path) for path in shard_files}
+    return WorkItemResult(image_writer.images_written, files)
+
+
+def run_instrumented_work_item(work_item: GenerationWorkItem) -> Tuple[WorkItemResult, dict]:
+    """
+    Run a work item on a worker process with its own instrumentation
+    :return: the result of the work item and the snapshot of the instrumentation to merge in the main process
+    """
+    instrumentation = Instrumentation()
+    previous_instrumentation = set_instrumentation(instrumentation)
+    try:
+        result = run_work_item(work_item)
+    finally:
+        set_instrumentation(previous_instrumentation)
+    return result, instrumentation.snapshot()
+
+
+def attach_recorded_files(work_items: List[GenerationWorkItem], manifest: RunManifest,
+                          verify_checksums: bool = True) -> List[GenerationWorkItem]:
+    """
+    Attach the files the manifest recorded for every work item, so completed work items are skipped
+    """
+    return [work_item._replace(recorded_files=manifest.get_recorded_files(get_work_item_key(work_item),
+                                                                          work_item.number_of_images),
+                               verify_checksums=verify_checksums)
+            for work_item in work_items]
+
+
+def run_work_items(work_items: List[GenerationWorkItem], max_workers: int = None,
+                   manifest: RunManifest = None) -> int:
+    """
+    Run the work items on max_workers processes, defaults to the number of cpus
+    Work items are run in the current process when max_workers is 1
+    The stages recorded by the workers are merged into the instrumentation of the current process when it is enabled
+    :param manifest: Record every work item in this manifest as soon as it is done, see attach_recorded_files
+    :return: the number of images generated
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count()
+    instrumentation = get_instrumentation()
+    number_of_images = 0
+    if max_workers == 1:
+        for work_item in work_items:
+            result = run_work_item(work_item)
+            number_of_images += result.number_of_images
+            if manifest is not None:
+                manifest.record(get_work_item_key(work_item), work_item.number_of_images, result.files)
+        return number_of_images
+
+    # every process encodes its own images, so the cpus are shared between the encoding threads of the processes
+    encode_workers = max(1, (os.cpu_count() or 1) // max_workers)
+    run = run_instrumented_work_item if instrumentation.enabled else run_work_item
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(run, work_item._replace(encode_workers=encode_workers)): work_item
+                   for work_item in work_items}
+        for work_items_done, future in enumerate(as_completed(futures), start=1):
+            if instrumentation.enabled:
+                result, snapshot = future.result()
+                instrumentation.merge(snapshot)
+            else:
+                result = future.result()
+            number_of_images += result.number_of_images
+            if manifest is not None:
+                work_item = futures[future]
+                manifest.record(get_work_item_key(work_item), work_item.number_of_images, result.files)
+            instrumentation.progress(f'Generated {number_of_images} images, {work_items_done}/{len(futures)} '
+                                     f'work items done')
+    return number_of_images
@@ -0,0 +1,214 @@
+"""
+Record the progress of a generation run so it can be resumed after a crash and grown later on
+
+The run manifest is a json lines file in the generated images folder.
+Its first line holds the master seed, the configuration and the DarkMark timestamp of the run, then a line is appended
+for every round of images per shape and for every work item once its files are written, with the crc32 of every file.
+Appending keeps the cost of a checkpoint independent of the size of the run, and a line cut short by a killed run is
+ignored when the manifest is read again.
+
+run_manifest.jsonl
+    {"seed": 42, "config": {"canvas_size": [640, 480], ...}, "timestamp": 1760000000}
+    {"round": [1000, 0, 0]}
+    {"item": "aqua/circle_gold_0", "number_of_images": 64, "files": {"aqua/circle_gold_0.jpg": "1c291ca3", ...}}
+"""
+import json
+import os
+import random
+import time
+import zlib
+from typing import Dict, List, NamedTuple
+
+MANIFEST_FILE_NAME = 'run_manifest.jsonl'
+
+CHECKSUM_CHUNK_SIZE = 1 << 20
+
+
+class GenerationRound(NamedTuple):
+    # the images of every shape added to every iteration by the round
+    number_of_images_per_shape: int
+    # the index of the first image of the round, the images of the earlier rounds come first
+    first_image_index: int
+    # the chunk index of the first work item of the round, so the work items of every round get their own seeds
+    first_chunk_index: int
+
+
+def compute_checksum(data: bytes) -> str:
+    """
+    Get the crc32 of data as 8 hex digits
+    """
+    return f'{zlib.crc32(data):08x}'
+
+
+def compute_file_checksum(path: str) -> str:
+    """
+    Get the crc32 of the content of a file as 8 hex digits
+    """
+    checksum = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHECKSUM_CHUNK_SIZE), b''):
+            checksum = zlib.crc32(chunk, checksum)
+    return f'{checksum:08x}'
+
+
+def remove_damaged_files(folder: str, recorded_files: Dict[str, str], verify_checksums: bool = True) -> List[str]:
+    """
+    Find the recorded files that are missing or whose checksum changed, the damaged files are deleted
+    :param recorded_files: The checksum of every file, mapping its path relative to folder to its checksum
+    :param verify_checksums: Read every file to compare its checksum, otherwise only missing files are found
+    :return: the relative paths of the files to regenerate
+    """
+    damaged_files = []
+    for relative_path, checksum in recorded_files.items():
+        path = os.path.join(folder, relative_path)
+        if not os.path.isfile(path):
+            damaged_files.append(relative_path)
+        elif verify_checksums and compute_file_checksum(path) != checksum:
+            os.remove(path)
+            damaged_files.append(relative_path)
+    return damaged_files
+
+
+def normalize_config(config: Dict) -> Dict:
+    """
+    Get the config as it reads back from json, NamedTuples given with _asdict() and tuples turned into lists
+    """
+    return json.loads(json.dumps(config))
+
+
+class RunManifest:
+    """
+    The seed, configuration, rounds and completed work items of a generation run
+
+    manifest = RunManifest.open('generated_images', seed, config)
+    for generation_round in manifest.plan_rounds(number_of_images_per_shape, images_per_work_item):
+        ...
+    manifest.record('aqua/circle_gold_0', 64, files)
+    """
+
+    def __init__(self, path: str, seed: int, config: Dict, rounds: List[GenerationRound] = None,
+                 completed: Dict[str, tuple] = None, needs_newline: bool = False, timestamp: int = None):
+        self.path = path
+        self.seed = seed
+        self.config = config
+        # the unix time written in the DarkMark json of every image, so resumed work items write the same files
+        self.timestamp = timestamp
+        self.rounds = rounds or []
+        # the number of images and the checksums of the files of every completed work item
+        self.completed = completed or {}
+        self._needs_newline = needs_newline
+
+    @classmethod
+    def open(cls, folder: str, seed: int = None, config: Dict = None, timestamp: int = None) -> 'RunManifest':
+        """
+        Read the manifest of folder, or start one when there is none
+        :param seed: The master seed, defaults to the seed of the manifest or to a random seed for a new one
+        :param config: The configuration of the run, every setting changing the generated files
+        :param timestamp: The DarkMark timestamp, defaults to the timestamp of the manifest or to now for a new one
+        :raises ValueError: if the seed, the configuration or the timestamp differ from those of the manifest
+        """
+        path = os.path.join(folder, MANIFEST_FILE_NAME)
+        config = normalize_config(config or {})
+        if not os.path.isfile(path):
+            if seed is None:
+                seed = random.SystemRandom().getrandbits(64)
+            if timestamp is None:
+                timestamp = int(time.time())
+            manifest = cls(path, seed, config, timestamp=timestamp)
+            manifest._append({'seed': seed, 'config': config, 'timestamp': timestamp})
+            return manifest
+
+        manifest = cls.read(path)
+        if seed is not None and seed != manifest.seed:
+            raise ValueError(f'{path} was generated with seed {manifest.seed}, resume with that seed or generate '
+                             f'seed {seed} in another folder')
+        if timestamp is not None and timestamp != manifest.timestamp:
+            raise ValueError(f'{path} was generated with timestamp {manifest.timestamp}, resume with that timestamp '
+                             f'or generate timestamp {timestamp} in another folder')
+        changed = sorted(key for key in set(config) | set(manifest.config)
+                         if config.get(key) != manifest.config.get(key))
+        if changed:
+            raise ValueError(f'{path} was generated with other settings for {", ".join(changed)}, '
+                             f'resume with the same settings or generate in another folder')
+        return manifest
+
+    @classmethod
+    def read(cls, path: str) -> 'RunManifest':
+        """
+        Read a manifest, skipping the lines a killed run could not finish
+        :raises ValueError: if the first line does not hold the seed and the configuration
+        """
+        with open(path, 'rb') as f:
+            content = f.read()
+        lines = content.decode(errors='replace').splitlines()
+        try:
+            header = json.loads(lines[0])
+            seed, config = header['seed'], header['config']
+        except (IndexError, KeyError, TypeError, ValueError):
+            raise ValueError(f'{path} does not start with the seed and configuration of a run')
+        rounds = []
+        completed = {}
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if 'round' in entry:
+                rounds.append(GenerationRound(*entry['round']))
+            elif 'item' in entry:
+                completed[entry['item']] = (entry['number_of_images'], entry['files'])
+        return cls(path, seed, config, rounds, completed, needs_newline=not content.endswith(b'\n'),
+                   timestamp=header.get('timestamp'))
+
+    def plan_rounds(self, number_of_images_per_shape: int, images_per_work_item: int) -> List[GenerationRound]:
+        """
+        Get the rounds holding number_of_images_per_shape images per shape, adding a round for the missing images
+        The images of a new round are numbered after those of the earlier rounds of every iteration, so growing a run
+        leaves the files of the earlier rounds untouched
+        :param images_per_work_item: The images of every work item, the chunks of a round are numbered from its
+        first_chunk_index
+        :raises ValueError: if the manifest already holds more images per shape
+        """
+        number_of_iterations = self.config.get('number_of_iterations', 1)
+        recorded_images_per_shape = sum(generation_round.number_of_images_per_shape for generation_round in self.rounds)
+        if number_of_images_per_shape < recorded_images_per_shape:
+            raise ValueError(f'{self.path} already holds {recorded_images_per_shape} images per shape, '
+                             f'more than {number_of_images_per_shape}')
+        if number_of_images_per_shape > recorded_images_per_shape:
+            if self.rounds:
+                last_round = self.rounds[-1]
+                first_image_index = (last_round.first_image_index
+                                     + number_of_iterations * last_round.number_of_images_per_shape)
+                first_chunk_index = (last_round.first_chunk_index
+                                     - (-last_round.number_of_images_per_shape // images_per_work_item))
+            else:
+                first_image_index = first_chunk_index = 0
+            generation_round = GenerationRound(number_of_images_per_shape - recorded_images_per_shape,
+                                               first_image_index, first_chunk_index)
+            self.rounds.append(generation_round)
+            self._append({'round': list(generation_round)})
+        return list(self.rounds)
+
+    def get_recorded_files(self, item: str, number_of_images: int) -> Dict[str, str]:
+        """
+        Get the checksums of the files of a completed work item, None when it was not completed
+        """
+        number_of_recorded_images, files = self.completed.get(item, (None, None))
+        return files if number_of_recorded_images == number_of_images else None
+
+    def record(self, item: str, number_of_images: int, files: Dict[str, str]):
+        """
+        Record a completed work item and the checksums of its files, relative to the folder of the manifest
+        """
+        if self.completed.get(item) == (number_of_images, files):
+            return
+        self.completed[item] = (number_of_images, files)
+        self._append({'item': item, 'number_of_images': number_of_images, 'files': files})
+
+    def _append(self, entry: Dict):
+        with open(self.path, 'a') as f:
+            if self._needs_newline:
+                # end the line a killed run left unfinished
+                f.write('\n')
+                self._needs_newline = False
+            f.write(json.dumps(entry) + '\n')
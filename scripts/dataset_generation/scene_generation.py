@@ -0,0 +1,202 @@
+"""
+Generate scenes holding several shapes per image
+
+Shapes are placed one after the other against an occupancy grid of the canvas.
+For every shape a batch of candidate positions is scored at once with the summed area table of the grid,
+so placing a shape costs the same whether the scene already holds one shape or dozens.
+"""
+import math
+import os
+import sys
+from typing import Tuple, List, NamedTuple
+
+import numpy as np
+
+# the instrumentation shared by the scripts sits in its own folder next to this one
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'instrumentation'))
+
+from dataset_generation import (all_shapes, colors, shape_to_index, convert_hex_color_to_rgb, create_blank_canvas,
+                                add_shape_to_canvas, generate_shape_size, get_max_bounding_box,
+                                convert_bounding_boxes_to_darknet, format_darknet_label, make_dir_if_not_exist)
+from darkmark_format import format_darkmark_json
+from image_writer import ImageWriter
+from instrumentation import get_instrumentation
+
+
+class ScenePlacement(NamedTuple):
+    shape: str
+    shape_center: Tuple[int, int]
+    shape_size: Tuple[int, int]
+    max_bounding_box: Tuple[int, int, int, int]
+
+
+class OccupancyGrid:
+    """
+    Cells of the canvas covered by the max bounding boxes placed so far
+    A box covers every cell it touches, so boxes that do not share a cell never overlap
+    """
+
+    def __init__(self, canvas_size: Tuple[int, int], cell_size: int = 8):
+        width, height = canvas_size
+        self.cell_size = cell_size
+        self.cells = np.zeros((math.ceil(height / cell_size), math.ceil(width / cell_size)), np.int32)
+        self._summed_area_table = None
+
+    def _cell_ranges(self, boxes: np.ndarray):
+        rows, columns = self.cells.shape
+        # (x_start, y_start, x_end, y_end) rounded outwards to whole cells and clipped to the grid
+        cell_ranges = np.empty((4, len(boxes)), np.int64)
+        np.floor_divide(boxes[:, :2].T, self.cell_size, out=cell_ranges[:2])
+        np.negative(np.floor_divide(-boxes[:, 2:].T, self.cell_size), out=cell_ranges[2:])
+        np.maximum(cell_ranges, 0, out=cell_ranges)
+        np.minimum(cell_ranges[0::2], columns, out=cell_ranges[0::2])
+        np.minimum(cell_ranges[1::2], rows, out=cell_ranges[1::2])
+        return cell_ranges
+
+    def occupied_fractions(self, boxes: np.ndarray) -> np.ndarray:
+        """
+        Get the fraction of the cells of every (x1, y1, x2, y2) box that are already occupied
+        """
+        if self._summed_area_table is None:
+            self._summed_area_table = np.zeros((self.cells.shape[0] + 1, self.cells.shape[1] + 1), np.int32)
+            np.cumsum(self.cells > 0, axis=0, dtype=np.int32, out=self._summed_area_table[1:, 1:])
+            np.cumsum(self._summed_area_table[1:, 1:], axis=1, out=self._summed_area_table[1:, 1:])
+        table = self._summed_area_table
+        x_start, y_start, x_end, y_end = self._cell_ranges(boxes)
+        occupied = table[y_end, x_end] - table[y_start, x_end] - table[y_end, x_start] + table[y_start, x_start]
+        number_of_cells = np.maximum((x_end - x_start) * (y_end - y_start), 1)
+        return occupied / number_of_cells
+
+    def occupy(self, box: Tuple[int, int, int, int]):
+        x_start, y_start, x_end, y_end = (int(value[0]) for value in self._cell_ranges(np.array([box])))
+        self.cells[y_start:y_end, x_start:x_end] += 1
+        self._summed_area_table = None
+
+
+def get_relative_max_bounding_box(shape: str, shape_size: Tuple[int, int], stroke_width: int):
+    """
+    Get the max bounding box add_shape_to_canvas returns for a shape centered on (0, 0)
+    """
+    max_bounding_box = get_max_bounding_box(shape, (0, 0), shape_size)
+    stroke_width_padding = stroke_width * 2
+    return (max_bounding_box[0] - stroke_width_padding, max_bounding_box[1] - stroke_width_padding,
+            max_bounding_box[2] + stroke_width_padding, max_bounding_box[3] + stroke_width_padding)
+
+
+def place_shapes(canvas_size: Tuple[int, int], shapes: List[str], stroke_width: int = 4, max_overlap: float = 0.0,
+                 canvas_padding: int = 20, candidates_per_shape: int = 32, cell_size: int = 8,
+                 random_state: np.random.RandomState = None) -> List[ScenePlacement]:
+    """
+    Place the shapes one after the other so each covers at most max_overlap of its max bounding box cells
+    with the shapes placed before it
+    Shapes without any acceptable candidate position are left out of the scene
+    :param random_state: The random state to draw from, defaults to the global numpy random state
+    """
+    if random_state is None:
+        random_state = np.random
+    width, height = canvas_size
+    occupancy_grid = OccupancyGrid(canvas_size, cell_size)
+    placements = []
+    for shape in shapes:
+        shape_size = tuple(int(value) for value in generate_shape_size(shape, random_state))
+        relative_box = get_relative_max_bounding_box(shape, shape_size, stroke_width)
+        # keep the whole max bounding box within the padding of the canvas
+        x_low, x_high = canvas_padding - relative_box[0], width - canvas_padding - relative_box[2]
+        y_low, y_high = canvas_padding - relative_box[1], height - canvas_padding - relative_box[3]
+        # an odd sized shape leaves a window of less than a pixel that may not hold a whole position
+        if math.floor(x_high) <= math.ceil(x_low) or math.floor(y_high) <= math.ceil(y_low):
+            continue
+
+        x = random_state.randint(math.ceil(x_low), math.floor(x_high), size=candidates_per_shape)
+        y = random_state.randint(math.ceil(y_low), math.floor(y_high), size=candidates_per_shape)
+        boxes = np.stack([x + relative_box[0], y + relative_box[1], x + relative_box[2], y + relative_box[3]],
+                         axis=1).astype(np.int64)
+        acceptable = np.flatnonzero(occupancy_grid.occupied_fractions(boxes) <= max_overlap)
+        if len(acceptable) == 0:
+            continue
+
+        candidate = acceptable[0]
+        max_bounding_box = tuple(int(value) for value in boxes[candidate])
+        occupancy_grid.occupy(max_bounding_box)
+        placements.append(ScenePlacement(shape, (int(x[candidate]), int(y[candidate])), shape_size,
+                                         max_bounding_box))
+    return placements
+
+
+def render_scene(canvas_size: Tuple[int, int], placements: List[ScenePlacement], canvas_color=(0, 0, 0),
+                 color=(0, 0, 0), stroke_width: int = 4, draw_bounding_box=False, bounding_box_color=(0, 0, 0),
+                 timestamp: int = None):
+    """
+    Draw the placed shapes on a blank canvas
+    :param timestamp: The unix time written in the DarkMark json, defaults to now
+    :return: the canvas, its darknet label with one line per shape and its DarkMark json with one mark per shape
+    """
+    canvas = create_blank_canvas(canvas_size, canvas_color)
+    max_bounding_boxes = []
+    for placement in placements:
+        canvas, max_bounding_box = add_shape_to_canvas(
+            canvas, placement.shape, shape_center=placement.shape_center, shape_size=placement.shape_size,
+            color=color, stroke_width=stroke_width, draw_bounding_box=draw_bounding_box,
+            bounding_box_color=bounding_box_color)
+        max_bounding_boxes.append(max_bounding_box)
+    if not placements:
+        return canvas, '', format_darkmark_json(canvas_size, [], [], np.empty((0, 4)), timestamp)
+
+    darknet_boxes = convert_bounding_boxes_to_darknet(np.array(max_bounding_boxes),
+                                                      np.array([placement.shape_size for placement in placements]),
+                                                      canvas_size)
+    object_classes = [shape_to_index[placement.shape] for placement in placements]
+    label = '\n'.join(format_darknet_label(object_class, darknet_box)
+                      for object_class, darknet_box in zip(object_classes, darknet_boxes))
+    darkmark_json = format_darkmark_json(canvas_size, object_classes,
+                                         [placement.shape for placement in placements], darknet_boxes, timestamp)
+    return canvas, label, darkmark_json
+
+
+def generate_scene_images(canvas_size: Tuple[int, int], colors_to_use: List[str], generated_images_folder: str,
+                          number_of_images: int = 15, shapes_per_image: int = 8, max_overlap: float = 0.0,
+                          first_image_index: int = 0, draw_bounding_box=False,
+                          random_state: np.random.RandomState = None, image_writer: ImageWriter = None,
+                          timestamp: int = None):
+    """
+    Generate images holding shapes_per_image random shapes each, saved as scene_{shape color}_{i}
+    :param max_overlap: The fraction of the max bounding box of a shape that may overlap the shapes placed before it
+    :param random_state: The random state to draw from, defaults to the global numpy random state
+    :param image_writer: The writer encoding and saving the files, a new one is used for this call when not given
+    :param timestamp: The unix time written in the DarkMark json, defaults to now
+    """
+    if image_writer is None:
+        with ImageWriter() as image_writer:
+            generate_scene_images(canvas_size, colors_to_use, generated_images_folder, number_of_images,
+                                  shapes_per_image, max_overlap, first_image_index, draw_bounding_box, random_state,
+                                  image_writer, timestamp)
+        return
+    if random_state is None:
+        random_state = np.random
+
+    canvas_color_key = colors_to_use[0]
+    canvas_color = convert_hex_color_to_rgb(colors[canvas_color_key])
+    background_color_key = colors_to_use[1]
+    background_color = convert_hex_color_to_rgb(colors[background_color_key])
+    bounding_box_color = convert_hex_color_to_rgb(colors[colors_to_use[2]])
+
+    # parent directory for all the generated images with this canvas color
+    generated_images_dir = os.path.join(generated_images_folder, canvas_color_key)
+    if image_writer.shard_writer is None:
+        make_dir_if_not_exist(generated_images_dir)
+
+    instrumentation = get_instrumentation()
+    for i in range(first_image_index, first_image_index + number_of_images):
+        shapes = [all_shapes[shape_index] for shape_index in random_state.randint(0, len(all_shapes),
+                                                                                  size=shapes_per_image)]
+        with instrumentation.stage('render', items=1):
+            placements = place_shapes(canvas_size, shapes, max_overlap=max_overlap, random_state=random_state)
+            canvas, label, darkmark_json = render_scene(canvas_size, placements, canvas_color, background_color,
+                                                        draw_bounding_box=draw_bounding_box,
+                                                        bounding_box_color=bounding_box_color, timestamp=timestamp)
+        instrumentation.count('images_rendered', 1)
+        generated_image_file = os.path.join(generated_images_dir, f'scene_{background_color_key}_{i}')
+        image_writer.submit(generated_image_file + image_writer.encoder.extension, canvas,
+                            {f'{generated_image_file}.txt': label, f'{generated_image_file}.json': darkmark_json})
+        instrumentation.progress(f'Queued {i - first_image_index + 1}/{number_of_images} scenes for '
+                                 f'{generated_images_dir}')
@@ -0,0 +1,282 @@
+"""
+Stream generated shapes straight to a training loop without writing anything to disk
+
+Batches are (images, labels) with (N, H, W, 3) uint8 BGR images and (N, 5) float32 labels of
+<object-class> <x_center> <y_center> <width> <height>, the darknet label of every image.
+
+iterate_shape_batches renders the batches in the current process.
+SharedMemoryShapeStream renders them on producer processes into the slots of a multiprocessing.shared_memory ring,
+consumers in any process read the slots in place, so batches are never pickled nor copied.
+
+with SharedMemoryShapeStream(batch_size=64, number_of_producers=4, seed=42) as stream:
+    for images, labels in stream.ring.batches():
+        ...
+"""
+import multiprocessing
+import queue
+import threading
+from multiprocessing import shared_memory
+from typing import Iterator, List, Sequence, Tuple
+
+import numpy as np
+
+from dataset_generation import (all_shapes, colors, shape_to_index, convert_hex_color_to_rgb, generate_shape_sizes,
+                                generate_shape_centers, render_shape_batch)
+
+LABEL_COLUMNS = 5
+
+# Put on the filled queue to tell consumers the producers are done
+_STOP = -1
+
+
+def generate_shape_batch(canvas_size: Tuple[int, int] = (640, 480), batch_size: int = 64,
+                         shapes: Sequence[str] = None, random_state: np.random.RandomState = None,
+                         images: np.ndarray = None, labels: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Render a batch of random shapes, the canvas and shape colors are picked once per batch
+    Images are grouped by shape within the batch since each shape is rendered with a single render_shape_batch call
+    :param shapes: The shapes to draw from, defaults to all_shapes
+    :param random_state: The random state to draw from, defaults to the global numpy random state
+    :param images: Render into this (N, H, W, 3) uint8 array instead of a new one
+    :param labels: Write the labels into this (N, 5) float32 array instead of a new one
+    :return: the images and the labels
+    """
+    if shapes is None:
+        shapes = all_shapes
+    if random_state is None:
+        random_state = np.random
+    width, height = canvas_size
+    if images is None:
+        images = np.empty((batch_size, height, width, 3), np.uint8)
+    if labels is None:
+        labels = np.empty((batch_size, LABEL_COLUMNS), np.float32)
+
+    color_keys = list(colors.keys())
+    canvas_color_index, shape_color_index = random_state.choice(len(color_keys), 2, replace=False)
+    canvas_color = convert_hex_color_to_rgb(colors[color_keys[canvas_color_index]])
+    shape_color = convert_hex_color_to_rgb(colors[color_keys[shape_color_index]])
+
+    shape_counts = random_state.multinomial(batch_size, [1 / len(shapes)] * len(shapes))
+    start = 0
+    for shape, shape_count in zip(shapes, shape_counts.tolist()):
+        if shape_count == 0:
+            continue
+        end = start + shape_count
+        shape_sizes = generate_shape_sizes(shape, shape_count, random_state)
+        shape_centers = generate_shape_centers(canvas_size, shape_sizes, random_state=random_state)
+        # images[start:end] is a view so the shapes are drawn straight into the batch
+        _, _, darknet_boxes = render_shape_batch(canvas_size, shape, shape_centers, shape_sizes, canvas_color,
+                                                 shape_color, stroke_width=4, canvases=images[start:end])
+        labels[start:end, 0] = shape_to_index[shape]
+        labels[start:end, 1:] = darknet_boxes
+        start = end
+    return images, labels
+
+
+def iterate_shape_batches(canvas_size: Tuple[int, int] = (640, 480), batch_size: int = 64,
+                          number_of_batches: int = None, shapes: Sequence[str] = None,
+                          seed: int = None) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Yield batches of generate_shape_batch, endlessly when number_of_batches is None
+    Every batch is a new array so a batch can be kept while the next ones are rendered
+    """
+    random_state = np.random.RandomState(np.random.MT19937(np.random.SeedSequence(seed)))
+    batch_number = 0
+    while number_of_batches is None or batch_number < number_of_batches:
+        yield generate_shape_batch(canvas_size, batch_size, shapes, random_state)
+        batch_number += 1
+
+
+def iterate_shape_images(canvas_size: Tuple[int, int] = (640, 480), number_of_images: int = None,
+                         shapes: Sequence[str] = None, seed: int = None,
+                         batch_size: int = 64) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Yield (image, label) pairs, endlessly when number_of_images is None
+    Images are rendered batch_size at a time and shuffled within their batch
+    """
+    random_state = np.random.RandomState(np.random.MT19937(np.random.SeedSequence(seed)))
+    images_yielded = 0
+    while number_of_images is None or images_yielded < number_of_images:
+        images, labels = generate_shape_batch(canvas_size, batch_size, shapes, random_state)
+        for i in random_state.permutation(batch_size).tolist():
+            if number_of_images is not None and images_yielded >= number_of_images:
+                return
+            yield images[i], labels[i]
+            images_yielded += 1
+
+
+class ShapeBatchRing:
+    """
+    A ring of batch slots in shared memory, a slot index is either free, being written, filled or being read
+    The ring can be passed to other processes, they attach to the same shared memory
+    """
+
+    def __init__(self, canvas_size: Tuple[int, int] = (640, 480), batch_size: int = 64, number_of_slots: int = 8):
+        self.canvas_size = canvas_size
+        self.batch_size = batch_size
+        self.number_of_slots = number_of_slots
+        width, height = canvas_size
+        self._images_shape = (number_of_slots, batch_size, height, width, 3)
+        self._labels_shape = (number_of_slots, batch_size, LABEL_COLUMNS)
+        images_size = int(np.prod(self._images_shape))
+        labels_size = int(np.prod(self._labels_shape)) * np.dtype(np.float32).itemsize
+        self._shared_memory = shared_memory.SharedMemory(create=True, size=images_size + labels_size)
+        self._owner = True
+        self.free_slots = multiprocessing.Queue()
+        self.filled_slots = multiprocessing.Queue()
+        self.stop_event = multiprocessing.Event()
+        for slot in range(number_of_slots):
+            self.free_slots.put(slot)
+        self._create_views()
+
+    def _create_views(self):
+        images_size = int(np.prod(self._images_shape))
+        self.images = np.ndarray(self._images_shape, np.uint8, self._shared_memory.buf)
+        self.labels = np.ndarray(self._labels_shape, np.float32, self._shared_memory.buf, offset=images_size)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['images'], state['labels']
+        state['_owner'] = False
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._create_views()
+
+    def slot(self, slot: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get the images and labels of a slot, both are views of the shared memory
+        """
+        return self.images[slot], self.labels[slot]
+
+    def acquire_free_slot(self, timeout: float = None) -> int:
+        """
+        Get a slot to write, blocks while every slot is filled or being read
+        :raises queue.Empty: if no slot was freed within timeout seconds
+        """
+        return self.free_slots.get(timeout=timeout)
+
+    def publish_slot(self, slot: int):
+        self.filled_slots.put(slot)
+
+    def acquire_filled_slot(self, timeout: float = None) -> int:
+        """
+        Get a slot to read, blocks until a producer fills one
+        :return: the slot or None once the producers are done
+        :raises queue.Empty: if no slot was filled within timeout seconds
+        """
+        slot = self.filled_slots.get(timeout=timeout)
+        if slot == _STOP:
+            # let the other consumers see it too
+            self.filled_slots.put(_STOP)
+            return None
+        return slot
+
+    def release_slot(self, slot: int):
+        self.free_slots.put(slot)
+
+    def batches(self) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Yield the filled batches until the producers are done
+        A batch is a view of its slot, it is only valid until the next batch is requested, copy it to keep it
+        """
+        while True:
+            slot = self.acquire_filled_slot()
+            if slot is None:
+                return
+            try:
+                yield self.slot(slot)
+            finally:
+                self.release_slot(slot)
+
+    def close(self):
+        """
+        Detach from the shared memory, the process that created the ring also frees it
+        """
+        self.images = None
+        self.labels = None
+        self._shared_memory.close()
+        if self._owner:
+            self._shared_memory.unlink()
+
+
+def produce_shape_batches(ring: ShapeBatchRing, seed_sequence: np.random.SeedSequence, shapes: Sequence[str] = None,
+                          number_of_batches: int = None):
+    """
+    Fill free slots of the ring until stop_event is set or number_of_batches batches are produced
+    """
+    random_state = np.random.RandomState(np.random.MT19937(seed_sequence))
+    batch_number = 0
+    while not ring.stop_event.is_set() and (number_of_batches is None or batch_number < number_of_batches):
+        try:
+            slot = ring.acquire_free_slot(timeout=0.1)
+        except queue.Empty:
+            continue
+        images, labels = ring.slot(slot)
+        generate_shape_batch(ring.canvas_size, ring.batch_size, shapes, random_state, images, labels)
+        ring.publish_slot(slot)
+        batch_number += 1
+
+
+class SharedMemoryShapeStream:
+    """
+    Producer processes filling a ShapeBatchRing with generated batches
+    Consumers read ring.batches() in this process or in processes given the ring
+    """
+
+    def __init__(self, canvas_size: Tuple[int, int] = (640, 480), batch_size: int = 64,
+                 number_of_producers: int = None, number_of_slots: int = None, shapes: Sequence[str] = None,
+                 seed: int = None, batches_per_producer: int = None):
+        """
+        :param number_of_producers: The number of producer processes, defaults to the number of cpus
+        :param number_of_slots: The number of batches in the ring, defaults to twice the number of producers
+        :param seed: Every producer derives its own seed from it, batches of different producers interleave in
+        the order they are finished
+        :param batches_per_producer: Stop after this many batches per producer, the stream is endless when None
+        """
+        if number_of_producers is None:
+            number_of_producers = multiprocessing.cpu_count()
+        if number_of_slots is None:
+            number_of_slots = 2 * number_of_producers
+        self.ring = ShapeBatchRing(canvas_size, batch_size, number_of_slots)
+        seed_sequences = np.random.SeedSequence(seed).spawn(number_of_producers)
+        self.producers: List[multiprocessing.Process] = [
+            multiprocessing.Process(target=produce_shape_batches,
+                                    args=(self.ring, seed_sequence, shapes, batches_per_producer), daemon=True)
+            for seed_sequence in seed_sequences]
+        self._stop_thread = None
+        self._closed = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self):
+        for producer in self.producers:
+            producer.start()
+        self._stop_thread = threading.Thread(target=self._stop_consumers_when_done, daemon=True)
+        self._stop_thread.start()
+
+    def _stop_consumers_when_done(self):
+        for producer in self.producers:
+            producer.join()
+        self.ring.filled_slots.put(_STOP)
+
+    def __iter__(self):
+        return self.ring.batches()
+
+    def close(self):
+        """
+        Stop the producers and free the shared memory
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self.ring.stop_event.set()
+        if self._stop_thread is not None:
+            self._stop_thread.join()
+        self.ring.close()
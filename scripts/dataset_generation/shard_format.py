@@ -0,0 +1,196 @@
+"""
+Pack generated samples into fixed-size shards instead of two tiny files per image
+
+A shard is an uncompressed tar holding the encoded image and the labels of every sample, next to a json index
+with the offset and size of each file inside the tar.
+The manifest gathers the indexes of all the shards of a folder so a sample can be read by its index with a single
+seek, without unpacking anything.
+
+shards/
+    circle-00000000-00000.tar
+    circle-00000000-00000.json
+    manifest.json
+"""
+import glob
+import io
+import json
+import os
+import tarfile
+from bisect import bisect_right
+from typing import Dict, List
+
+MANIFEST_FILE_NAME = 'manifest.json'
+
+
+class ShardWriter:
+    """
+    Write samples to shards of at most samples_per_shard samples named {shard_prefix}-{shard number}.tar
+    Sample names are the path of the image relative to root_folder without its extension, e.g. aqua/circle_gold_0
+    """
+
+    def __init__(self, shard_folder: str, root_folder: str, samples_per_shard: int = 10000,
+                 shard_prefix: str = 'shard'):
+        self.shard_folder = shard_folder
+        self.root_folder = root_folder
+        self.samples_per_shard = samples_per_shard
+        self.shard_prefix = shard_prefix
+        self.shard_paths: List[str] = []
+        self._tar = None
+        self._samples_in_shard: List[str] = []
+        os.makedirs(shard_folder, exist_ok=True)
+
+    def add_sample(self, image_path: str, image_bytes, text_files: Dict[str, str] = None):
+        """
+        Add an encoded image and its text files, every file must share the stem of the image
+        """
+        sample_name, image_extension = os.path.splitext(os.path.relpath(image_path, self.root_folder))
+        files = {image_extension: bytes(image_bytes)}
+        for text_path, text in (text_files or {}).items():
+            text_name, text_extension = os.path.splitext(os.path.relpath(text_path, self.root_folder))
+            if text_name != sample_name:
+                raise ValueError(f'{text_path} does not share the stem of {image_path}')
+            files[text_extension] = text.encode()
+
+        if self._tar is None:
+            self._open_shard()
+        for extension, data in files.items():
+            tar_info = tarfile.TarInfo(sample_name + extension)
+            tar_info.size = len(data)
+            self._tar.addfile(tar_info, io.BytesIO(data))
+        self._samples_in_shard.append(sample_name)
+        if len(self._samples_in_shard) >= self.samples_per_shard:
+            self._close_shard()
+
+    def close(self):
+        """
+        Close the current shard and write its index
+        """
+        if self._tar is not None:
+            self._close_shard()
+
+    def _open_shard(self):
+        shard_path = os.path.join(self.shard_folder, f'{self.shard_prefix}-{len(self.shard_paths):05d}.tar')
+        self.shard_paths.append(shard_path)
+        self._tar = tarfile.open(shard_path, 'w', format=tarfile.PAX_FORMAT)
+        self._samples_in_shard = []
+
+    def _close_shard(self):
+        self._tar.close()
+        self._tar = None
+        write_shard_index(self.shard_paths[-1])
+
+
+def write_shard_index(shard_path: str):
+    """
+    Write the json index of a shard holding the offset and size of every file of every sample
+    Only the tar headers are read, the data of the files is skipped
+    """
+    samples = {}
+    with tarfile.open(shard_path, 'r') as tar:
+        for member in tar:
+            sample_name, extension = os.path.splitext(member.name)
+            samples.setdefault(sample_name, {})[extension] = [member.offset_data, member.size]
+    index = {
+        'shard': os.path.basename(shard_path),
+        'samples': [{'name': name, 'files': files} for name, files in samples.items()],
+    }
+    with open(os.path.splitext(shard_path)[0] + '.json', 'w') as f:
+        json.dump(index, f)
+
+
+def write_shard_manifest(shard_folder: str) -> str:
+    """
+    Gather the indexes of every shard in shard_folder into the manifest, shards are sorted by name
+    :return: the path of the manifest
+    """
+    manifest_path = os.path.join(shard_folder, MANIFEST_FILE_NAME)
+    shards = []
+    for index_path in sorted(glob.glob(os.path.join(shard_folder, '*.json'))):
+        if index_path == manifest_path:
+            continue
+        with open(index_path) as f:
+            shards.append(json.load(f))
+    with open(manifest_path, 'w') as f:
+        json.dump({'number_of_samples': sum(len(shard['samples']) for shard in shards), 'shards': shards}, f)
+    return manifest_path
+
+
+class ShardReader:
+    """
+    Random access to the samples of the shards listed in a manifest
+    """
+
+    def __init__(self, shard_folder: str):
+        self.shard_folder = shard_folder
+        with open(os.path.join(shard_folder, MANIFEST_FILE_NAME)) as f:
+            self.shards = json.load(f)['shards']
+        # index of the first sample of every shard
+        self._first_sample_of_shard = []
+        number_of_samples = 0
+        for shard in self.shards:
+            self._first_sample_of_shard.append(number_of_samples)
+            number_of_samples += len(shard['samples'])
+        self._number_of_samples = number_of_samples
+        self._open_shards = {}
+
+    def __len__(self):
+        return self._number_of_samples
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        for shard_file in self._open_shards.values():
+            shard_file.close()
+        self._open_shards = {}
+
+    def sample_name(self, index: int) -> str:
+        shard_number, sample_number = self._locate(index)
+        return self.shards[shard_number]['samples'][sample_number]['name']
+
+    def read_sample(self, index: int) -> Dict[str, bytes]:
+        """
+        Read the files of a sample keyed by their extension, e.g. {'.jpg': ..., '.txt': ...}
+        """
+        shard_number, sample_number = self._locate(index)
+        shard_file = self._get_shard_file(shard_number)
+        files = {}
+        for extension, (offset, size) in self.shards[shard_number]['samples'][sample_number]['files'].items():
+            shard_file.seek(offset)
+            files[extension] = shard_file.read(size)
+        return files
+
+    def export_to_darknet_folder(self, output_folder: str, shard_names: List[str] = None):
+        """
+        Write the samples back to the darknet layout, e.g. output_folder/aqua/circle_gold_0.jpg
+        :param shard_names: Only export these shards, defaults to every shard
+        :return: the number of samples exported
+        """
+        number_of_samples = 0
+        for shard_number, shard in enumerate(self.shards):
+            if shard_names is not None and shard['shard'] not in shard_names:
+                continue
+            for sample_number, sample in enumerate(shard['samples']):
+                files = self.read_sample(self._first_sample_of_shard[shard_number] + sample_number)
+                sample_path = os.path.join(output_folder, sample['name'])
+                os.makedirs(os.path.dirname(sample_path), exist_ok=True)
+                for extension, data in files.items():
+                    with open(sample_path + extension, 'wb') as f:
+                        f.write(data)
+                number_of_samples += 1
+        return number_of_samples
+
+    def _locate(self, index: int):
+        if not 0 <= index < self._number_of_samples:
+            raise IndexError(f'sample index {index} out of range for {self._number_of_samples} samples')
+        shard_number = bisect_right(self._first_sample_of_shard, index) - 1
+        return shard_number, index - self._first_sample_of_shard[shard_number]
+
+    def _get_shard_file(self, shard_number: int):
+        if shard_number not in self._open_shards:
+            shard_path = os.path.join(self.shard_folder, self.shards[shard_number]['shard'])
+            self._open_shards[shard_number] = open(shard_path, 'rb')
+        return self._open_shards[shard_number]
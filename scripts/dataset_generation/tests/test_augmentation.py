@@ -0,0 +1,30 @@
+import numpy as np
+
+from augmentation import AugmentationParameters, render_augmented_shape_batch
+from dataset_generation import all_shapes, generate_shape_sizes
+
+
+def test_augmented_boxes_are_the_extent_of_the_drawn_pixels():
+    random_state = np.random.RandomState(3)
+    augmentation = AugmentationParameters(vertical_flip_probability=0.5, color_jitter=0)
+    for shape in all_shapes:
+        shape_sizes = generate_shape_sizes(shape, 50, random_state)
+        canvases, tight_boxes, darknet_boxes = render_augmented_shape_batch(
+            (320, 240), shape, shape_sizes, (0, 0, 0), (255, 255, 255), augmentation=augmentation,
+            random_state=random_state, canvas_padding=-10)
+        for canvas, tight_box, darknet_box in zip(canvases, tight_boxes, darknet_boxes):
+            rows, columns = np.nonzero(canvas[..., 0])
+            pixel_box = [columns.min(), rows.min(), columns.max() + 1, rows.max() + 1]
+            assert tight_box.tolist() == pixel_box, shape
+            center, size = (tight_box[:2] + tight_box[2:]) / 2, tight_box[2:] - tight_box[:2]
+            assert np.allclose(darknet_box, np.concatenate([center, size]) / [320, 240, 320, 240]), shape
+
+
+def test_augmented_boxes_do_not_depend_on_the_channels_the_colors_share():
+    augmentation = AugmentationParameters(max_rotation=180, color_jitter=0)
+    for shape in all_shapes:
+        shape_sizes = generate_shape_sizes(shape, 20, np.random.RandomState(5))
+        boxes = [render_augmented_shape_batch((320, 240), shape, shape_sizes, canvas_color, color,
+                                              augmentation=augmentation, random_state=np.random.RandomState(7))[1]
+                 for canvas_color, color in [((0, 0, 0), (255, 255, 255)), ((0, 90, 200), (0, 91, 200))]]
+        assert np.array_equal(boxes[0], boxes[1]), shape
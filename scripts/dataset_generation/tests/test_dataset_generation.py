@@ -0,0 +1,82 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from dataset_generation import generate_images, generate_training_images
+from image_encoding import EncoderParameters
+
+DATA_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+COLORS_TO_USE = ['darkgreen', 'gold', 'aqua']
+
+
+def read_pixels(folder, stem: str) -> np.ndarray:
+    return np.load(os.path.join(folder, COLORS_TO_USE[0], f'{stem}.npy'))
+
+
+def read_files(folder) -> dict:
+    files = {}
+    for directory, _, file_names in os.walk(folder):
+        for file_name in file_names:
+            path = os.path.join(directory, file_name)
+            with open(path, 'rb') as f:
+                files[os.path.relpath(path, folder)] = f.read()
+    return files
+
+
+def test_generate_images_matches_the_baseline_for_a_seed(tmp_path):
+    """
+    baseline_seed_123.json holds the md5 of the pixels of every canvas and the labels written by the original per
+    image generate_images after np.random.seed(123), with the star drawn in BGR like every other shape
+    """
+    with open(os.path.join(DATA_FOLDER, 'baseline_seed_123.json')) as f:
+        baseline = json.load(f)
+
+    np.random.seed(123)
+    generate_images((640, 480), COLORS_TO_USE, str(tmp_path), 5, encoder=EncoderParameters('raw'))
+
+    for image_name, pixels_md5 in baseline['images'].items():
+        stem = os.path.splitext(image_name)[0]
+        assert hashlib.md5(read_pixels(tmp_path, stem).tobytes()).hexdigest() == pixels_md5, stem
+    for label_name, label in baseline['labels'].items():
+        with open(tmp_path / COLORS_TO_USE[0] / label_name) as f:
+            assert f.read() == label, label_name
+
+
+def test_generate_images_does_not_depend_on_the_batch_size(tmp_path):
+    for batch_size in [64, 3]:
+        np.random.seed(7)
+        generate_images((320, 240), COLORS_TO_USE, str(tmp_path / str(batch_size)), 7, batch_size=batch_size,
+                        encoder=EncoderParameters('raw'), shape_scale=0.5)
+    for name in os.listdir(tmp_path / '64' / COLORS_TO_USE[0]):
+        stem, extension = os.path.splitext(name)
+        if extension == '.npy':
+            assert np.array_equal(read_pixels(tmp_path / '64', stem), read_pixels(tmp_path / '3', stem)), stem
+        elif extension == '.txt':
+            labels = [(tmp_path / folder / COLORS_TO_USE[0] / name).read_text() for folder in ['64', '3']]
+            assert labels[0] == labels[1], name
+
+
+def test_generate_training_images_writes_the_same_files_for_a_seed_and_timestamp(tmp_path, monkeypatch):
+    # the second run generates the work items on a pool of processes
+    for run, max_workers in [('first', 1), ('second', 2)]:
+        os.makedirs(tmp_path / run)
+        monkeypatch.chdir(tmp_path / run)
+        generate_training_images((320, 240), number_of_images_per_shape=3, seed=5, shape_scale=0.5,
+                                 max_workers=max_workers, timestamp=1700000000)
+    first, second = [read_files(tmp_path / run / 'shapes_neural_network') for run in ['first', 'second']]
+    assert sorted(first) == sorted(second)
+    for name in first:
+        if name.endswith('run_manifest.jsonl'):
+            # the pool records the work items in the order they are done
+            assert sorted(first[name].splitlines()) == sorted(second[name].splitlines())
+        else:
+            assert first[name] == second[name], name
+
+    # a resumed run writes the missing files again with the timestamp of the run manifest
+    json_files = sorted(name for name in first if name.endswith('.json'))
+    os.remove(tmp_path / 'second' / 'shapes_neural_network' / json_files[0])
+    generate_training_images((320, 240), number_of_images_per_shape=3, seed=5, shape_scale=0.5)
+    assert read_files(tmp_path / 'second' / 'shapes_neural_network') == second
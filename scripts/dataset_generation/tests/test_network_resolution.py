@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from network_resolution import TileParameters, cut_tiles, get_tile_origins, read_network_size, read_network_sizes
+
+CFG = """# darknet cfg
+[net]
+batch=64
+width=416 # multiple of 32
+height=288
+channels=3
+
+[convolutional]
+width=13
+height=13
+
+[net]
+width=608
+height=608
+"""
+
+
+def test_read_network_size_reads_the_first_net_section(tmp_path):
+    cfg_path = tmp_path / 'network.cfg'
+    cfg_path.write_text(CFG)
+    assert read_network_size(str(cfg_path)) == (416, 288)
+    assert read_network_sizes([str(cfg_path), str(cfg_path)]) == [(416, 288)]
+
+    cfg_path.write_text('[convolutional]\nwidth=13\nheight=13\n')
+    with pytest.raises(ValueError):
+        read_network_size(str(cfg_path))
+    cfg_path.write_text('[net]\nwidth=416\n[convolutional]\nheight=13\n')
+    with pytest.raises(ValueError):
+        read_network_size(str(cfg_path))
+
+
+def test_cut_tiles_covers_the_canvas_with_overlapping_tiles():
+    canvas_size, tile_size = (640, 480), (416, 288)
+    # 2 x 2 tiles overlapping by 192 and 96 pixels
+    assert get_tile_origins(canvas_size, tile_size).tolist() == [[0, 0], [224, 0], [0, 192], [224, 192]]
+
+    canvases = np.arange(2 * 480 * 640 * 3, dtype=np.uint64).astype(np.uint8).reshape(2, 480, 640, 3)
+    # a box in the overlap of every tile, and a box only in the bottom right tile
+    darknet_boxes = np.array([[320 / 640, 240 / 480, 40 / 640, 40 / 480],
+                              [600 / 640, 440 / 480, 40 / 640, 40 / 480]])
+    cut = cut_tiles(canvases, darknet_boxes, canvas_size, TileParameters(tile_size))
+    assert [(canvas_index, tile_index) for canvas_index, tile_index, _, _ in cut] == [(0, 0), (0, 1), (0, 2), (0, 3),
+                                                                                      (1, 3)]
+    for canvas_index, tile_index, tile, tile_box in cut:
+        x, y = get_tile_origins(canvas_size, tile_size)[tile_index]
+        assert tile.shape == (288, 416, 3)
+        assert np.array_equal(tile, canvases[canvas_index, y:y + 288, x:x + 416])
+        center = darknet_boxes[canvas_index, :2] * canvas_size
+        np.testing.assert_allclose(tile_box, [(center[0] - x) / 416, (center[1] - y) / 288, 40 / 416, 40 / 288])
+
+    # the empty tiles are kept as negative samples with no box
+    cut = cut_tiles(canvases, darknet_boxes, canvas_size, TileParameters(tile_size, keep_empty_tiles=True))
+    assert len(cut) == 8
+    assert [tile_box is None for canvas_index, _, _, tile_box in cut if canvas_index == 1] == [True, True, True, False]
+
+
+def test_cut_tiles_only_labels_shapes_visible_enough_in_a_tile():
+    canvases = np.zeros((1, 480, 640, 3), np.uint8)
+    # a box 40 pixels wide with 10 of them in the left tile only
+    darknet_boxes = np.array([[(416 - 10 + 20) / 640, 100 / 480, 40 / 640, 40 / 480]])
+    cut = cut_tiles(canvases, darknet_boxes, (640, 480), TileParameters((416, 288), min_visibility=0.5))
+    assert [tile_index for _, tile_index, _, _ in cut] == [1]
+    cut = cut_tiles(canvases, darknet_boxes, (640, 480), TileParameters((416, 288), min_visibility=0.2))
+    assert [tile_index for _, tile_index, _, _ in cut] == [0, 1]
+    np.testing.assert_allclose(cut[0][3], [(416 - 5) / 416, 100 / 288, 10 / 416, 40 / 288])
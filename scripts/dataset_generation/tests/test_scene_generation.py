@@ -0,0 +1,78 @@
+import os
+
+import numpy as np
+
+import scene_generation
+from dataset_generation import shape_to_index
+from image_encoding import EncoderParameters
+from image_writer import ImageWriter
+from scene_generation import OccupancyGrid, ScenePlacement, generate_scene_images, place_shapes, render_scene
+from test_dataset_generation import COLORS_TO_USE
+
+
+def test_generate_scene_images_saves_the_images_with_the_extension_of_the_encoder(tmp_path):
+    with ImageWriter(encoder=EncoderParameters('png')) as image_writer:
+        generate_scene_images((320, 240), COLORS_TO_USE, str(tmp_path), 2, shapes_per_image=3,
+                              random_state=np.random.RandomState(3), image_writer=image_writer, timestamp=1700000000)
+    assert image_writer.errors == []
+    assert sorted(os.listdir(tmp_path / COLORS_TO_USE[0])) == [
+        f'scene_{COLORS_TO_USE[1]}_{i}{extension}' for i in range(2) for extension in ['.json', '.png', '.txt']]
+
+
+def test_occupied_fractions_counts_every_cell_a_box_touches():
+    grid = OccupancyGrid((64, 48), cell_size=8)
+    assert grid.occupied_fractions(np.array([[0, 0, 64, 48]])).tolist() == [0]
+    grid.occupy((4, 4, 12, 12))
+    # the box touches the 2 x 2 cells at the top left, the boxes past the canvas are clipped to the grid
+    boxes = np.array([[0, 0, 16, 16], [0, 0, 32, 32], [15, 15, 17, 17], [16, 16, 64, 48], [-8, -8, 1, 1]])
+    assert grid.occupied_fractions(boxes).tolist() == [1, 0.25, 0.25, 0, 1]
+    grid.occupy((40, 0, 80, 8))
+    assert grid.occupied_fractions(np.array([[32, 0, 64, 8]])).tolist() == [0.75]
+
+
+def test_place_shapes_keeps_the_overlap_of_every_shape_under_max_overlap():
+    shapes = ['circle', 'square', 'star', 'ellipse', 'triangle'] * 8
+    for max_overlap in [0.0, 0.5]:
+        placements = place_shapes((640, 480), shapes, max_overlap=max_overlap,
+                                  random_state=np.random.RandomState(9))
+        assert len(placements) > 4
+        grid = OccupancyGrid((640, 480))
+        for placement in placements:
+            x1, y1, x2, y2 = placement.max_bounding_box
+            assert 20 <= x1 and 20 <= y1 and x2 <= 620 and y2 <= 460
+            assert grid.occupied_fractions(np.array([placement.max_bounding_box]))[0] <= max_overlap
+            grid.occupy(placement.max_bounding_box)
+        if max_overlap == 0:
+            boxes = np.array([placement.max_bounding_box for placement in placements])
+            for i, box in enumerate(boxes):
+                others = np.delete(boxes, i, axis=0)
+                assert not np.any((others[:, 0] < box[2]) & (box[0] < others[:, 2]) &
+                                  (others[:, 1] < box[3]) & (box[1] < others[:, 3]))
+
+
+def test_place_shapes_leaves_out_odd_sized_shapes_without_a_whole_position(monkeypatch):
+    # the max bounding box of a 31 x 21 ellipse spans from -8.5 to 38.5, leaving x_low 28.5 and x_high 29.5
+    monkeypatch.setattr(scene_generation, 'generate_shape_size', lambda shape, random_state: (31, 21))
+    assert place_shapes((88, 240), ['ellipse'], random_state=np.random.RandomState(0)) == []
+    assert len(place_shapes((89, 240), ['ellipse'], random_state=np.random.RandomState(0))) == 1
+
+
+def test_render_scene_labels_every_shape_with_the_max_bounding_box_it_was_placed_with():
+    canvas_size = (640, 480)
+    placements = place_shapes(canvas_size, ['circle', 'square', 'star', 'triangle'],
+                              random_state=np.random.RandomState(4))
+    assert len(placements) == 4
+    _, label, _ = render_scene(canvas_size, placements, canvas_color=(0, 0, 0), color=(255, 255, 255))
+    lines = label.split('\n')
+    assert len(lines) == len(placements)
+    for placement, line in zip(placements, lines):
+        object_class, _, _, w, h = line.split()
+        assert int(object_class) == shape_to_index[placement.shape]
+        x1, y1, x2, y2 = placement.max_bounding_box
+        assert np.isclose(float(w), (x2 - x1) / canvas_size[0]) and np.isclose(float(h), (y2 - y1) / canvas_size[1])
+        # the pixels of the shape drawn alone lie within the box it was placed with
+        canvas, _, _ = render_scene(canvas_size, [placement], canvas_color=(0, 0, 0), color=(255, 255, 255))
+        ys, xs = np.nonzero(canvas.any(axis=2))
+        assert x1 <= xs.min() and xs.max() <= x2 and y1 <= ys.min() and ys.max() <= y2, line
+
+    assert render_scene(canvas_size, [])[1] == ''
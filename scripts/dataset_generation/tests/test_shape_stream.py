@@ -0,0 +1,30 @@
+import numpy as np
+
+from dataset_generation import all_shapes
+from shape_stream import SharedMemoryShapeStream
+
+
+def test_every_producer_fills_its_batches():
+    with SharedMemoryShapeStream((640, 480), batch_size=4, number_of_producers=3, seed=1,
+                                 batches_per_producer=2) as stream:
+        batches = [(images.copy(), labels.copy()) for images, labels in stream]
+    assert len(batches) == 6
+    for images, labels in batches:
+        assert images.shape == (4, 480, 640, 3) and labels.shape == (4, 5)
+        assert np.all((labels[:, 0] >= 0) & (labels[:, 0] < len(all_shapes)))
+        assert np.all((labels[:, 1:] > 0) & (labels[:, 1:] <= 1))
+        # every image has a shape drawn on its canvas
+        assert all(np.any(image != image[0, 0]) for image in images)
+
+
+def test_an_endless_stream_stops_its_producers_when_closed():
+    stream = SharedMemoryShapeStream((640, 480), batch_size=2, number_of_producers=2, number_of_slots=2, seed=1)
+    stream.start()
+    for batch_number, _ in enumerate(stream.ring.batches(), start=1):
+        if batch_number == 5:
+            break
+    stream.close()
+    assert not any(producer.is_alive() for producer in stream.producers)
+    assert all(producer.exitcode == 0 for producer in stream.producers)
+    # closing again does nothing
+    stream.close()
@@ -0,0 +1,23 @@
+import os
+
+import numpy as np
+
+from dataset_generation import generate_images
+from shard_format import ShardReader
+from test_dataset_generation import COLORS_TO_USE, read_files
+
+
+def test_shards_hold_the_files_written_without_shards(tmp_path):
+    for folder, samples_per_shard in [('files', None), ('shards', 4)]:
+        generate_images((320, 240), COLORS_TO_USE, str(tmp_path / folder), 3, random_state=np.random.RandomState(11),
+                        samples_per_shard=samples_per_shard, shape_scale=0.5, timestamp=1700000000)
+    files = read_files(tmp_path / 'files')
+
+    with ShardReader(str(tmp_path / 'shards')) as reader:
+        assert len(reader) == len(files) // 3
+        for index in [0, len(reader) // 2, len(reader) - 1]:
+            name = reader.sample_name(index)
+            assert reader.read_sample(index) == {extension: files[name + extension]
+                                                 for extension in ['.jpg', '.txt', '.json']}
+        assert reader.export_to_darknet_folder(str(tmp_path / 'exported')) == len(reader)
+    assert read_files(tmp_path / 'exported') == files
@@ -1,7 +1,20 @@
 import os
 import random
+import shutil
+import sys
 from pathlib import Path
 
+# the instrumentation shared by the scripts sits in its own folder next to this one
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'instrumentation'))
+
+from file_index import FileIndex, get_default_index_path
+from file_transfer import TRANSFER_MODES, detect_transfer_mode, transfer_files
+from instrumentation import get_instrumentation, report_run
+
+image_file_extensions = ['.jpg', '.jpeg', '.png', '.webp']
+training_file_extensions = ['.txt', '.json']
+SAMPLING_MODES = ['exact', 'bernoulli']
+
 
 def get_files_from_folder(folder: str) -> [Path]:
     # get all the files recursively in the folder using glob
@@ -12,103 +25,342 @@ def get_files_from_folder(folder: str) -> [Path]:
     return [f.absolute() for f in files]
 
 
+def is_valid_stem_group(file_extensions) -> bool:
+    # a stem is used for training when it has an image along with every training file
+    has_images = any(e in image_file_extensions for e in file_extensions)
+    has_training_files = all(
+        e in file_extensions for e in training_file_extensions)
+    return has_images and has_training_files
+
+
 def filter_valid_files(files):
     # filter out the files that are used for training and have been validated by DarkMark
-    image_file_extensions = ['.jpg', '.jpeg', '.png']
-    training_file_extensions = ['.txt', '.json']
-    # group the files by their path stem
+    # group the files by their directory and path stem, the same stem in another directory is another image
     files_by_stem = {}
     for file_by_stem in files:
-        stem = Path(file_by_stem).stem
-        if stem not in files_by_stem:
-            files_by_stem[stem] = []
-        files_by_stem[stem].append(file_by_stem)
+        directory_and_file_name = os.path.splitext(file_by_stem)[0]
+        if directory_and_file_name not in files_by_stem:
+            files_by_stem[directory_and_file_name] = []
+        files_by_stem[directory_and_file_name].append(file_by_stem)
     # filter out the files that are not used for training
     valid_files = {}
-    for file_by_stem in files_by_stem:
-        files_using_stem = files_by_stem[file_by_stem]
+    for directory_and_file_name in files_by_stem:
+        files_using_stem = files_by_stem[directory_and_file_name]
         if len(files_using_stem) == 1:
             # if there is only one file for a stem, then it is NOT used for training
             continue
         # get the file extensions for our files_for_stem list
         file_extensions = [Path(filepath).suffix for filepath in files_using_stem]
 
-        has_images = any(e in image_file_extensions for e in file_extensions)
-        has_training_files = all(
-            e in file_extensions for e in training_file_extensions)
-        files_used_in_training = has_images and has_training_files
-
-        if not files_used_in_training:
+        if not is_valid_stem_group(file_extensions):
             continue
 
-        directory_and_file_name = os.path.join(os.path.dirname(files_using_stem[0]), file_by_stem)
-        if directory_and_file_name not in valid_files:
-            valid_files[directory_and_file_name] = []
-        valid_files[directory_and_file_name].append(files_using_stem)
+        valid_files[directory_and_file_name] = [files_using_stem]
     return valid_files
 
 
-def get_fraction_of_dataset(directory_to_search: str, directory_to_copy_to: str, fraction: float):
-    # clear the folder if it exists
-    print(f'Clearing folder: {directory_to_copy_to}')
-    if os.path.exists(directory_to_copy_to):
-        os.system('rm -rf ' + directory_to_copy_to)
-    os.system('mkdir ' + directory_to_copy_to)
+def get_valid_files_from_index(directory_to_search: str, index_path: str = None):
+    # same as filter_valid_files(get_files_from_folder(directory_to_search)) using the persistent file index
+    # only the directories that changed since the last run are listed again
+    if index_path is None:
+        index_path = get_default_index_path(directory_to_search)
+    instrumentation = get_instrumentation()
+    valid_files = {}
+    with FileIndex(index_path) as file_index:
+        with instrumentation.stage('scan'):
+            statistics = file_index.update(directory_to_search)
+        print(f'Scanned {statistics["scanned"]} directories, {statistics["skipped"]} were unchanged')
+        with instrumentation.stage('filter'):
+            for directory, stem, file_extensions in file_index.iter_stem_groups(directory_to_search):
+                if len(file_extensions) == 1 or not is_valid_stem_group(file_extensions):
+                    continue
+                directory_and_file_name = os.path.join(directory, stem)
+                # plain strings since building millions of Path objects costs more than reading the index
+                valid_files[directory_and_file_name] = [
+                    [directory_and_file_name + extension for extension in file_extensions]]
+    instrumentation.count('valid_stems', len(valid_files))
+    return valid_files
+
+
+def iter_stems_by_directory(directory_to_search: str):
+    # stream (directory, extensions by stem) one directory at a time, only the entries of a single directory are held
+    # stems are grouped per directory, files of a stem are directory/stem + extension
+    instrumentation = get_instrumentation()
+    directories_to_visit = [os.path.abspath(directory_to_search)]
+    directories_listed = 0
+    while directories_to_visit:
+        directory = directories_to_visit.pop()
+        extensions_by_stem = {}
+        with instrumentation.stage('scan'), os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    directories_to_visit.append(entry.path)
+                elif entry.is_file():
+                    stem, extension = os.path.splitext(entry.name)
+                    extensions_by_stem.setdefault(stem, []).append(extension)
+        directories_listed += 1
+        instrumentation.progress(f'Listed {directories_listed} directories, {len(directories_to_visit)} to go')
+        yield directory, extensions_by_stem
+
+
+def iter_valid_stems_by_directory(directory_to_search: str):
+    # stream (directory, [(stem, extensions)]) of the valid stems of every directory holding some
+    instrumentation = get_instrumentation()
+    for directory, extensions_by_stem in iter_stems_by_directory(directory_to_search):
+        with instrumentation.stage('filter', items=len(extensions_by_stem)):
+            valid_stems = [(stem, extensions) for stem, extensions in extensions_by_stem.items()
+                           if len(extensions) > 1 and is_valid_stem_group(extensions)]
+        instrumentation.count('valid_stems', len(valid_stems))
+        if valid_stems:
+            yield directory, valid_stems
+
+
+def sample_stems(stems, fraction: float, sampling: str, random_generator: random.Random):
+    # exact keeps int(len(stems) * fraction) stems like get_fraction_of_dataset
+    # bernoulli keeps every stem with probability fraction, so the number kept varies around the fraction
+    if sampling == 'exact':
+        return random_generator.sample(stems, int(len(stems) * fraction))
+    if sampling == 'bernoulli':
+        return [stem for stem in stems if random_generator.random() < fraction]
+    raise ValueError('sampling must be one of: {}'.format(SAMPLING_MODES))
+
+
+def iter_fraction_of_dataset(directory_to_search: str, directory_to_copy_to: str, fraction: float,
+                             sampling: str = 'exact', seed: int = None):
+    # stream the (source, destination) pairs of a fraction of every directory as the directories are listed
+    # peak memory is bounded by the largest directory instead of the whole dataset
+    random_generator = random.Random(seed)
+    for directory, valid_stems in iter_valid_stems_by_directory(directory_to_search):
+        # sort so the same seed picks the same stems whatever order the filesystem lists them in
+        valid_stems.sort()
+        stems_to_copy = sample_stems(valid_stems, fraction, sampling, random_generator)
+        if not stems_to_copy:
+            continue
+        nested_folder_to_copy_to = os.path.join(directory_to_copy_to, os.path.basename(directory))
+        os.makedirs(nested_folder_to_copy_to, exist_ok=True)
+        for stem, extensions in stems_to_copy:
+            for extension in extensions:
+                file_name = stem + extension
+                yield os.path.join(directory, file_name), os.path.join(nested_folder_to_copy_to, file_name)
+
+
+def get_valid_files(directory_to_search: str, use_index: bool = False, index_path: str = None):
     print('Getting files from folder: ' + directory_to_search)
-    # get all the files in the folder
-    files = get_files_from_folder(directory_to_search)
-    print(f'Found {len(files)} files in {directory_to_search}')
-    # filter out the files that are used for training and have been validated by DarkMark
-    valid_files = filter_valid_files(files)
-    valid_files_keys = list(valid_files.keys())
-    print(f'Found {len(valid_files_keys)} valid files')
+    instrumentation = get_instrumentation()
+    if use_index:
+        valid_files = get_valid_files_from_index(directory_to_search, index_path)
+    else:
+        # get all the files in the folder
+        with instrumentation.stage('scan'):
+            files = get_files_from_folder(directory_to_search)
+        instrumentation.count('files_scanned', len(files))
+        print(f'Found {len(files)} files in {directory_to_search}')
+        # filter out the files that are used for training and have been validated by DarkMark
+        with instrumentation.stage('filter', items=len(files)):
+            valid_files = filter_valid_files(files)
+        instrumentation.count('valid_stems', len(valid_files))
+    print(f'Found {len(valid_files)} valid files')
+    return valid_files
+
+
+def group_valid_files_by_directory(valid_files):
     # group valid files by their directory
     valid_files_by_directory = {}
-    for file_by_stem in valid_files_keys:
+    for file_by_stem in valid_files:
         directory = Path(file_by_stem).parent
         if directory not in valid_files_by_directory:
             valid_files_by_directory[directory] = []
         valid_files_by_directory[directory].append(file_by_stem)
     print(f'Found {len(valid_files_by_directory)} valid files by directory')
-    fraction_of_directories = {}
-    # get a fraction of the files in each directory
-    for directory in valid_files_by_directory:
-        files_for_directory = valid_files_by_directory[directory]
-        num_files_to_copy = int(len(files_for_directory) * fraction)
-        files_to_copy = random.sample(files_for_directory, num_files_to_copy)
-        fraction_of_directories[directory] = files_to_copy
-    print(
-        f'Found {len(fraction_of_directories)} directories with fraction of files')
-    total_files_copied = 0
-    # copy the files to the new folder
-    for directory in fraction_of_directories:
-        file_stems_to_copy = fraction_of_directories[directory]
-        files_copied_from_directory = 0
-
-        nested_folder_to_copy_to = os.path.join(
-            directory_to_copy_to, os.path.basename(directory))
-
-        # make the directory if it does not exist
-        if not os.path.exists(nested_folder_to_copy_to):
-            os.system('mkdir ' + nested_folder_to_copy_to)
-
-        for file_stem_to_copy in file_stems_to_copy:
-            for files_to_copy in valid_files[file_stem_to_copy]:
-                for file_to_copy in files_to_copy:
-                    file_to_copy_to = os.path.join(
-                        nested_folder_to_copy_to, os.path.basename(file_to_copy))
-
-                    os.system(f'cp {file_to_copy} {file_to_copy_to}')
-                    files_copied_from_directory += 1
+    return valid_files_by_directory
+
+
+def get_image_file(files_using_stem):
+    # the image darknet loads for a stem, darknet finds the .txt next to it
+    for file_using_stem in files_using_stem:
+        if Path(file_using_stem).suffix.lower() in image_file_extensions:
+            return str(file_using_stem)
+    return None
+
+
+def drop_duplicate_stems(valid_files, directory_to_search: str, max_hash_distance: int = 4,
+                         max_changed_pixels: int = 1, hash_workers: int = None, hash_cache_path: str = None):
+    # keep a single stem of every group of identical or near identical images, see image_deduplication
+    # the stem kept is the first one by path, hashes are cached in hash_cache_path, next to directory_to_search by
+    # default, so reruns only hash new or modified images
+    # imported here so the splitter only needs numpy and cv2 when it deduplicates
+    from image_deduplication import deduplicate_images, get_default_hash_cache_path
+    if hash_cache_path is None:
+        hash_cache_path = get_default_hash_cache_path(directory_to_search)
+    instrumentation = get_instrumentation()
+    stems = sorted(valid_files)
+    images = [get_image_file(valid_files[stem][0]) for stem in stems]
+    duplicate_of = deduplicate_images(images, max_hash_distance, max_changed_pixels, hash_workers, hash_cache_path)
+    unique_files = {stem: valid_files[stem] for i, stem in enumerate(stems) if duplicate_of[i] == i}
+    instrumentation.count('duplicates_dropped', len(valid_files) - len(unique_files))
+    print(f'Dropped {len(valid_files) - len(unique_files)} duplicates, {len(unique_files)} stems left')
+    return unique_files
+
+
+def split_by_fractions(items, split_fractions):
+    # cut items into consecutive parts using the cumulative fractions so every item ends up in a part
+    total = sum(split_fractions)
+    parts = []
+    start = 0
+    cumulative_fraction = 0
+    for split_fraction in split_fractions:
+        cumulative_fraction += split_fraction
+        end = round(len(items) * cumulative_fraction / total)
+        parts.append(items[start:end])
+        start = end
+    return parts
+
+
+def write_darknet_list_files(directory_to_search: str, output_folder: str, network_name: str,
+                             fraction: float = 1.0, directory_fractions: dict = None,
+                             split_fractions=(0.8, 0.2, 0.0), seed: int = None, names_file: str = None,
+                             use_index: bool = False, index_path: str = None, deduplicate: bool = False,
+                             max_hash_distance: int = 4, max_changed_pixels: int = 1, hash_workers: int = None,
+                             hash_cache_path: str = None):
+    # write the darknet train/valid/test lists pointing at the original images instead of copying them
+    # fraction of the stems of every directory are kept, directory_fractions overrides it by directory name
+    # the kept stems of every directory are split between train, valid and test using split_fractions
+    # a .data file is written as well when names_file is given
+    # the same seed always gives the same lists whatever order the files are found in
+    # deduplicate drops duplicate images before sampling, see drop_duplicate_stems
+    directory_fractions = directory_fractions or {}
+    random_generator = random.Random(seed)
+    valid_files = get_valid_files(directory_to_search, use_index, index_path)
+    if deduplicate:
+        valid_files = drop_duplicate_stems(valid_files, directory_to_search, max_hash_distance, max_changed_pixels,
+                                           hash_workers, hash_cache_path)
+    valid_files_by_directory = group_valid_files_by_directory(valid_files)
+
+    list_names = ['train', 'valid', 'test']
+    images_by_list = {list_name: [] for list_name in list_names}
+    for directory in sorted(valid_files_by_directory):
+        files_for_directory = sorted(valid_files_by_directory[directory])
+        directory_fraction = directory_fractions.get(os.path.basename(directory), fraction)
+        files_to_use = random_generator.sample(files_for_directory, int(len(files_for_directory) * directory_fraction))
+        for list_name, files_for_list in zip(list_names, split_by_fractions(files_to_use, split_fractions)):
+            for file_by_stem in files_for_list:
+                image_file = get_image_file(valid_files[file_by_stem][0])
+                images_by_list[list_name].append(os.path.abspath(image_file))
+
+    os.makedirs(output_folder, exist_ok=True)
+    list_paths = {}
+    for list_name, split_fraction in zip(list_names, split_fractions):
+        if split_fraction == 0:
+            continue
+        list_paths[list_name] = os.path.abspath(os.path.join(output_folder, f'{network_name}_{list_name}.txt'))
+        with open(list_paths[list_name], 'w') as f:
+            f.writelines(f'{image_file}\n' for image_file in images_by_list[list_name])
+        print(f'Wrote {len(images_by_list[list_name])} images to {list_paths[list_name]}')
+
+    if names_file is not None:
+        write_darknet_data_file(output_folder, network_name, list_paths, names_file)
+    return list_paths
+
+
+def write_darknet_data_file(output_folder: str, network_name: str, list_paths: dict, names_file: str):
+    # write the darknet .data file pointing at the train and valid lists, its backup is the output folder
+    with open(names_file) as f:
+        number_of_classes = sum(1 for line in f if line.strip())
+    data_path = os.path.join(output_folder, f'{network_name}.data')
+    with open(data_path, 'w') as f:
+        f.write(f'classes = {number_of_classes}\n')
+        f.write(f'train = {list_paths.get("train", "")}\n')
+        f.write(f'valid = {list_paths.get("valid", "")}\n')
+        f.write(f'names = {os.path.abspath(names_file)}\n')
+        f.write(f'backup = {os.path.abspath(output_folder)}\n')
+    print(f'Wrote {data_path}')
+    return data_path
+
+
+def clear_folder(directory_to_clear: str, directory_to_keep: str):
+    # refuse to clear the current folder or a folder holding the data we are splitting
+    directory_to_clear = os.path.abspath(directory_to_clear)
+    directory_to_keep = os.path.abspath(directory_to_keep)
+    if directory_to_clear == os.getcwd() or \
+            os.path.commonpath([directory_to_clear, directory_to_keep]) == directory_to_clear:
+        raise ValueError(f'Refusing to clear {directory_to_clear} since it holds {directory_to_keep}')
+    print(f'Clearing folder: {directory_to_clear}')
+    if os.path.exists(directory_to_clear):
+        shutil.rmtree(directory_to_clear)
+    os.makedirs(directory_to_clear)
+
+
+def get_fraction_of_dataset(directory_to_search: str, directory_to_copy_to: str, fraction: float,
+                            transfer_mode: str = 'auto', max_workers: int = 16, use_index: bool = False,
+                            index_path: str = None, streaming: bool = False, sampling: str = 'exact',
+                            seed: int = None, report_path: str = None, deduplicate: bool = False,
+                            max_hash_distance: int = 4, max_changed_pixels: int = 1, hash_workers: int = None,
+                            hash_cache_path: str = None):
+    # transfer_mode is one of file_transfer.TRANSFER_MODES, auto picks the cheapest mode the filesystem supports
+    # use_index keeps a persistent index of the files, see get_valid_files_from_index
+    # streaming lists, samples and transfers one directory at a time, see iter_fraction_of_dataset
+    # sampling only applies when streaming, the same seed always picks the same files
+    # report_path writes the json run report of the scan, filter and copy stages
+    # deduplicate drops identical and near identical images before sampling, see drop_duplicate_stems
+    if transfer_mode != 'auto' and transfer_mode not in TRANSFER_MODES:
+        raise ValueError('transfer_mode must be auto or one of: {}'.format(TRANSFER_MODES))
+    if streaming and use_index:
+        raise ValueError('streaming lists the directories itself and cannot use the index')
+    if streaming and deduplicate:
+        raise ValueError('streaming samples every directory on its own and cannot find duplicates across them')
+    with report_run(report_path):
+        # clear the folder if it exists
+        clear_folder(directory_to_copy_to, directory_to_search)
+        if transfer_mode == 'auto':
+            transfer_mode = detect_transfer_mode(directory_to_search, directory_to_copy_to)
+        print(f'Transferring files with mode: {transfer_mode}')
+        if streaming:
+            files_to_transfer = iter_fraction_of_dataset(directory_to_search, directory_to_copy_to, fraction,
+                                                         sampling, seed)
+            progress = transfer_files(files_to_transfer, transfer_mode, max_workers)
+            print(f'Copied {progress.files_transferred} files to {directory_to_copy_to}')
+            return
+        valid_files = get_valid_files(directory_to_search, use_index, index_path)
+        if deduplicate:
+            valid_files = drop_duplicate_stems(valid_files, directory_to_search, max_hash_distance,
+                                               max_changed_pixels, hash_workers, hash_cache_path)
+        valid_files_by_directory = group_valid_files_by_directory(valid_files)
+        random_generator = random.Random(seed)
+        fraction_of_directories = {}
+        # get a fraction of the files in each directory
+        # sorted so the same seed picks the same files whatever order the filesystem lists them in
+        for directory in sorted(valid_files_by_directory):
+            files_for_directory = sorted(valid_files_by_directory[directory])
+            num_files_to_copy = int(len(files_for_directory) * fraction)
+            files_to_copy = random_generator.sample(files_for_directory, num_files_to_copy)
+            fraction_of_directories[directory] = files_to_copy
         print(
-            f'Copied {files_copied_from_directory} files to {nested_folder_to_copy_to}')
-        total_files_copied += files_copied_from_directory
-    print(f'Copied {total_files_copied} files to {directory_to_copy_to}')
+            f'Found {len(fraction_of_directories)} directories with fraction of files')
+        # pair every file to copy with its destination in the new folder
+        files_to_transfer = []
+        for directory in fraction_of_directories:
+            file_stems_to_copy = fraction_of_directories[directory]
+
+            nested_folder_to_copy_to = os.path.join(
+                directory_to_copy_to, os.path.basename(directory))
+
+            # make the directory if it does not exist
+            os.makedirs(nested_folder_to_copy_to, exist_ok=True)
+
+            for file_stem_to_copy in file_stems_to_copy:
+                for files_to_copy in valid_files[file_stem_to_copy]:
+                    for file_to_copy in files_to_copy:
+                        file_to_copy_to = os.path.join(
+                            nested_folder_to_copy_to, os.path.basename(file_to_copy))
+                        files_to_transfer.append((str(file_to_copy), file_to_copy_to))
+        # copy the files to the new folder
+        progress = transfer_files(files_to_transfer, transfer_mode, max_workers)
+        print(f'Copied {progress.files_transferred} files to {directory_to_copy_to}')
 
 
 if __name__ == "__main__":
-    # define the folder we will copy to
-    directory_to_copy_to = './'
+    # define the folder we will copy to, it is cleared first
+    directory_to_copy_to = 'split-training-data'
 
     # define the folder we will search for the images
     directory_to_search = 'training_data'
@@ -0,0 +1,150 @@
+"""
+Persistent index of the files of a dataset grouped by directory and stem
+
+The index is a SQLite database holding the extensions of every stem of every directory along with the mtime of the
+directory. Adding, removing or renaming a file changes the mtime of its directory, so an update only lists the
+directories whose mtime changed and reuses the stored stems and sub directories of the others.
+"""
+import json
+import os
+import sqlite3
+import time
+from typing import Dict, Iterator, List, Tuple
+
+# the default index of a dataset sits next to its folder, e.g. training_data.dataset_splitter_index.sqlite
+# keeping it out of the dataset means writing it does not change the mtime of a directory we index
+INDEX_FILE_SUFFIX = '.dataset_splitter_index.sqlite'
+
+# a directory modified this close to the scan may change again within the mtime resolution of the filesystem
+_UNTRUSTED_MTIME_SECONDS = 2
+
+# indexes written with another version of the schema are rebuilt from scratch
+_SCHEMA_VERSION = 1
+
+# the extensions of a stem are a json list since an extension may hold a comma
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stems (
+    directory TEXT NOT NULL,
+    stem TEXT NOT NULL,
+    extensions TEXT NOT NULL,
+    PRIMARY KEY (directory, stem)
+) WITHOUT ROWID;
+'''
+
+
+def get_default_index_path(root: str) -> str:
+    return os.path.abspath(root).rstrip(os.sep) + INDEX_FILE_SUFFIX
+
+
+class FileIndex:
+    """
+    with FileIndex(index_path) as file_index:
+        file_index.update('training_data')
+        for directory, stem, extensions in file_index.iter_stem_groups('training_data'):
+            ...
+    """
+
+    def __init__(self, index_path: str):
+        self.index_path = index_path
+        self._connection = sqlite3.connect(index_path)
+        if self._connection.execute('PRAGMA user_version').fetchone()[0] != _SCHEMA_VERSION:
+            self._connection.executescript('DROP TABLE IF EXISTS directories; DROP TABLE IF EXISTS stems;')
+            self._connection.execute(f'PRAGMA user_version = {_SCHEMA_VERSION}')
+        self._connection.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._connection.close()
+
+    def _load_directories(self, root: str) -> Tuple[Dict[str, int], Dict[str, List[str]]]:
+        mtimes = {}
+        children = {}
+        for path, parent, mtime_ns in self._connection.execute(
+                'SELECT path, parent, mtime_ns FROM directories WHERE path = ? OR path LIKE ? ESCAPE \'\\\'',
+                (root, _escape_like(root + os.sep) + '%')):
+            mtimes[path] = mtime_ns
+            children.setdefault(parent, []).append(path)
+        return mtimes, children
+
+    def update(self, root: str) -> Dict[str, int]:
+        """
+        Rescan the directories under root whose mtime changed since the last update
+        :return: the number of directories scanned, skipped and removed
+        """
+        root = os.path.abspath(root)
+        stored_mtimes, stored_children = self._load_directories(root)
+        scan_started_ns = time.time_ns()
+        visited = set()
+        statistics = {'scanned': 0, 'skipped': 0, 'removed': 0}
+        directories_to_visit = [root]
+        with self._connection:
+            while directories_to_visit:
+                directory = directories_to_visit.pop()
+                try:
+                    mtime_ns = os.stat(directory).st_mtime_ns
+                except FileNotFoundError:
+                    continue
+                visited.add(directory)
+
+                if stored_mtimes.get(directory) == mtime_ns:
+                    directories_to_visit.extend(stored_children.get(directory, []))
+                    statistics['skipped'] += 1
+                    continue
+
+                stems, sub_directories = _scan_directory(directory, self.index_path)
+                self._connection.execute('DELETE FROM stems WHERE directory = ?', (directory,))
+                self._connection.executemany(
+                    'INSERT INTO stems (directory, stem, extensions) VALUES (?, ?, ?)',
+                    ((directory, stem, json.dumps(sorted(extensions))) for stem, extensions in stems.items()))
+                if scan_started_ns - mtime_ns < _UNTRUSTED_MTIME_SECONDS * 10 ** 9:
+                    # force a rescan next time
+                    mtime_ns = -1
+                self._connection.execute(
+                    'INSERT OR REPLACE INTO directories (path, parent, mtime_ns) VALUES (?, ?, ?)',
+                    (directory, os.path.dirname(directory) if directory != root else None, mtime_ns))
+                directories_to_visit.extend(sub_directories)
+                statistics['scanned'] += 1
+
+            removed = [directory for directory in stored_mtimes if directory not in visited]
+            self._connection.executemany('DELETE FROM directories WHERE path = ?', ((d,) for d in removed))
+            self._connection.executemany('DELETE FROM stems WHERE directory = ?', ((d,) for d in removed))
+            statistics['removed'] = len(removed)
+        return statistics
+
+    def iter_stem_groups(self, root: str) -> Iterator[Tuple[str, str, List[str]]]:
+        """
+        Iterate over (directory, stem, extensions) of every stem under root, directories are absolute
+        """
+        root = os.path.abspath(root)
+        for directory, stem, extensions in self._connection.execute(
+                'SELECT directory, stem, extensions FROM stems WHERE directory = ? OR directory LIKE ? ESCAPE \'\\\'',
+                (root, _escape_like(root + os.sep) + '%')):
+            yield directory, stem, json.loads(extensions)
+
+
+def _escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _scan_directory(directory: str, index_path: str) -> Tuple[Dict[str, List[str]], List[str]]:
+    stems = {}
+    sub_directories = []
+    index_path = os.path.abspath(index_path)
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                sub_directories.append(entry.path)
+            elif entry.is_file() and INDEX_FILE_SUFFIX not in entry.name and entry.path != index_path:
+                stem, extension = os.path.splitext(entry.name)
+                stems.setdefault(stem, []).append(extension)
+    return stems, sub_directories
@@ -0,0 +1,191 @@
+"""
+Transfer files in process on a pool of threads instead of forking cp once per file
+
+Modes:
+* hardlink: a new name for the same file, needs the same filesystem
+* symlink: a link to the absolute path of the source
+* reflink: a copy on write clone of the file (FICLONE), falls back to copy_file_range when cloning is not supported
+* copy: a regular copy
+
+The auto mode picks the cheapest mode supported between the two folders, hardlink then reflink then copy.
+Symlinks are never picked automatically since they break when the source folder moves.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Iterable, List, Tuple
+
+# the instrumentation shared by the scripts sits in its own folder next to this one
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'instrumentation'))
+
+from instrumentation import get_instrumentation
+
+TRANSFER_MODES = ['hardlink', 'symlink', 'reflink', 'copy']
+
+# ioctl request cloning a whole file on linux, see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+
+class FileTransferError(Exception):
+    """
+    Raised when some of the files could not be transferred
+    """
+
+    def __init__(self, errors: List[Tuple[str, Exception]]):
+        self.errors = errors
+        path, error = errors[0]
+        super().__init__(f'Failed to transfer {len(errors)} files, first error for {path}: {error}')
+
+
+class TransferProgress:
+    """
+    Thread safe counters of a transfer, printed at most every print_interval seconds
+    """
+
+    def __init__(self, print_interval: float = 5.0):
+        self.files_transferred = 0
+        self.bytes_transferred = 0
+        self.errors: List[Tuple[str, Exception]] = []
+        self.print_interval = print_interval
+        self._start = time.perf_counter()
+        self._last_print = self._start
+        self._lock = threading.Lock()
+
+    def add_file(self, number_of_bytes: int):
+        with self._lock:
+            self.files_transferred += 1
+            self.bytes_transferred += number_of_bytes
+            now = time.perf_counter()
+            if now - self._last_print >= self.print_interval:
+                self._last_print = now
+                print(self.summary())
+
+    def add_error(self, path: str, error: Exception):
+        with self._lock:
+            self.errors.append((path, error))
+
+    def summary(self) -> str:
+        elapsed = max(time.perf_counter() - self._start, 1e-9)
+        return (f'Transferred {self.files_transferred} files ({self.bytes_transferred / 1e6:.1f} MB) '
+                f'at {self.files_transferred / elapsed:.0f} files/s')
+
+
+def reflink_file(source: str, destination: str):
+    """
+    Clone source to destination, falls back to copy_file_range which lets the filesystem share or copy the blocks
+    """
+    with open(source, 'rb') as source_file, open(destination, 'wb') as destination_file:
+        if sys.platform.startswith('linux'):
+            import fcntl
+            try:
+                fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+                return
+            except OSError:
+                pass
+        if not hasattr(os, 'copy_file_range'):
+            shutil.copyfileobj(source_file, destination_file)
+            return
+        remaining = os.fstat(source_file.fileno()).st_size
+        while remaining > 0:
+            copied = os.copy_file_range(source_file.fileno(), destination_file.fileno(), remaining)
+            if copied == 0:
+                break
+            remaining -= copied
+
+
+def transfer_file(source: str, destination: str, mode: str):
+    """
+    Transfer a single file, an existing destination is replaced
+    """
+    if os.path.lexists(destination):
+        os.remove(destination)
+    if mode == 'hardlink':
+        os.link(source, destination)
+    elif mode == 'symlink':
+        os.symlink(os.path.abspath(source), destination)
+    elif mode == 'reflink':
+        reflink_file(source, destination)
+    elif mode == 'copy':
+        shutil.copyfile(source, destination)
+    else:
+        raise ValueError('mode must be one of: {}'.format(TRANSFER_MODES))
+
+
+def _supports_mode(source_file: str, destination_directory: str, mode: str) -> bool:
+    probe_path = os.path.join(destination_directory, f'.transfer_probe_{os.getpid()}_{threading.get_ident()}')
+    try:
+        if mode == 'reflink':
+            # only a real clone counts, copy_file_range always works
+            import fcntl
+            with open(source_file, 'rb') as source, open(probe_path, 'wb') as destination:
+                fcntl.ioctl(destination.fileno(), FICLONE, source.fileno())
+        else:
+            transfer_file(source_file, probe_path, mode)
+        return True
+    except (OSError, ImportError):
+        return False
+    finally:
+        if os.path.lexists(probe_path):
+            os.remove(probe_path)
+
+
+def detect_transfer_mode(source_directory: str, destination_directory: str) -> str:
+    """
+    Get the cheapest mode supported to transfer files from source_directory to destination_directory
+    Links and clones need both folders on the same filesystem, the probe file is created in destination_directory
+    so the source folder is never written to, a read only dataset falls back to copy like any error
+    """
+    try:
+        os.makedirs(destination_directory, exist_ok=True)
+        if os.stat(source_directory).st_dev != os.stat(destination_directory).st_dev:
+            return 'copy'
+        with tempfile.NamedTemporaryFile(dir=destination_directory, prefix='.transfer_probe_source_') as probe_file:
+            probe_file.write(b'probe')
+            probe_file.flush()
+            for mode in ['hardlink', 'reflink']:
+                if _supports_mode(probe_file.name, destination_directory, mode):
+                    return mode
+    except OSError:
+        pass
+    return 'copy'
+
+
+def transfer_files(file_pairs: Iterable[Tuple[str, str]], mode: str = 'copy', max_workers: int = 16,
+                   max_in_flight: int = 1024, progress: TransferProgress = None) -> TransferProgress:
+    """
+    Transfer every (source, destination) pair on a pool of threads, the destination folders must exist
+    file_pairs may be a generator, transfers start as soon as the first pair is produced
+    :param max_in_flight: The number of pairs submitted to the pool but not transferred yet
+    :raises FileTransferError: if some of the files could not be transferred
+    """
+    if mode not in TRANSFER_MODES:
+        raise ValueError('mode must be one of: {}'.format(TRANSFER_MODES))
+    if progress is None:
+        progress = TransferProgress()
+    instrumentation = get_instrumentation()
+
+    def transfer(source: str, destination: str):
+        try:
+            with instrumentation.stage('copy'):
+                transfer_file(source, destination, mode)
+            number_of_bytes = os.path.getsize(source)
+            progress.add_file(number_of_bytes)
+            instrumentation.count('files_transferred')
+            instrumentation.count('bytes_transferred', number_of_bytes)
+        except Exception as error:
+            progress.add_error(source, error)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = set()
+        for source, destination in file_pairs:
+            if len(in_flight) >= max_in_flight:
+                _, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            in_flight.add(executor.submit(transfer, source, destination))
+    print(progress.summary())
+    if progress.errors:
+        raise FileTransferError(progress.errors)
+    return progress
@@ -0,0 +1,345 @@
+"""
+Find identical and near identical images of a dataset so duplicates are dropped before sampling
+
+Every image gets an exact hash of its bytes, a 64 bit difference hash of its content and a 32x32 thumbnail, computed
+on a pool of processes and cached in a SQLite database keyed by path, size and mtime, so reruns only hash new or
+modified files.
+Images sharing an exact hash are duplicates. The images left are clustered with a BK-tree of their 8x8 coarse
+thumbnails under the largest difference of a pixel: in path order, the images kept before whose coarse thumbnail is
+within COARSE_TOLERANCE of the coarse thumbnail of an image and whose difference hash is within max_distance bits of
+its hash are its candidates, the first max_candidates of them are compared, and it is a duplicate of the first
+candidate whose thumbnail has at most max_changed_pixels pixels differing by more than PIXEL_TOLERANCE, otherwise it
+is kept and added to the tree. Queries only visit the branches of the tree whose distance can match, so the
+clustering does not compare every pair of images.
+
+The difference hash alone is not enough to pick the candidates since small shapes on flat backgrounds barely change
+it: distinct generated images often share it, so the candidates grew with the square of the images. The coarse
+thumbnails tell the shapes apart, while a JPEG re-encode or a resize of an image moves them by a couple of levels.
+"""
+import functools
+import hashlib
+import os
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# the instrumentation shared by the scripts sits in its own folder next to this one
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'instrumentation'))
+
+from instrumentation import get_instrumentation
+
+# the default cache of a dataset sits next to its folder like the file index
+HASH_CACHE_FILE_SUFFIX = '.dataset_splitter_hashes.sqlite'
+
+# difference hashes of re-encoded or resized images are usually within this many bits
+DEFAULT_MAX_DISTANCE = 4
+
+# near duplicates have at most DEFAULT_MAX_CHANGED_PIXELS pixels of their thumbnails differing by more than
+# PIXEL_TOLERANCE on a channel
+THUMBNAIL_SIZE = (32, 32)
+PIXEL_TOLERANCE = 32
+DEFAULT_MAX_CHANGED_PIXELS = 1
+
+# candidates have coarse thumbnails, the means of the 4x4 blocks of the thumbnails, differing by at most
+# COARSE_TOLERANCE on every pixel and channel, re-encoded or resized images move them by a couple of levels
+COARSE_THUMBNAIL_SIZE = (8, 8)
+COARSE_TOLERANCE = 8
+
+# the most candidates whose thumbnails are compared to the thumbnail of an image, the first ones kept
+DEFAULT_MAX_CANDIDATES = 16
+
+# thumbnails are read back from the cache when an image has candidates, the last ones read are kept in memory
+THUMBNAILS_IN_MEMORY = 4096
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    exact TEXT NOT NULL,
+    perceptual TEXT,
+    thumbnail BLOB
+) WITHOUT ROWID;
+'''
+
+
+class ImageHash(NamedTuple):
+    # blake2b of the bytes of the file
+    exact: str
+    # 64 bit difference hash, None when the image could not be decoded
+    perceptual: Optional[int]
+
+
+def get_default_hash_cache_path(root: str) -> str:
+    return os.path.abspath(root).rstrip(os.sep) + HASH_CACHE_FILE_SUFFIX
+
+
+def compute_difference_hash(image: np.ndarray) -> int:
+    """
+    Hash a grayscale image into 64 bits, one per pair of horizontal neighbours of its 9x8 thumbnail
+    """
+    thumbnail = cv2.resize(image, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = thumbnail[:, 1:] > thumbnail[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hash_image(path: str) -> Tuple[ImageHash, Optional[bytes]]:
+    """
+    Hash an image file
+    :return: the hash and the bytes of the BGR thumbnail of the image, None when it could not be decoded
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    exact = hashlib.blake2b(data, digest_size=16).hexdigest()
+    # decoding at a quarter of the size is enough for the thumbnails and much faster
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_REDUCED_COLOR_4)
+    if image is None:
+        return ImageHash(exact, None), None
+    thumbnail = cv2.resize(image, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+    perceptual = compute_difference_hash(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
+    return ImageHash(exact, perceptual), thumbnail.tobytes()
+
+
+def _hash_images(paths: List[str]) -> List[Tuple[Optional[ImageHash], Optional[bytes]]]:
+    results = []
+    for path in paths:
+        try:
+            results.append(hash_image(path))
+        except OSError:
+            # a file that cannot be read is reported as unhashable instead of ending the run
+            results.append((None, None))
+    return results
+
+
+def count_changed_pixels(thumbnail: np.ndarray, other_thumbnails: np.ndarray) -> np.ndarray:
+    """
+    Count the pixels of every (N, 32, 32, 3) other thumbnail differing from thumbnail by more than PIXEL_TOLERANCE
+    """
+    difference = np.abs(other_thumbnails.astype(np.int16) - thumbnail.astype(np.int16)) > PIXEL_TOLERANCE
+    # a max over the 3 channels of the last axis is much slower than combining them
+    changed = difference[..., 0] | difference[..., 1] | difference[..., 2]
+    return np.count_nonzero(changed.reshape(len(changed), -1), axis=1)
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+def compute_coarse_thumbnail(thumbnail: np.ndarray) -> np.ndarray:
+    """
+    Shrink a (32, 32, 3) thumbnail to the (8, 8, 3) means of its 4x4 blocks
+    """
+    return cv2.resize(thumbnail, COARSE_THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+
+
+def coarse_distance(a: np.ndarray, b: np.ndarray) -> int:
+    """
+    The largest difference between a pixel of a and b on a channel
+    """
+    return int(cv2.norm(a, b, cv2.NORM_INF))
+
+
+class HashCache:
+    """
+    with HashCache(cache_path) as hash_cache:
+        hashes = hash_cache.get_hashes(paths, max_workers)
+    """
+
+    def __init__(self, cache_path: str):
+        self.cache_path = cache_path
+        self._connection = sqlite3.connect(cache_path)
+        self._connection.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._connection.close()
+
+    def get_hashes(self, paths: List[str], max_workers: int = None,
+                   files_per_task: int = 256) -> List[Optional[ImageHash]]:
+        """
+        Get the hash of every path, only the files missing from the cache or modified since are hashed
+        :param max_workers: The number of processes hashing the files, defaults to the number of cpus
+        :return: the hashes, None for the files that could not be read, which are not cached
+        """
+        instrumentation = get_instrumentation()
+        hashes: List[Optional[ImageHash]] = [None] * len(paths)
+        stats = []
+        paths_to_hash = []
+        unhashable = []
+        for i, path in enumerate(paths):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                stats.append(None)
+                unhashable.append(i)
+                continue
+            stats.append((stat.st_size, stat.st_mtime_ns))
+            row = self._connection.execute('SELECT size, mtime_ns, exact, perceptual FROM hashes WHERE path = ?',
+                                           (path,)).fetchone()
+            if row is not None and (row[0], row[1]) == stats[i]:
+                hashes[i] = ImageHash(row[2], None if row[3] is None else int(row[3], 16))
+            else:
+                paths_to_hash.append(i)
+        print(f'Hashing {len(paths_to_hash)} images, {len(paths) - len(paths_to_hash)} were cached')
+
+        chunks = [paths_to_hash[start:start + files_per_task]
+                  for start in range(0, len(paths_to_hash), files_per_task)]
+        with instrumentation.stage('hash', items=len(paths_to_hash)):
+            if max_workers == 1 or len(chunks) <= 1:
+                results = [_hash_images([paths[i] for i in chunk]) for chunk in chunks]
+            else:
+                with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                    results = list(executor.map(_hash_images, [[paths[i] for i in chunk] for chunk in chunks]))
+        instrumentation.count('images_hashed', len(paths_to_hash))
+
+        with self._connection:
+            for chunk, chunk_results in zip(chunks, results):
+                for i, (image_hash, _) in zip(chunk, chunk_results):
+                    hashes[i] = image_hash
+                    if image_hash is None:
+                        unhashable.append(i)
+                self._connection.executemany(
+                    'INSERT OR REPLACE INTO hashes (path, size, mtime_ns, exact, perceptual, thumbnail) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    ((paths[i], stats[i][0], stats[i][1], image_hash.exact,
+                      None if image_hash.perceptual is None else format(image_hash.perceptual, '016x'), thumbnail)
+                     for i, (image_hash, thumbnail) in zip(chunk, chunk_results) if image_hash is not None))
+        instrumentation.count('images_unhashable', len(unhashable))
+        if unhashable:
+            print(f'Could not read {len(unhashable)} images, they are kept without being compared: '
+                  + ', '.join(paths[i] for i in sorted(unhashable)[:10]))
+        return hashes
+
+    def get_thumbnail(self, path: str) -> Optional[np.ndarray]:
+        """
+        Get the (32, 32, 3) BGR thumbnail of an image hashed before, None when it could not be decoded
+        """
+        row = self._connection.execute('SELECT thumbnail FROM hashes WHERE path = ?', (path,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return np.frombuffer(row[0], np.uint8).reshape(THUMBNAIL_SIZE[1], THUMBNAIL_SIZE[0], 3)
+
+
+class BKTree:
+    """
+    A BK-tree of values under an integer distance, 64 bit hashes under the Hamming distance by default
+    Every child of a node sits at a different distance from it, so a query within max_distance of a node only
+    visits the children at a distance of the node within max_distance of the distance of the query
+    """
+
+    def __init__(self, distance: Callable[[object, object], int] = hamming_distance):
+        # node: (value, item, {distance: child node})
+        self._root = None
+        self._distance = distance
+        self.size = 0
+
+    def add(self, value, item):
+        self.size += 1
+        if self._root is None:
+            self._root = (value, item, {})
+            return
+        node = self._root
+        while True:
+            distance = self._distance(value, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (value, item, {})
+                return
+            node = child
+
+    def find_within(self, value, max_distance: int) -> Iterator[Tuple[int, object]]:
+        """
+        Iterate over the (distance, item) of every value within max_distance of value
+        """
+        if self._root is None:
+            return
+        nodes_to_visit = [self._root]
+        while nodes_to_visit:
+            node_value, item, children = nodes_to_visit.pop()
+            distance = self._distance(value, node_value)
+            if distance <= max_distance:
+                yield distance, item
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    nodes_to_visit.append(child)
+
+
+def find_duplicates(hashes: List[Optional[ImageHash]], get_thumbnail: Callable[[int], np.ndarray],
+                    max_distance: int = DEFAULT_MAX_DISTANCE,
+                    max_changed_pixels: int = DEFAULT_MAX_CHANGED_PIXELS,
+                    max_candidates: int = DEFAULT_MAX_CANDIDATES) -> List[int]:
+    """
+    Get the index of the image every image duplicates, its own index for the images kept
+    Images are kept in order, so an image is only ever a duplicate of an image before it
+    Images without a hash, the files that could not be read, are kept
+    :param get_thumbnail: Get the thumbnail of the image of an index, only called for images with a difference hash
+    :param max_distance: The largest Hamming distance between the difference hashes of candidates
+    :param max_changed_pixels: The most pixels of the thumbnails of near duplicates differing by more than
+    PIXEL_TOLERANCE, a negative value only finds exact duplicates
+    :param max_candidates: The most candidates compared to an image, the first ones kept
+    """
+    kept_by_exact_hash: Dict[str, int] = {}
+    tree = BKTree(coarse_distance)
+    duplicate_of = []
+    for i, image_hash in enumerate(hashes):
+        if image_hash is None:
+            duplicate_of.append(i)
+            continue
+        original = kept_by_exact_hash.get(image_hash.exact)
+        thumbnail = coarse_thumbnail = None
+        if original is None and max_changed_pixels >= 0 and image_hash.perceptual is not None:
+            thumbnail = get_thumbnail(i)
+            coarse_thumbnail = compute_coarse_thumbnail(thumbnail)
+            # the first images kept among the candidates matching the thumbnail
+            candidates = sorted(candidate for _, candidate in tree.find_within(coarse_thumbnail, COARSE_TOLERANCE)
+                                if hamming_distance(image_hash.perceptual, hashes[candidate].perceptual)
+                                <= max_distance)[:max_candidates]
+            if candidates:
+                changed_pixels = count_changed_pixels(thumbnail,
+                                                      np.stack([get_thumbnail(candidate) for candidate in candidates]))
+                matches = np.flatnonzero(changed_pixels <= max_changed_pixels)
+                if len(matches):
+                    original = candidates[matches[0]]
+        if original is None:
+            original = i
+            kept_by_exact_hash[image_hash.exact] = i
+            if coarse_thumbnail is not None:
+                tree.add(coarse_thumbnail, i)
+        duplicate_of.append(original)
+    return duplicate_of
+
+
+def deduplicate_images(images: List[str], max_distance: int = DEFAULT_MAX_DISTANCE,
+                       max_changed_pixels: int = DEFAULT_MAX_CHANGED_PIXELS, max_workers: int = None,
+                       cache_path: str = None, max_candidates: int = DEFAULT_MAX_CANDIDATES) -> List[int]:
+    """
+    Get the index of the image every image duplicates, see find_duplicates, images are sorted by path first so the
+    image kept in a group of duplicates does not depend on the order they were found in
+    :param max_workers: The number of processes hashing the images, defaults to the number of cpus
+    :param cache_path: The hash cache, the hashes are not cached when None
+    :param max_candidates: The most candidates compared to an image
+    """
+    order = sorted(range(len(images)), key=lambda i: images[i])
+    sorted_images = [images[i] for i in order]
+    with HashCache(':memory:' if cache_path is None else cache_path) as hash_cache:
+        hashes = hash_cache.get_hashes(sorted_images, max_workers)
+
+        @functools.lru_cache(maxsize=THUMBNAILS_IN_MEMORY)
+        def get_thumbnail(index: int) -> np.ndarray:
+            return hash_cache.get_thumbnail(sorted_images[index])
+
+        sorted_duplicate_of = find_duplicates(hashes, get_thumbnail, max_distance, max_changed_pixels,
+                                               max_candidates)
+    duplicate_of = [0] * len(images)
+    for sorted_index, original in enumerate(sorted_duplicate_of):
+        duplicate_of[order[sorted_index]] = order[original]
+    return duplicate_of
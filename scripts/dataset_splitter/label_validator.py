@@ -0,0 +1,349 @@
+"""
+Validate the darknet labels and DarkMark json files of a dataset in bulk
+
+The label files are parsed on a pool of processes into a single columnar array of (class, cx, cy, w, h, source)
+rows, where source is the index of the stem of the label in the list of stems, the array can be memory-mapped.
+Every check and histogram is then computed on the whole array at once with numpy.
+
+Checks:
+* malformed: lines that are not 5 numbers and label files that are not text
+* class_not_integer, class_out_of_range: class indexes that are not a line of the .names file
+* out_of_range: coordinates outside [0, 1], nan or infinite, or boxes extending past the image
+* zero_area: boxes with a width or height of 0
+* label_without_image, image_without_label, missing_json: stems missing some of their files
+* darkmark_mismatch: stems whose .json marks are not the boxes of their .txt
+"""
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, NamedTuple, Tuple
+
+import numpy as np
+
+from dataset_splitter import image_file_extensions, iter_stems_by_directory
+
+LABEL_DTYPE = np.dtype([('class', np.int32), ('cx', np.float32), ('cy', np.float32), ('w', np.float32),
+                        ('h', np.float32), ('source', np.int32)])
+
+# darknet writes 10 decimals, DarkMark keeps the full float of its rect
+COORDINATE_TOLERANCE = 1e-4
+
+# examples kept per check in the report
+MAX_EXAMPLES = 10
+
+
+class LabelColumns(NamedTuple):
+    labels: np.ndarray
+    # (source, line number, line) of every line that could not be parsed
+    parse_errors: List[Tuple[int, int, str]]
+    # non integer class indexes are truncated in labels, their rows are listed here
+    non_integer_class_rows: np.ndarray
+
+
+class StemGroups(NamedTuple):
+    # directory/stem of every stem, their index is the source of the labels
+    stems: List[str]
+    # extensions of every stem
+    extensions: List[List[str]]
+
+
+def find_stem_groups(directory_to_search: str) -> StemGroups:
+    """
+    Group the files of every directory by their stem, see dataset_splitter.iter_stems_by_directory
+    Stems are sorted so the sources of a dataset do not depend on the order the filesystem lists it in
+    """
+    stems = []
+    extensions = []
+    for directory, extensions_by_stem in iter_stems_by_directory(directory_to_search):
+        for stem in sorted(extensions_by_stem):
+            stems.append(os.path.join(directory, stem))
+            extensions.append(extensions_by_stem[stem])
+    return StemGroups(stems, extensions)
+
+
+def _parse_darknet_files(label_files: List[Tuple[int, str]]):
+    values = []
+    sources = []
+    parse_errors = []
+    for source, label_file in label_files:
+        try:
+            with open(label_file, encoding='utf-8') as f:
+                lines = [line for line in f.read().splitlines() if line.strip()]
+        except UnicodeDecodeError as error:
+            parse_errors.append((source, 0, str(error)))
+            continue
+        line_tokens = [line.split() for line in lines]
+        # a line short of a token and a line with a token too many would add up to 5 tokens per line
+        if all(len(tokens) == 5 for tokens in line_tokens):
+            try:
+                values.extend(float(token) for tokens in line_tokens for token in tokens)
+                sources.extend([source] * len(lines))
+                continue
+            except ValueError:
+                del values[len(sources) * 5:]
+        # only a malformed file is parsed line by line
+        for line_number, (line, tokens) in enumerate(zip(lines, line_tokens), start=1):
+            try:
+                line_values = [float(token) for token in tokens]
+            except ValueError:
+                line_values = []
+            if len(line_values) != 5:
+                parse_errors.append((source, line_number, line))
+                continue
+            values.extend(line_values)
+            sources.append(source)
+    return np.array(values, np.float64).reshape(-1, 5), np.array(sources, np.int32), parse_errors
+
+
+def _parse_darkmark_files(json_files: List[Tuple[int, str]]):
+    values = []
+    sources = []
+    parse_errors = []
+    for source, json_file in json_files:
+        try:
+            with open(json_file) as f:
+                marks = json.load(f).get('mark', [])
+            for mark in marks:
+                rect = mark['rect']
+                values.extend((mark['class_idx'], rect['x'] + rect['w'] / 2, rect['y'] + rect['h'] / 2, rect['w'],
+                               rect['h']))
+                sources.append(source)
+        except (ValueError, KeyError, TypeError, AttributeError) as error:
+            del values[len(sources) * 5:]
+            parse_errors.append((source, 0, str(error)))
+    return np.array(values, np.float64).reshape(-1, 5), np.array(sources, np.int32), parse_errors
+
+
+def _parse_files(parse_files, files: List[Tuple[int, str]], max_workers: int = None, files_per_task: int = 1000,
+                 memmap_path: str = None) -> LabelColumns:
+    chunks = [files[start:start + files_per_task] for start in range(0, len(files), files_per_task)]
+    if max_workers == 1:
+        results = [parse_files(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            # map keeps the order of the chunks so labels stay sorted by source
+            results = list(executor.map(parse_files, chunks))
+
+    number_of_labels = sum(len(chunk_sources) for _, chunk_sources, _ in results)
+    if memmap_path is None:
+        labels = np.empty(number_of_labels, LABEL_DTYPE)
+    else:
+        labels = np.lib.format.open_memmap(memmap_path, mode='w+', dtype=LABEL_DTYPE, shape=(number_of_labels,))
+    parse_errors = []
+    non_integer_class_rows = []
+    start = 0
+    for chunk_values, chunk_sources, chunk_parse_errors in results:
+        end = start + len(chunk_sources)
+        rows = labels[start:end]
+        # float parses nan and inf, a class that is not finite is kept as -1 and listed as not an integer
+        finite_class = np.isfinite(chunk_values[:, 0])
+        rows['class'] = np.where(finite_class, chunk_values[:, 0], -1)
+        for column, name in enumerate(['cx', 'cy', 'w', 'h'], start=1):
+            rows[name] = chunk_values[:, column]
+        rows['source'] = chunk_sources
+        non_integer_class = ~finite_class | (chunk_values[:, 0] != np.floor(chunk_values[:, 0]))
+        non_integer_class_rows.append(np.flatnonzero(non_integer_class) + start)
+        parse_errors.extend(chunk_parse_errors)
+        start = end
+    if memmap_path is not None:
+        labels.flush()
+    return LabelColumns(labels, parse_errors, np.concatenate(non_integer_class_rows or [np.empty(0, np.int64)]))
+
+
+def parse_label_files(label_files: List[Tuple[int, str]], max_workers: int = None, files_per_task: int = 1000,
+                      memmap_path: str = None) -> LabelColumns:
+    """
+    Parse darknet label files into a LABEL_DTYPE array on max_workers processes, defaults to the number of cpus
+    :param label_files: The (source, path) of every label file
+    :param memmap_path: Save the labels to this .npy file, the labels returned are memory-mapped from it
+    """
+    return _parse_files(_parse_darknet_files, label_files, max_workers, files_per_task, memmap_path)
+
+
+def parse_darkmark_files(json_files: List[Tuple[int, str]], max_workers: int = None,
+                         files_per_task: int = 1000) -> LabelColumns:
+    """
+    Parse the marks of DarkMark json files into a LABEL_DTYPE array, see parse_label_files
+    """
+    return _parse_files(_parse_darkmark_files, json_files, max_workers, files_per_task)
+
+
+def check_labels(labels: np.ndarray, number_of_classes: int = None) -> Dict[str, np.ndarray]:
+    """
+    Get the mask of the rows failing every check
+    """
+    cx, cy, w, h = labels['cx'], labels['cy'], labels['w'], labels['h']
+    out_of_range = (cx < 0) | (cx > 1) | (cy < 0) | (cy > 1) | (w < 0) | (w > 1) | (h < 0) | (h > 1)
+    # float parses nan and inf, nan fails every comparison above
+    out_of_range |= ~(np.isfinite(cx) & np.isfinite(cy) & np.isfinite(w) & np.isfinite(h))
+    # the box may only extend past the image by the rounding of the coordinates
+    out_of_range |= (cx - w / 2 < -COORDINATE_TOLERANCE) | (cx + w / 2 > 1 + COORDINATE_TOLERANCE)
+    out_of_range |= (cy - h / 2 < -COORDINATE_TOLERANCE) | (cy + h / 2 > 1 + COORDINATE_TOLERANCE)
+    checks = {
+        'out_of_range': out_of_range,
+        'zero_area': (w <= 0) | (h <= 0),
+    }
+    class_out_of_range = labels['class'] < 0
+    if number_of_classes is not None:
+        class_out_of_range |= labels['class'] >= number_of_classes
+    checks['class_out_of_range'] = class_out_of_range
+    return checks
+
+
+def find_darkmark_mismatches(labels: np.ndarray, darkmark_labels: np.ndarray, number_of_sources: int) -> np.ndarray:
+    """
+    Get the sources whose DarkMark marks do not hold the same classes and boxes as their darknet labels
+    Only sources having both files should be passed
+    """
+    label_counts = np.bincount(labels['source'], minlength=number_of_sources)
+    darkmark_counts = np.bincount(darkmark_labels['source'], minlength=number_of_sources)
+    mismatched = label_counts != darkmark_counts
+
+    # compare the rows of the sources holding as many marks as labels once both are sorted the same way
+    same_count = ~mismatched
+    labels = labels[same_count[labels['source']]]
+    darkmark_labels = darkmark_labels[same_count[darkmark_labels['source']]]
+
+    def sort_rows(rows):
+        return rows[np.lexsort((np.round(rows['cy'], 3), np.round(rows['cx'], 3), rows['class'], rows['source']))]
+
+    labels = sort_rows(labels)
+    darkmark_labels = sort_rows(darkmark_labels)
+    different = labels['class'] != darkmark_labels['class']
+    for name in ['cx', 'cy', 'w', 'h']:
+        different |= np.abs(labels[name] - darkmark_labels[name]) > COORDINATE_TOLERANCE
+    mismatched[labels['source'][different]] = True
+    return np.flatnonzero(mismatched)
+
+
+def compute_statistics(labels: np.ndarray, number_of_classes: int, number_of_sources: int,
+                       bins: int = 20) -> Dict:
+    """
+    Get the class histogram, the box size histograms and the histogram of the number of boxes per image
+    """
+    edges = np.linspace(0, 1, bins + 1)
+    boxes_per_source = np.bincount(labels['source'], minlength=number_of_sources)
+    class_counts = np.bincount(np.clip(labels['class'], 0, None), minlength=number_of_classes)
+    statistics = {
+        'number_of_labels': int(len(labels)),
+        'class_counts': class_counts.tolist(),
+        'box_size_bin_edges': edges.tolist(),
+        'width_histogram': np.histogram(labels['w'], edges)[0].tolist(),
+        'height_histogram': np.histogram(labels['h'], edges)[0].tolist(),
+        'area_histogram': np.histogram(labels['w'] * labels['h'], edges)[0].tolist(),
+        'boxes_per_image_histogram': np.bincount(boxes_per_source).tolist(),
+    }
+    # the boxes that are not finite are reported as out of range, the means would not be valid json
+    finite = np.isfinite(labels['w']) & np.isfinite(labels['h'])
+    if finite.any():
+        statistics['mean_width'] = float(labels['w'][finite].mean())
+        statistics['mean_height'] = float(labels['h'][finite].mean())
+    return statistics
+
+
+def read_number_of_classes(names_file: str) -> int:
+    with open(names_file) as f:
+        return sum(1 for line in f if line.strip())
+
+
+def validate_dataset(directory_to_search: str, names_file: str = None, max_workers: int = None,
+                     memmap_path: str = None) -> Dict:
+    """
+    Check every label of the dataset and compute its statistics
+    :return: the report holding the number of failures of every check with some examples, and the statistics
+    """
+    stem_groups = find_stem_groups(directory_to_search)
+    stems = stem_groups.stems
+    number_of_sources = len(stems)
+    has_image = np.array([any(extension.lower() in image_file_extensions for extension in extensions)
+                          for extensions in stem_groups.extensions], bool)
+    has_label = np.array(['.txt' in extensions for extensions in stem_groups.extensions], bool)
+    has_json = np.array(['.json' in extensions for extensions in stem_groups.extensions], bool)
+
+    label_sources = np.flatnonzero(has_label)
+    label_columns = parse_label_files([(source, stems[source] + '.txt') for source in label_sources], max_workers,
+                                      memmap_path=memmap_path)
+    labels = label_columns.labels
+    json_sources = np.flatnonzero(has_label & has_json)
+    darkmark_columns = parse_darkmark_files([(source, stems[source] + '.json') for source in json_sources],
+                                            max_workers)
+
+    number_of_classes = None
+    if names_file is not None:
+        number_of_classes = read_number_of_classes(names_file)
+    row_checks = check_labels(labels, number_of_classes)
+    class_not_integer = np.zeros(len(labels), bool)
+    class_not_integer[label_columns.non_integer_class_rows] = True
+    row_checks['class_not_integer'] = class_not_integer
+
+    # a source with an unparsable json cannot be compared
+    darkmark_parse_error_sources = {source for source, _, _ in darkmark_columns.parse_errors}
+    comparable = has_label & has_json
+    comparable[list(darkmark_parse_error_sources)] = False
+    darkmark_mismatch = find_darkmark_mismatches(labels[comparable[labels['source']]],
+                                                 darkmark_columns.labels[comparable[darkmark_columns.labels['source']]],
+                                                 number_of_sources)
+    darkmark_mismatch = darkmark_mismatch[comparable[darkmark_mismatch]]
+
+    source_checks = {
+        'label_without_image': np.flatnonzero(has_label & ~has_image),
+        'image_without_label': np.flatnonzero(has_image & ~has_label),
+        'missing_json': np.flatnonzero(has_image & has_label & ~has_json),
+        'empty_label': np.flatnonzero(has_label & (np.bincount(labels['source'], minlength=number_of_sources) == 0)),
+        'darkmark_mismatch': darkmark_mismatch,
+    }
+
+    checks = {
+        'malformed': {
+            'count': len(label_columns.parse_errors),
+            'examples': [f'{stems[source]}.txt:{line_number}: {line}'
+                         for source, line_number, line in label_columns.parse_errors[:MAX_EXAMPLES]],
+        },
+        'darkmark_unreadable': {
+            'count': len(darkmark_columns.parse_errors),
+            'examples': [f'{stems[source]}.json: {error}'
+                         for source, _, error in darkmark_columns.parse_errors[:MAX_EXAMPLES]],
+        },
+    }
+    for name, failed in row_checks.items():
+        failed_rows = np.flatnonzero(failed)
+        checks[name] = {
+            'count': int(len(failed_rows)),
+            'examples': [f'{stems[labels["source"][row]]}.txt' for row in failed_rows[:MAX_EXAMPLES]],
+        }
+    for name, failed_sources in source_checks.items():
+        checks[name] = {
+            'count': int(len(failed_sources)),
+            'examples': [stems[source] for source in failed_sources[:MAX_EXAMPLES]],
+        }
+
+    return {
+        'directory': os.path.abspath(directory_to_search),
+        'number_of_stems': number_of_sources,
+        'number_of_label_files': int(len(label_sources)),
+        'checks': checks,
+        'statistics': compute_statistics(labels, number_of_classes or int(labels['class'].max(initial=-1)) + 1,
+                                         number_of_sources),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Validate the darknet labels and DarkMark json files of a dataset')
+    parser.add_argument('directory_to_search', help='folder holding the images and their labels')
+    parser.add_argument('--names', help='.names file of the network, enables the class range check')
+    parser.add_argument('--max-workers', type=int, help='processes parsing the labels, defaults to the cpus')
+    parser.add_argument('--memmap', help='.npy file the labels are saved to and memory-mapped from')
+    parser.add_argument('--report', help='json file the report is saved to')
+    args = parser.parse_args()
+
+    report = validate_dataset(args.directory_to_search, args.names, args.max_workers, args.memmap)
+    for name, check in report['checks'].items():
+        print(f'{name}: {check["count"]}')
+        for example in check['examples']:
+            print(f'    {example}')
+    print(f'Class counts: {report["statistics"]["class_counts"]}')
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Saved the report to {args.report}')
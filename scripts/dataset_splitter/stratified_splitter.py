@@ -0,0 +1,197 @@
+"""
+Split a dataset between train, valid and test keeping the share of every class in every split
+
+The labels of every valid stem are parsed on a pool of processes, see label_validator.parse_label_files, into an
+(S, C) matrix holding the number of boxes of every class in every stem.
+Every stem is then put in the stratum of the rarest class it holds, stems without boxes in a stratum of their own,
+and every stratum is shuffled and cut by the split fractions at once with numpy, so rare classes end up in every
+split in proportion instead of vanishing from the small ones.
+"""
+import argparse
+import os
+from typing import List, NamedTuple, Sequence
+
+import numpy as np
+
+from dataset_splitter import image_file_extensions, is_valid_stem_group, write_darknet_data_file
+from label_validator import find_stem_groups, parse_darkmark_files, parse_label_files, read_number_of_classes
+
+SPLIT_NAMES = ['train', 'valid', 'test']
+
+# largest difference between the share of the boxes of a class in a split and the fraction of the split
+CLASS_PROPORTION_TOLERANCE = 0.02
+
+
+class ClassCounts(NamedTuple):
+    # directory/stem of every valid stem
+    stems: List[str]
+    # image of every stem
+    images: List[str]
+    # (S, C) number of boxes of every class in every stem
+    counts: np.ndarray
+
+
+def find_valid_stems(directory_to_search: str):
+    """
+    Get the valid stems of the dataset and their image, see dataset_splitter.is_valid_stem_group
+    """
+    stem_groups = find_stem_groups(directory_to_search)
+    stems = []
+    images = []
+    for stem, extensions in zip(stem_groups.stems, stem_groups.extensions):
+        if len(extensions) > 1 and is_valid_stem_group(extensions):
+            stems.append(stem)
+            images.append(stem + next(extension for extension in extensions
+                                      if extension in image_file_extensions))
+    return stems, images
+
+
+def parse_stem_labels(stems: List[str], max_workers: int = None, use_darkmark: bool = False) -> np.ndarray:
+    """
+    Parse the labels of every stem into a label_validator.LABEL_DTYPE array whose source is the index of the stem
+    :param use_darkmark: Parse the marks of the .json files instead of the .txt files
+    :raises ValueError: if a label could not be parsed
+    """
+    if use_darkmark:
+        label_columns = parse_darkmark_files([(source, stem + '.json') for source, stem in enumerate(stems)],
+                                             max_workers)
+    else:
+        label_columns = parse_label_files([(source, stem + '.txt') for source, stem in enumerate(stems)], max_workers)
+    if label_columns.parse_errors:
+        source, line_number, line = label_columns.parse_errors[0]
+        raise ValueError(f'{len(label_columns.parse_errors)} labels could not be parsed, the first one is '
+                         f'{stems[source]}:{line_number}: {line}')
+    return label_columns.labels
+
+
+def build_class_counts(directory_to_search: str, number_of_classes: int = None, max_workers: int = None,
+                       use_darkmark: bool = False) -> ClassCounts:
+    """
+    Count the boxes of every class in every valid stem of the dataset
+    :param number_of_classes: The number of columns of the counts, defaults to the largest class found plus one
+    :param max_workers: The number of processes parsing the labels, defaults to the number of cpus
+    :param use_darkmark: Count the mark[].class_idx of the .json files instead of the classes of the .txt files
+    :raises ValueError: if a label could not be parsed or a class is outside [0, number_of_classes)
+    """
+    stems, images = find_valid_stems(directory_to_search)
+    labels = parse_stem_labels(stems, max_workers, use_darkmark)
+    if number_of_classes is None:
+        number_of_classes = int(labels['class'].max(initial=-1)) + 1
+    if np.any((labels['class'] < 0) | (labels['class'] >= number_of_classes)):
+        raise ValueError(f'Some classes are outside [0, {number_of_classes}), run label_validator.py to find them')
+    flat_counts = np.bincount(labels['source'].astype(np.int64) * number_of_classes + labels['class'],
+                              minlength=len(stems) * number_of_classes)
+    return ClassCounts(stems, images, flat_counts.reshape(len(stems), number_of_classes).astype(np.int32))
+
+
+def assign_strata(counts: np.ndarray) -> np.ndarray:
+    """
+    Get the stratum of every stem, the rarest class it holds, or C for stems without boxes
+    """
+    number_of_classes = counts.shape[1]
+    class_totals = counts.sum(axis=0)
+    # ties between classes of the same total go to the lowest class
+    rarity = np.where(counts > 0, class_totals[np.newaxis, :], np.iinfo(np.int64).max)
+    strata = np.argmin(rarity, axis=1)
+    strata[~counts.any(axis=1)] = number_of_classes
+    return strata
+
+
+def rank_within_strata(strata: np.ndarray, random_state: np.random.RandomState):
+    """
+    Shuffle the stems of every stratum by sorting on (stratum, random key)
+    :return: the order of the stems sorted by stratum and the rank of every stem of that order within its stratum
+    """
+    order = np.lexsort((random_state.random_sample(len(strata)), strata))
+    sorted_strata = strata[order]
+    ranks = np.arange(len(order)) - np.searchsorted(sorted_strata, sorted_strata, side='left')
+    return order, ranks
+
+
+def stratified_split(counts: np.ndarray, split_fractions: Sequence[float], seed: int = None) -> np.ndarray:
+    """
+    Assign every stem to a split so the stems of every stratum are cut by the split fractions
+    Like dataset_splitter.split_by_fractions, the cuts are rounded cumulative fractions of every stratum
+    :return: the (S,) index of the split of every stem
+    """
+    random_state = np.random.RandomState(np.random.MT19937(np.random.SeedSequence(seed)))
+    strata = assign_strata(counts)
+    order, ranks = rank_within_strata(strata, random_state)
+    stratum_sizes = np.bincount(strata)[strata[order]]
+
+    cumulative_fractions = np.cumsum(split_fractions) / sum(split_fractions)
+    cuts = np.rint(stratum_sizes[:, np.newaxis] * cumulative_fractions[np.newaxis, :])
+    assignments = np.empty(len(order), np.int8)
+    assignments[order] = (ranks[:, np.newaxis] >= cuts).sum(axis=1)
+    return assignments
+
+
+def compute_class_proportions(counts: np.ndarray, assignments: np.ndarray, number_of_splits: int) -> np.ndarray:
+    """
+    Get the (K, C) share of the boxes of every class held by every split
+    """
+    split_counts = np.zeros((number_of_splits, counts.shape[1]), np.int64)
+    np.add.at(split_counts, assignments, counts)
+    return split_counts / np.maximum(counts.sum(axis=0), 1)[np.newaxis, :]
+
+
+def write_stratified_list_files(directory_to_search: str, output_folder: str, network_name: str,
+                                split_fractions=(0.8, 0.1, 0.1), fraction: float = 1.0, seed: int = None,
+                                names_file: str = None, max_workers: int = None, use_darkmark: bool = False,
+                                tolerance: float = CLASS_PROPORTION_TOLERANCE):
+    """
+    Write the train, valid and test lists of fraction of the dataset in one pass, keeping the share of every class
+    Lists are named like dataset_splitter.write_darknet_list_files names them, lists with a fraction of 0 are
+    not written, and the .data file is written too when names_file is given
+    :param fraction: The fraction of the stems kept, the stems left out are stratified like a split of their own
+    :param tolerance: Classes whose share in a split differs from the split fraction by more are printed
+    :return: the path of every list written and the (K, C) share of every class in every split
+    """
+    number_of_classes = None if names_file is None else read_number_of_classes(names_file)
+    class_counts = build_class_counts(directory_to_search, number_of_classes, max_workers, use_darkmark)
+    print(f'Counted the classes of {len(class_counts.stems)} stems')
+
+    kept_fractions = [split_fraction / sum(split_fractions) * fraction for split_fraction in split_fractions]
+    # the stems left out go to a last split that is not written
+    assignments = stratified_split(class_counts.counts, kept_fractions + [1 - fraction], seed)
+    class_proportions = compute_class_proportions(class_counts.counts, assignments, len(kept_fractions) + 1)
+
+    present_classes = class_counts.counts.sum(axis=0) > 0
+    deviations = np.abs(class_proportions[:len(kept_fractions)] - np.array(kept_fractions)[:, np.newaxis])
+    for split_index, class_index in zip(*np.nonzero((deviations > tolerance) & present_classes[np.newaxis, :])):
+        print(f'Class {class_index} has {class_proportions[split_index, class_index]:.3f} of its boxes in '
+              f'{SPLIT_NAMES[split_index]} instead of {kept_fractions[split_index]:.3f}')
+
+    os.makedirs(output_folder, exist_ok=True)
+    list_paths = {}
+    for split_index, (list_name, split_fraction) in enumerate(zip(SPLIT_NAMES, split_fractions)):
+        if split_fraction == 0:
+            continue
+        list_paths[list_name] = os.path.abspath(os.path.join(output_folder, f'{network_name}_{list_name}.txt'))
+        sources = np.flatnonzero(assignments == split_index)
+        with open(list_paths[list_name], 'w') as f:
+            f.writelines(f'{class_counts.images[source]}\n' for source in sources.tolist())
+        print(f'Wrote {len(sources)} images to {list_paths[list_name]}')
+
+    if names_file is not None:
+        write_darknet_data_file(output_folder, network_name, list_paths, names_file)
+    return list_paths, class_proportions[:len(kept_fractions)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Write class stratified darknet train, valid and test lists')
+    parser.add_argument('directory_to_search', help='folder holding the images and their labels')
+    parser.add_argument('output_folder', help='folder the lists are written to')
+    parser.add_argument('network_name', help='prefix of the lists, e.g. shapes_neural_network')
+    parser.add_argument('--split-fractions', type=float, nargs=3, default=[0.8, 0.1, 0.1],
+                        metavar=('TRAIN', 'VALID', 'TEST'))
+    parser.add_argument('--fraction', type=float, default=1.0, help='fraction of the dataset to split')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--names', help='.names file of the network, the .data file is written when given')
+    parser.add_argument('--max-workers', type=int, help='processes parsing the labels, defaults to the cpus')
+    parser.add_argument('--darkmark', action='store_true', help='read the classes of the .json files')
+    args = parser.parse_args()
+
+    write_stratified_list_files(args.directory_to_search, args.output_folder, args.network_name,
+                                args.split_fractions, args.fraction, args.seed, args.names, args.max_workers,
+                                args.darkmark)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the scripts import their sibling modules as they do when run from their own folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
@@ -0,0 +1,60 @@
+import os
+
+from dataset_splitter import get_fraction_of_dataset, get_valid_files, write_darknet_list_files
+
+DIRECTORIES = ['aqua', 'gold']
+
+
+def create_training_data(folder, number_of_stems: int = 20):
+    # every directory holds the same file names, 1 in 5 stems misses its .json
+    for directory in DIRECTORIES:
+        os.makedirs(os.path.join(folder, directory))
+        for stem in range(number_of_stems):
+            extensions = ['.jpg', '.txt'] if stem % 5 == 0 else ['.jpg', '.txt', '.json']
+            for extension in extensions:
+                with open(os.path.join(folder, directory, f'circle_{stem}{extension}'), 'w') as f:
+                    f.write(f'{directory} {stem}')
+    return str(folder)
+
+
+def list_files(folder):
+    return sorted(os.path.relpath(os.path.join(directory, file_name), folder)
+                  for directory, _, file_names in os.walk(folder) for file_name in file_names)
+
+
+def test_valid_files_are_grouped_per_directory(tmp_path):
+    training_data = create_training_data(tmp_path / 'training_data')
+    for use_index in [False, True]:
+        valid_files = get_valid_files(training_data, use_index, str(tmp_path / 'index.sqlite'))
+        assert sorted(valid_files) == sorted(os.path.join(training_data, directory, f'circle_{stem}')
+                                             for directory in DIRECTORIES for stem in range(20) if stem % 5)
+
+
+def test_write_darknet_list_files_lists_every_valid_image(tmp_path):
+    training_data = create_training_data(tmp_path / 'training_data')
+    list_paths = write_darknet_list_files(training_data, str(tmp_path / 'lists'), 'shapes', seed=1)
+    images = []
+    for list_path in list_paths.values():
+        with open(list_path) as f:
+            images.extend(f.read().splitlines())
+    assert sorted(images) == sorted(os.path.join(training_data, directory, f'circle_{stem}.jpg')
+                                    for directory in DIRECTORIES for stem in range(20) if stem % 5)
+
+
+def test_get_fraction_of_dataset_picks_the_same_files_for_a_seed(tmp_path):
+    training_data = create_training_data(tmp_path / 'training_data')
+    for streaming in [False, True]:
+        picked = []
+        for run in ['first', 'second']:
+            directory_to_copy_to = str(tmp_path / f'{run}_{streaming}')
+            get_fraction_of_dataset(training_data, directory_to_copy_to, 0.5, transfer_mode='copy', max_workers=2,
+                                    streaming=streaming, seed=3)
+            picked.append(list_files(directory_to_copy_to))
+        assert picked[0] == picked[1]
+        # half of the 16 valid stems of every directory with their 3 files
+        assert len(picked[0]) == len(DIRECTORIES) * 8 * 3
+        # every file is copied to the same place under its directory
+        for path in picked[0]:
+            with open(os.path.join(training_data, path)) as source, \
+                    open(os.path.join(tmp_path, f'first_{streaming}', path)) as destination:
+                assert source.read() == destination.read(), path
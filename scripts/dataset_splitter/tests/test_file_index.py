@@ -0,0 +1,73 @@
+import os
+import shutil
+import sqlite3
+
+from file_index import FileIndex
+
+# mtimes far enough in the past for the index to trust them
+OLD_MTIME_NS = 1_600_000_000 * 10 ** 9
+
+
+def create_file(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'w').close()
+
+
+def set_old_mtimes(folder, offset_ns: int = 0):
+    for directory, _, _ in os.walk(folder):
+        os.utime(directory, ns=(OLD_MTIME_NS + offset_ns, OLD_MTIME_NS + offset_ns))
+
+
+def read_stem_groups(file_index: FileIndex, folder) -> dict:
+    return {os.path.relpath(os.path.join(directory, stem), folder): sorted(extensions)
+            for directory, stem, extensions in file_index.iter_stem_groups(str(folder))}
+
+
+def test_update_only_rescans_the_directories_that_changed(tmp_path):
+    folder = tmp_path / 'training_data'
+    for path in ['aqua/circle_0.jpg', 'aqua/circle_0.txt', 'gold/square_0.jpg', 'gold/deep/star_0.jpg']:
+        create_file(folder / path)
+    set_old_mtimes(folder)
+
+    with FileIndex(str(tmp_path / 'index.sqlite')) as file_index:
+        assert file_index.update(str(folder)) == {'scanned': 4, 'skipped': 0, 'removed': 0}
+        assert file_index.update(str(folder)) == {'scanned': 0, 'skipped': 4, 'removed': 0}
+
+        create_file(folder / 'aqua' / 'circle_0.json')
+        os.utime(folder / 'aqua', ns=(OLD_MTIME_NS + 1, OLD_MTIME_NS + 1))
+        assert file_index.update(str(folder)) == {'scanned': 1, 'skipped': 3, 'removed': 0}
+        assert read_stem_groups(file_index, folder)[os.path.join('aqua', 'circle_0')] == ['.jpg', '.json', '.txt']
+
+        # removing a directory changes the mtime of its parent, its sub directories are dropped with it
+        shutil.rmtree(folder / 'gold')
+        os.utime(folder, ns=(OLD_MTIME_NS + 2, OLD_MTIME_NS + 2))
+        assert file_index.update(str(folder)) == {'scanned': 1, 'skipped': 1, 'removed': 2}
+        assert read_stem_groups(file_index, folder) == {os.path.join('aqua', 'circle_0'): ['.jpg', '.json', '.txt']}
+
+
+def test_update_rescans_directories_modified_within_the_mtime_resolution(tmp_path):
+    create_file(tmp_path / 'training_data' / 'circle_0.jpg')
+    with FileIndex(str(tmp_path / 'index.sqlite')) as file_index:
+        assert file_index.update(str(tmp_path / 'training_data'))['scanned'] == 1
+        assert file_index.update(str(tmp_path / 'training_data'))['scanned'] == 1
+
+
+def test_extensions_holding_a_comma_round_trip(tmp_path):
+    folder = tmp_path / 'training_data'
+    for name in ['circle_0.jpg', 'circle_0.t,xt']:
+        create_file(folder / name)
+    index_path = str(tmp_path / 'index.sqlite')
+    with FileIndex(index_path) as file_index:
+        file_index.update(str(folder))
+        assert read_stem_groups(file_index, folder) == {'circle_0': ['.jpg', '.t,xt']}
+
+    # an index written with the comma separated extensions is rebuilt
+    connection = sqlite3.connect(index_path)
+    with connection:
+        connection.execute('PRAGMA user_version = 0')
+        connection.execute("UPDATE stems SET extensions = '.jpg,.txt'")
+    connection.close()
+    with FileIndex(index_path) as file_index:
+        assert read_stem_groups(file_index, folder) == {}
+        file_index.update(str(folder))
+        assert read_stem_groups(file_index, folder) == {'circle_0': ['.jpg', '.t,xt']}
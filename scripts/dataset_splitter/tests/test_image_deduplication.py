@@ -0,0 +1,59 @@
+import os
+
+import cv2
+import numpy as np
+
+from image_deduplication import deduplicate_images
+
+
+def draw_image(center, color=(0, 215, 255), canvas_color=(0, 100, 0)) -> np.ndarray:
+    image = np.empty((480, 640, 3), np.uint8)
+    image[:] = canvas_color
+    cv2.circle(image, center, 30, color, -1)
+    return image
+
+
+def test_deduplicate_images_finds_identical_and_near_identical_images(tmp_path):
+    paths = {}
+
+    def save(name: str, image: np.ndarray, flags=()):
+        paths[name] = str(tmp_path / name)
+        cv2.imwrite(paths[name], image, list(flags))
+
+    original = draw_image((200, 150))
+    save('a_original.jpg', original)
+    save('b_copy.jpg', original)
+    save('c_reencoded.jpg', original, [cv2.IMWRITE_JPEG_QUALITY, 50])
+    save('d_resized.png', cv2.resize(original, (480, 360), interpolation=cv2.INTER_AREA))
+    # small shapes barely change the difference hash, these are distinct images
+    save('e_moved.jpg', draw_image((420, 300)))
+    save('f_recolored.jpg', draw_image((200, 150), color=(255, 0, 255)))
+
+    names = sorted(paths)
+    # the order the images are given in does not change the image kept
+    images = [paths[name] for name in reversed(names)]
+    duplicate_of = deduplicate_images(images, max_workers=1, cache_path=str(tmp_path / 'hashes.sqlite'))
+    originals = {os.path.basename(image): os.path.basename(images[original])
+                 for image, original in zip(images, duplicate_of)}
+    assert originals == {
+        'a_original.jpg': 'a_original.jpg',
+        'b_copy.jpg': 'a_original.jpg',
+        'c_reencoded.jpg': 'a_original.jpg',
+        'd_resized.png': 'a_original.jpg',
+        'e_moved.jpg': 'e_moved.jpg',
+        'f_recolored.jpg': 'f_recolored.jpg',
+    }
+
+    # the hashes are read back from the cache
+    assert deduplicate_images(images, max_workers=1, cache_path=str(tmp_path / 'hashes.sqlite')) == duplicate_of
+
+
+def test_deduplicate_images_keeps_the_images_that_cannot_be_read(tmp_path):
+    cv2.imwrite(str(tmp_path / 'a_original.jpg'), draw_image((200, 150)))
+    cv2.imwrite(str(tmp_path / 'b_copy.jpg'), draw_image((200, 150)))
+    # a directory cannot be opened by the hashing worker and a missing file cannot be stat'ed
+    os.makedirs(tmp_path / 'c_directory.jpg')
+    images = [str(tmp_path / name) for name in ['a_original.jpg', 'b_copy.jpg', 'c_directory.jpg', 'd_missing.jpg']]
+    for _ in range(2):
+        # the images that could not be read are not cached, they are tried again
+        assert deduplicate_images(images, max_workers=1, cache_path=str(tmp_path / 'hashes.sqlite')) == [0, 0, 2, 3]
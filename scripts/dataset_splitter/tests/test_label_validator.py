@@ -0,0 +1,73 @@
+import json
+import os
+
+from label_validator import validate_dataset
+
+NAMES = ['circle', 'square']
+
+
+def write_sample(folder, stem: str, label: str = None, marks: list = None, image=True):
+    if image:
+        open(os.path.join(folder, f'{stem}.jpg'), 'wb').close()
+    if label is not None:
+        with open(os.path.join(folder, f'{stem}.txt'), 'w') as f:
+            f.write(label)
+    if marks is not None:
+        with open(os.path.join(folder, f'{stem}.json'), 'w') as f:
+            json.dump({'mark': [{'class_idx': object_class, 'rect': {'x': cx - w / 2, 'y': cy - h / 2, 'w': w, 'h': h}}
+                                for object_class, cx, cy, w, h in marks]}, f)
+
+
+def test_validate_dataset_reports_every_check(tmp_path):
+    folder = tmp_path / 'training_data'
+    os.makedirs(folder)
+    names_file = tmp_path / 'shapes.names'
+    names_file.write_text('\n'.join(NAMES) + '\n')
+
+    write_sample(folder, 'valid', '0 0.5 0.5 0.2 0.4\n1 0.25 0.25 0.1 0.1\n',
+                 [(1, 0.25, 0.25, 0.1, 0.1), (0, 0.5, 0.5, 0.2, 0.4)])
+    # a line short of a token next to a line with a token too many holds 5 tokens per line on average
+    write_sample(folder, 'malformed', '0 0.5 0.5 0.2\n0 0.5 0.5 0.2 0.4 0.1\n', [])
+    write_sample(folder, 'out_of_range', '0 0.95 0.5 0.2 0.4\n', [(0, 0.95, 0.5, 0.2, 0.4)])
+    write_sample(folder, 'class_out_of_range', '2 0.5 0.5 0.2 0.4\n', [(2, 0.5, 0.5, 0.2, 0.4)])
+    write_sample(folder, 'mismatch', '0 0.5 0.5 0.2 0.4\n', [(0, 0.5, 0.5, 0.3, 0.4)])
+    write_sample(folder, 'missing_json', '0 0.5 0.5 0.2 0.4\n')
+    write_sample(folder, 'image_without_label')
+    write_sample(folder, 'label_without_image', '0 0.5 0.5 0.2 0.4\n', [(0, 0.5, 0.5, 0.2, 0.4)], image=False)
+
+    report = validate_dataset(str(folder), str(names_file), max_workers=1)
+    counts = {name: check['count'] for name, check in report['checks'].items()}
+    assert counts == {
+        'malformed': 2,
+        'darkmark_unreadable': 0,
+        'out_of_range': 1,
+        'zero_area': 0,
+        'class_out_of_range': 1,
+        'class_not_integer': 0,
+        'label_without_image': 1,
+        'image_without_label': 1,
+        'missing_json': 1,
+        # the malformed file has no label left to compare to its empty json
+        'empty_label': 1,
+        'darkmark_mismatch': 1,
+    }
+    assert report['checks']['malformed']['examples'] == [f'{folder / "malformed"}.txt:1: 0 0.5 0.5 0.2',
+                                                         f'{folder / "malformed"}.txt:2: 0 0.5 0.5 0.2 0.4 0.1']
+    assert report['checks']['darkmark_mismatch']['examples'] == [str(folder / 'mismatch')]
+    assert report['number_of_stems'] == 8
+    assert report['statistics']['number_of_labels'] == 7
+
+
+def test_validate_dataset_reports_coordinates_that_are_not_finite_and_labels_that_are_not_text(tmp_path):
+    write_sample(tmp_path, 'nan', '0 nan 0.5 0.2 0.4\n', [])
+    write_sample(tmp_path, 'inf', '0 0.5 0.5 inf 0.4\n', [])
+    write_sample(tmp_path, 'nan_class', 'nan 0.5 0.5 0.2 0.4\n', [])
+    write_sample(tmp_path, 'binary', image=True)
+    (tmp_path / 'binary.txt').write_bytes(b'\xff\xd8\xff\xe0 0.5 0.5 0.2 0.4\n')
+
+    report = validate_dataset(str(tmp_path), max_workers=1)
+    checks = report['checks']
+    assert checks['out_of_range']['examples'] == [f'{tmp_path / "inf"}.txt', f'{tmp_path / "nan"}.txt']
+    assert checks['class_not_integer']['examples'] == [f'{tmp_path / "nan_class"}.txt']
+    assert checks['malformed']['count'] == 1
+    assert checks['malformed']['examples'][0].startswith(f'{tmp_path / "binary"}.txt:0: ')
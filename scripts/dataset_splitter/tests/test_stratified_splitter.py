@@ -0,0 +1,58 @@
+import os
+
+import numpy as np
+
+from stratified_splitter import write_stratified_list_files
+
+# the number of stems holding a single box of every class, the last count is the stems without boxes
+STEMS_PER_CLASS = [100, 20, 10, 10]
+
+
+def create_training_data(folder):
+    os.makedirs(folder)
+    for object_class, number_of_stems in enumerate(STEMS_PER_CLASS):
+        for i in range(number_of_stems):
+            stem = os.path.join(folder, f'{object_class}_{i}')
+            label = '' if object_class == len(STEMS_PER_CLASS) - 1 else f'{object_class} 0.5 0.5 0.2 0.2\n'
+            for extension, content in [('.jpg', ''), ('.txt', label), ('.json', '{}')]:
+                with open(stem + extension, 'w') as f:
+                    f.write(content)
+    return str(folder)
+
+
+def read_lists(list_paths: dict) -> dict:
+    lists = {}
+    for list_name, list_path in list_paths.items():
+        with open(list_path) as f:
+            lists[list_name] = f.read().splitlines()
+    return lists
+
+
+def test_write_stratified_list_files_cuts_every_class_by_the_split_fractions(tmp_path):
+    training_data = create_training_data(tmp_path / 'training_data')
+    list_paths, class_proportions = write_stratified_list_files(training_data, str(tmp_path / 'lists'), 'shapes',
+                                                                (0.8, 0.1, 0.1), seed=3, max_workers=1)
+    lists = read_lists(list_paths)
+    assert sorted(lists) == ['test', 'train', 'valid']
+    for object_class, number_of_stems in enumerate(STEMS_PER_CLASS):
+        cuts = np.rint(number_of_stems * np.array([0.8, 0.9, 1.0])).astype(int)
+        split_sizes = [sum(os.path.basename(image).startswith(f'{object_class}_') for image in lists[list_name])
+                       for list_name in ['train', 'valid', 'test']]
+        # even the rarest class has boxes in the smallest splits
+        assert split_sizes == np.diff(cuts, prepend=0).tolist(), object_class
+    np.testing.assert_allclose(class_proportions, np.array([[0.8], [0.1], [0.1]]).repeat(3, axis=1))
+
+
+def test_write_stratified_list_files_depends_only_on_the_seed(tmp_path):
+    training_data = create_training_data(tmp_path / 'training_data')
+    lists = [read_lists(write_stratified_list_files(training_data, str(tmp_path / folder), 'shapes', seed=seed,
+                                                    max_workers=1)[0])
+             for folder, seed in [('first', 3), ('second', 3), ('other', 4)]]
+    assert lists[0] == lists[1]
+    assert lists[0] != lists[2]
+    # a fraction of the dataset keeps the share of every class too
+    list_paths, _ = write_stratified_list_files(training_data, str(tmp_path / 'half'), 'shapes', fraction=0.5,
+                                                seed=3, max_workers=1)
+    images = [image for split in read_lists(list_paths).values() for image in split]
+    assert [sum(os.path.basename(image).startswith(f'{object_class}_') for image in images)
+            for object_class in range(len(STEMS_PER_CLASS))] == [50, 10, 5, 5]
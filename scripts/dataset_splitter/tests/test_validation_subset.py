@@ -0,0 +1,47 @@
+import numpy as np
+
+from label_validator import LABEL_DTYPE
+from validation_subset import compare_distributions, select_validation_subset
+
+
+def create_labels(number_of_sources: int, seed: int) -> np.ndarray:
+    # skewed classes, box sizes and aspect ratios with 1 to 3 boxes per source
+    random_state = np.random.RandomState(seed)
+    sources = np.repeat(np.arange(number_of_sources), random_state.randint(1, 4, size=number_of_sources))
+    labels = np.empty(len(sources), LABEL_DTYPE)
+    labels['source'] = sources
+    labels['class'] = random_state.choice(5, size=len(sources), p=[0.6, 0.2, 0.1, 0.07, 0.03])
+    labels['w'] = np.clip(random_state.lognormal(-2.5, 0.6, size=len(sources)), 0.01, 1)
+    labels['h'] = np.clip(labels['w'] * random_state.lognormal(0, 0.4, size=len(sources)), 0.01, 1)
+    labels['cx'] = labels['cy'] = 0.5
+    return labels
+
+
+def test_select_validation_subset_keeps_the_distributions_closer_than_a_random_pick():
+    number_of_sources, target_size = 3000, 150
+    labels = create_labels(number_of_sources, seed=0)
+    selected_sources = select_validation_subset(labels, number_of_sources, target_size, seed=1, number_of_classes=5)
+    assert len(selected_sources) == target_size
+    assert len(np.unique(selected_sources)) == target_size
+    assert np.array_equal(selected_sources,
+                          select_validation_subset(labels, number_of_sources, target_size, seed=1, number_of_classes=5))
+    # the rarest class is kept in the subset
+    selected = np.zeros(number_of_sources, bool)
+    selected[selected_sources] = True
+    assert np.any(selected[labels['source'][labels['class'] == 4]])
+
+    # a single pick of 150 images varies a lot, so the mean distances of several seeds are compared
+    distances = [compare_distributions(labels, select_validation_subset(labels, number_of_sources, target_size, seed,
+                                                                        number_of_classes=5), number_of_sources, 5)
+                 for seed in range(20)]
+    random_state = np.random.RandomState(2)
+    random_distances = [compare_distributions(labels, random_state.choice(number_of_sources, target_size,
+                                                                          replace=False), number_of_sources, 5)
+                        for _ in range(20)]
+    for name in distances[0]:
+        assert (np.mean([distance[name] for distance in distances]) <
+                np.mean([random_distance[name] for random_distance in random_distances])), name
+
+def test_select_validation_subset_takes_every_source_when_the_target_is_larger():
+    labels = create_labels(40, seed=3)
+    assert select_validation_subset(labels, 45, 100, seed=1).tolist() == list(range(45))
@@ -0,0 +1,202 @@
+"""
+Pick a small validation set that keeps the class, box size and aspect ratio distributions of a larger one
+
+Darknet computes the mAP on every image of the valid list, so a large list makes the mAP slow and infrequent.
+Every box gets a stratum from its class, the quantile bin of its area and the quantile bin of its aspect ratio,
+and every image the stratum of the rarest box it holds. The target size is shared between the strata in proportion
+to their number of images, every class getting at least one image when the target allows it, and the images of
+every stratum are drawn at once with numpy, see stratified_splitter.rank_within_strata.
+"""
+import argparse
+import os
+from typing import Dict, List
+
+import numpy as np
+
+from label_validator import read_number_of_classes
+from stratified_splitter import find_valid_stems, parse_stem_labels, rank_within_strata
+
+SIZE_BINS = 4
+ASPECT_RATIO_BINS = 3
+
+
+def read_image_list(list_path: str) -> List[str]:
+    """
+    Read the images of a darknet list file like shapes_neural_network_valid.txt
+    """
+    with open(list_path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def get_quantile_bins(values: np.ndarray, number_of_bins: int) -> np.ndarray:
+    """
+    Get the bin of every value between the quantiles of values, bins hold about the same number of values
+    """
+    edges = np.quantile(values, np.linspace(0, 1, number_of_bins + 1)[1:-1]) if len(values) else []
+    return np.searchsorted(edges, values, side='right')
+
+
+def get_box_strata(labels: np.ndarray, number_of_classes: int, size_bins: int = SIZE_BINS,
+                   aspect_ratio_bins: int = ASPECT_RATIO_BINS) -> np.ndarray:
+    """
+    Get the (class, area bin, aspect ratio bin) stratum of every box as a single index
+    """
+    widths = np.maximum(labels['w'].astype(np.float64), 1e-6)
+    heights = np.maximum(labels['h'].astype(np.float64), 1e-6)
+    size = get_quantile_bins(np.log(widths * heights), size_bins)
+    aspect_ratio = get_quantile_bins(np.log(widths / heights), aspect_ratio_bins)
+    classes = np.clip(labels['class'], 0, number_of_classes - 1).astype(np.int64)
+    return (classes * size_bins + size) * aspect_ratio_bins + aspect_ratio
+
+
+def get_image_strata(box_strata: np.ndarray, sources: np.ndarray, number_of_sources: int,
+                     number_of_strata: int) -> np.ndarray:
+    """
+    Get the stratum of every image, the stratum of its box in the rarest stratum or number_of_strata without boxes
+    """
+    stratum_totals = np.bincount(box_strata, minlength=number_of_strata)
+    # the first box of every source once sorted by (source, total of its stratum) is its rarest box
+    order = np.lexsort((box_strata, stratum_totals[box_strata], sources))
+    sorted_sources = sources[order]
+    first_boxes = order[np.flatnonzero(np.r_[True, sorted_sources[1:] != sorted_sources[:-1]])] if len(order) else order
+    image_strata = np.full(number_of_sources, number_of_strata, np.int64)
+    image_strata[sources[first_boxes]] = box_strata[first_boxes]
+    return image_strata
+
+
+def allocate_quotas(stratum_sizes: np.ndarray, target_size: int, stratum_groups: np.ndarray = None) -> np.ndarray:
+    """
+    Share target_size images between strata in proportion to their size, largest remainders first
+    Every group of strata holding images gets at least one in its largest stratum when target_size is at least the
+    number of such groups, a minimum for every small stratum would skew the subset towards the rare ones
+    :param stratum_groups: The group of every stratum, e.g. its class, defaults to a group per stratum
+    """
+    total = int(stratum_sizes.sum())
+    target_size = min(target_size, total)
+    if stratum_groups is None:
+        stratum_groups = np.arange(len(stratum_sizes))
+    # the first stratum of every group once sorted by (group, decreasing size) is its largest one
+    order = np.lexsort((-stratum_sizes, stratum_groups))
+    sorted_groups = stratum_groups[order]
+    largest_strata = order[np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])]
+    largest_strata = largest_strata[stratum_sizes[largest_strata] > 0]
+    minimums = np.zeros(len(stratum_sizes), np.int64)
+    if target_size >= len(largest_strata):
+        minimums[largest_strata] = 1
+    remaining = target_size - int(minimums.sum())
+    shares = (stratum_sizes - minimums) * remaining / max(total - int(minimums.sum()), 1)
+    quotas = minimums + np.floor(shares).astype(np.int64)
+    # hand out the images lost to the floor to the largest remainders
+    missing = target_size - int(quotas.sum())
+    remainders = np.where(quotas < stratum_sizes, shares - np.floor(shares), -1)
+    quotas[np.argsort(-remainders, kind='stable')[:missing]] += 1
+    return quotas
+
+
+def select_validation_subset(labels: np.ndarray, number_of_sources: int, target_size: int, seed: int = None,
+                             number_of_classes: int = None, size_bins: int = SIZE_BINS,
+                             aspect_ratio_bins: int = ASPECT_RATIO_BINS) -> np.ndarray:
+    """
+    Pick target_size sources keeping the distributions of the boxes of labels
+    :param labels: The label_validator.LABEL_DTYPE boxes of every source
+    :return: the sorted indexes of the sources picked
+    """
+    if number_of_classes is None:
+        number_of_classes = int(labels['class'].max(initial=-1)) + 1
+    number_of_strata = max(number_of_classes, 1) * size_bins * aspect_ratio_bins
+    box_strata = get_box_strata(labels, max(number_of_classes, 1), size_bins, aspect_ratio_bins)
+    image_strata = get_image_strata(box_strata, labels['source'].astype(np.int64), number_of_sources,
+                                    number_of_strata)
+
+    random_state = np.random.RandomState(np.random.MT19937(np.random.SeedSequence(seed)))
+    # every class is a group, the images without boxes fall in a group of their own
+    stratum_groups = np.arange(number_of_strata + 1) // (size_bins * aspect_ratio_bins)
+    quotas = allocate_quotas(np.bincount(image_strata, minlength=number_of_strata + 1), target_size, stratum_groups)
+    order, ranks = rank_within_strata(image_strata, random_state)
+    return np.sort(order[ranks < quotas[image_strata[order]]])
+
+
+def compare_distributions(labels: np.ndarray, selected_sources: np.ndarray, number_of_sources: int,
+                          number_of_classes: int, size_bins: int = SIZE_BINS,
+                          aspect_ratio_bins: int = ASPECT_RATIO_BINS) -> Dict[str, float]:
+    """
+    Get the total variation distance between the class, area and aspect ratio histograms of the boxes of every
+    source and of the boxes of the sources picked, 0 when they are the same and 1 when they do not overlap
+    """
+    selected = np.zeros(number_of_sources, bool)
+    selected[selected_sources] = True
+    box_selected = selected[labels['source']]
+    box_strata = get_box_strata(labels, max(number_of_classes, 1), size_bins, aspect_ratio_bins)
+    histograms = {
+        'class': (np.clip(labels['class'], 0, number_of_classes - 1), number_of_classes),
+        'size': (box_strata // aspect_ratio_bins % size_bins, size_bins),
+        'aspect_ratio': (box_strata % aspect_ratio_bins, aspect_ratio_bins),
+    }
+    distances = {}
+    for name, (bins, number_of_bins) in histograms.items():
+        everything = np.bincount(bins, minlength=number_of_bins) / max(len(bins), 1)
+        subset = np.bincount(bins[box_selected], minlength=number_of_bins) / max(int(box_selected.sum()), 1)
+        distances[name] = float(np.abs(everything - subset).sum() / 2)
+    return distances
+
+
+def write_validation_subset(output_path: str, directory_to_search: str = None, image_list: str = None,
+                            target_size: int = None, time_budget: float = None, seconds_per_image: float = None,
+                            seed: int = None, names_file: str = None, max_workers: int = None,
+                            use_darkmark: bool = False) -> Dict:
+    """
+    Write a darknet valid list of a small subset of the images of directory_to_search or of image_list
+    :param image_list: Pick from the images of this list, e.g. an existing valid list, so the subset stays out of the
+    train list
+    :param target_size: The number of images of the subset
+    :param time_budget: The seconds a mAP calculation may take, used with seconds_per_image when target_size is None
+    :param seconds_per_image: The seconds darknet takes per image of the valid list
+    :return: the number of images picked and the distances of compare_distributions
+    :raises ValueError: if neither target_size nor time_budget and seconds_per_image are given
+    """
+    if target_size is None:
+        if time_budget is None or seconds_per_image is None:
+            raise ValueError('Give either target_size or both time_budget and seconds_per_image')
+        target_size = int(time_budget / seconds_per_image)
+    if image_list is not None:
+        images = read_image_list(image_list)
+        stems = [os.path.splitext(image)[0] for image in images]
+    elif directory_to_search is not None:
+        stems, images = find_valid_stems(directory_to_search)
+    else:
+        raise ValueError('Give either directory_to_search or image_list')
+
+    labels = parse_stem_labels(stems, max_workers, use_darkmark)
+    number_of_classes = None if names_file is None else read_number_of_classes(names_file)
+    if number_of_classes is None:
+        number_of_classes = int(labels['class'].max(initial=-1)) + 1
+    selected_sources = select_validation_subset(labels, len(stems), target_size, seed, number_of_classes)
+    distances = compare_distributions(labels, selected_sources, len(stems), number_of_classes)
+
+    output_folder = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(output_folder, exist_ok=True)
+    with open(output_path, 'w') as f:
+        f.writelines(f'{os.path.abspath(images[source])}\n' for source in selected_sources.tolist())
+    print(f'Wrote {len(selected_sources)} of {len(stems)} images to {output_path}')
+    print('Distance to the full distributions: ' + ', '.join(f'{name} {distance:.3f}'
+                                                           for name, distance in distances.items()))
+    return {'number_of_images': int(len(selected_sources)), 'distances': distances}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Write a small darknet valid list representative of a dataset')
+    parser.add_argument('output_path', help='valid list to write, e.g. shapes_neural_network_valid.txt')
+    source_group = parser.add_mutually_exclusive_group(required=True)
+    source_group.add_argument('--directory', help='folder holding the images and their labels')
+    source_group.add_argument('--image-list', help='darknet list of the images to pick from')
+    parser.add_argument('--target-size', type=int, help='number of images of the subset')
+    parser.add_argument('--time-budget', type=float, help='seconds a mAP calculation may take')
+    parser.add_argument('--seconds-per-image', type=float, help='seconds darknet takes per validation image')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--names', help='.names file of the network')
+    parser.add_argument('--max-workers', type=int, help='processes parsing the labels, defaults to the cpus')
+    parser.add_argument('--darkmark', action='store_true', help='read the boxes of the .json files')
+    args = parser.parse_args()
+
+    write_validation_subset(args.output_path, args.directory, args.image_list, args.target_size, args.time_budget,
+                            args.seconds_per_image, args.seed, args.names, args.max_workers, args.darkmark)
@@ -0,0 +1,294 @@
+"""
+Per stage timers and counters shared by the scripts
+
+Stages are timed with a context manager and counters are plain sums, both are recorded from any thread.
+A run report holds the count, throughput and p50/p99 latency of every stage along with the counters, it can be
+written as json, published to a progress file or served on a local http status endpoint for monit to poll.
+
+The default instrumentation is disabled, timing a stage then only costs a method call returning a shared null
+context manager. Progress messages are printed at most every progress_interval seconds whether it is enabled or not.
+
+instrumentation = enable_instrumentation(progress_file='progress.json', status_port=8765)
+with get_instrumentation().stage('render', items=64):
+    ...
+instrumentation.write_report('report.json')
+"""
+import contextlib
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+_NULL_STAGE = contextlib.nullcontext()
+
+
+class StageStatistics:
+    """
+    Time spent in a stage, latencies are sampled into a bounded reservoir to compute the percentiles
+    """
+
+    def __init__(self, max_latency_samples: int):
+        self.calls = 0
+        self.items = 0
+        self.total_seconds = 0.0
+        self.max_latency_samples = max_latency_samples
+        self.latency_samples: List[float] = []
+        self._latency_samples_seen = 0
+        self._random = random.Random(0)
+
+    def add(self, seconds: float, items: int):
+        self.calls += 1
+        self.items += items
+        self.total_seconds += seconds
+        self._add_latency_sample(seconds)
+
+    def merge(self, snapshot: Dict):
+        self.calls += snapshot['calls']
+        self.items += snapshot['items']
+        self.total_seconds += snapshot['total_seconds']
+        for seconds in snapshot['latency_samples']:
+            self._add_latency_sample(seconds)
+
+    def _add_latency_sample(self, seconds: float):
+        self._latency_samples_seen += 1
+        if len(self.latency_samples) < self.max_latency_samples:
+            self.latency_samples.append(seconds)
+            return
+        sample = self._random.randrange(self._latency_samples_seen)
+        if sample < self.max_latency_samples:
+            self.latency_samples[sample] = seconds
+
+    def snapshot(self) -> Dict:
+        return {'calls': self.calls, 'items': self.items, 'total_seconds': self.total_seconds,
+                'latency_samples': list(self.latency_samples)}
+
+    def summary(self, elapsed_seconds: float) -> Dict:
+        latencies = sorted(self.latency_samples)
+
+        def percentile(fraction: float) -> float:
+            if not latencies:
+                return 0.0
+            return latencies[min(int(len(latencies) * fraction), len(latencies) - 1)] * 1e3
+
+        return {
+            'calls': self.calls,
+            'items': self.items,
+            'total_seconds': self.total_seconds,
+            'p50_ms': percentile(0.5),
+            'p99_ms': percentile(0.99),
+            # items per second of wall clock, stages running on several threads can exceed 1 / latency
+            'items_per_second': self.items / elapsed_seconds if elapsed_seconds > 0 else 0.0,
+        }
+
+
+class _Stage:
+    def __init__(self, instrumentation: 'Instrumentation', name: str, items: int):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.items = items
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.instrumentation.add_time(self.name, time.perf_counter() - self.start, self.items)
+
+
+class Instrumentation:
+    """
+    Timers, counters and progress output of a run
+    """
+
+    def __init__(self, enabled: bool = True, progress_interval: float = 5.0, progress_file: str = None,
+                 status_port: int = None, max_latency_samples: int = 10000):
+        """
+        :param enabled: Record the stages and counters, progress messages are printed either way
+        :param progress_interval: The minimum number of seconds between two progress messages or file updates
+        :param progress_file: A json file rewritten with the report every progress_interval seconds
+        :param status_port: Serve the report on http://127.0.0.1:{status_port}/status
+        :param max_latency_samples: The number of latencies kept per stage to compute the percentiles
+        """
+        self.enabled = enabled
+        self.progress_interval = progress_interval
+        self.progress_file = progress_file
+        self.max_latency_samples = max_latency_samples
+        self.stages: Dict[str, StageStatistics] = {}
+        self.counters: Dict[str, int] = {}
+        self.last_progress_message = ''
+        self._start = time.perf_counter()
+        self._last_progress = float('-inf')
+        self._last_publish = float('-inf')
+        self._lock = threading.Lock()
+        self._status_server = None
+        if enabled and status_port is not None:
+            self._start_status_server(status_port)
+
+    def stage(self, name: str, items: int = 1):
+        """
+        Time the block of a with statement as one call of the stage processing items items
+        """
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name, items)
+
+    def add_time(self, name: str, seconds: float, items: int = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            if name not in self.stages:
+                self.stages[name] = StageStatistics(self.max_latency_samples)
+            self.stages[name].add(seconds, items)
+        self._maybe_publish()
+
+    def count(self, name: str, value: int = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def progress(self, message: str, force: bool = False):
+        """
+        Print message unless a progress message was printed less than progress_interval seconds ago
+        """
+        now = time.perf_counter()
+        if not force and now - self._last_progress < self.progress_interval:
+            return
+        self._last_progress = now
+        self.last_progress_message = message
+        print(message)
+        self._maybe_publish()
+
+    def snapshot(self) -> Dict:
+        """
+        The raw statistics of the stages and the counters, to be merged into the instrumentation of another process
+        """
+        with self._lock:
+            return {'stages': {name: stage.snapshot() for name, stage in self.stages.items()},
+                    'counters': dict(self.counters)}
+
+    def merge(self, snapshot: Dict):
+        with self._lock:
+            for name, stage_snapshot in snapshot['stages'].items():
+                if name not in self.stages:
+                    self.stages[name] = StageStatistics(self.max_latency_samples)
+                self.stages[name].merge(stage_snapshot)
+            for name, value in snapshot['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self) -> Dict:
+        elapsed_seconds = time.perf_counter() - self._start
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'updated': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'elapsed_seconds': elapsed_seconds,
+                'last_progress_message': self.last_progress_message,
+                'stages': {name: stage.summary(elapsed_seconds) for name, stage in self.stages.items()},
+                'counters': dict(self.counters),
+            }
+
+    def write_report(self, path: str):
+        """
+        Write the report as json, the file is replaced at once so a reader never sees half a report
+        """
+        temporary_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temporary_path, 'w') as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+        os.replace(temporary_path, path)
+
+    def close(self):
+        """
+        Publish the final report to the progress file and stop the status endpoint
+        """
+        if self.enabled and self.progress_file is not None:
+            self.write_report(self.progress_file)
+        if self._status_server is not None:
+            self._status_server.shutdown()
+            self._status_server.server_close()
+            self._status_server = None
+
+    def _maybe_publish(self):
+        if self.progress_file is None:
+            return
+        now = time.perf_counter()
+        with self._lock:
+            if now - self._last_publish < self.progress_interval:
+                return
+            self._last_publish = now
+        self.write_report(self.progress_file)
+
+    def _start_status_server(self, status_port: int):
+        instrumentation = self
+
+        class StatusHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/status':
+                    self.send_error(404)
+                    return
+                body = json.dumps(instrumentation.report()).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # monit polls the endpoint, do not print every request
+                pass
+
+        self._status_server = ThreadingHTTPServer(('127.0.0.1', status_port), StatusHandler)
+        threading.Thread(target=self._status_server.serve_forever, daemon=True).start()
+
+
+_instrumentation = Instrumentation(enabled=False)
+
+
+def get_instrumentation() -> Instrumentation:
+    return _instrumentation
+
+
+def set_instrumentation(instrumentation: Instrumentation) -> Instrumentation:
+    """
+    Replace the instrumentation used by the scripts
+    :return: the instrumentation replaced
+    """
+    global _instrumentation
+    previous_instrumentation = _instrumentation
+    _instrumentation = instrumentation
+    return previous_instrumentation
+
+
+@contextlib.contextmanager
+def report_run(report_path: str = None):
+    """
+    Write the report of the run within the with statement to report_path, nothing is done when it is None
+    The instrumentation is enabled within the with statement when it is not already
+    """
+    if report_path is None:
+        yield get_instrumentation()
+        return
+    previous_instrumentation = None
+    if not get_instrumentation().enabled:
+        previous_instrumentation = set_instrumentation(Instrumentation())
+    instrumentation = get_instrumentation()
+    try:
+        yield instrumentation
+    finally:
+        instrumentation.write_report(report_path)
+        print(f'Wrote the run report to {report_path}')
+        if previous_instrumentation is not None:
+            set_instrumentation(previous_instrumentation)
+
+
+def enable_instrumentation(progress_interval: float = 5.0, progress_file: str = None,
+                           status_port: int = None) -> Instrumentation:
+    """
+    Replace the instrumentation used by the scripts with an enabled one, see Instrumentation
+    """
+    instrumentation = Instrumentation(True, progress_interval, progress_file, status_port)
+    set_instrumentation(instrumentation)
+    return instrumentation